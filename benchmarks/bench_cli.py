@@ -0,0 +1,193 @@
+"""End to end throughput of the cli on a mixed corpus at several numbers of workers, compared with a baseline
+
+Usage: python -m benchmarks.bench_cli --num_workers 1 2 4 --save_baseline cli_baseline.json
+       python -m benchmarks.bench_cli --num_workers 1 2 4 --baseline cli_baseline.json --tolerance 0.1
+
+Exits with 1 when the throughput of a configuration regressed beyond the tolerance.
+Throughput is absolute, so the comparison is skipped with a warning when the corpus,
+options, machine or CPU count differ from the baseline's.
+benchmarks/baselines/cli_baseline.json is a reference run on a small corpus
+(--num_files 40 --num_workers 1 2) from a single CPU x86_64 machine.
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.bench_executors import load_records
+from benchmarks.corpus import generate_mixed_corpus, get_manifest_path
+from dd_pyparse.core.utils.executors import EXECUTOR_REGISTRY
+from dd_pyparse.utils.logging import logger
+
+
+def get_dir_size(path: Path) -> int:
+    return sum(x.stat().st_size for x in path.rglob("*") if x.is_file()) if path.exists() else 0
+
+
+def run_cli(in_dir: Path, num_workers: int, executor: str = "process", extra_args: list[str] = None) -> dict:
+    """Run the cli in a subprocess and measure its wall time, CPU time, peak RSS and output"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir, children_dir, log_path = Path(tmp_dir) / "out", Path(tmp_dir) / "children", Path(tmp_dir) / "cli.log"
+        cmd = [
+            sys.executable,
+            "-m",
+            "dd_pyparse.interfaces._cli",
+            *("--in_dir", str(in_dir), "--out_dir", str(out_dir), "--children_dir", str(children_dir)),
+            *("--dataset", "benchmark", "--num_workers", str(num_workers), "--executor", executor, "--progress", "none"),
+            *(extra_args or []),
+        ]
+        with open(log_path, "w") as log:
+            start = time.perf_counter()
+            process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+            # the usage of the cli includes its workers once they are reaped, the max RSS is that of the largest process
+            _, status, usage = os.wait4(process.pid, 0)
+            wall = time.perf_counter() - start
+            process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            tail = "".join(log_path.read_text().splitlines(keepends=True)[-20:])
+            raise RuntimeError(f"cli exited with {process.returncode}:\n{tail}")
+
+        num_records = len(load_records(out_dir))
+        output_bytes, children_bytes = get_dir_size(out_dir), get_dir_size(children_dir)
+
+    input_files = [path for path in in_dir.rglob("*") if path.is_file()]
+    input_bytes = sum(path.stat().st_size for path in input_files)
+    cpu = usage.ru_utime + usage.ru_stime
+    return {
+        "executor": executor,
+        "num_workers": num_workers,
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "cpu_utilization": cpu / wall,
+        "num_input_files": len(input_files),
+        "num_records": num_records,
+        # records include children so fan-out counts towards throughput
+        "files_per_second": num_records / wall,
+        "input_files_per_second": len(input_files) / wall,
+        "mb_per_second": input_bytes / 1024**2 / wall,
+        "peak_rss": usage.ru_maxrss * 1024,
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "children_bytes": children_bytes,
+        "write_amplification": (output_bytes + children_bytes) / input_bytes if input_bytes else None,
+    }
+
+
+def bench_cli(in_dir: Path, num_workers: list[int], executor: str = "process", repeat: int = 1, extra_args: list[str] = None) -> list[dict]:
+    """Run every configuration `repeat` times and keep the run with the median wall time"""
+    results = []
+    for n in num_workers:
+        runs = sorted(
+            (run_cli(in_dir, num_workers=n, executor=executor, extra_args=extra_args) for _ in range(repeat)),
+            key=lambda x: x["wall_seconds"],
+        )
+        result = runs[len(runs) // 2] | {"num_runs": repeat}
+        if repeat > 1:
+            result["wall_seconds_stdev"] = statistics.stdev(x["wall_seconds"] for x in runs)
+        logger.info(
+            f"{executor} x{n}: {result['wall_seconds']:.1f}s wall, {result['cpu_seconds']:.1f}s CPU, "
+            f"{result['files_per_second']:.1f} files/s, peak RSS {result['peak_rss'] / 1024**2:.0f} MB"
+        )
+        results.append(result)
+    return results
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float = 0.1) -> list[dict]:
+    """Compare the throughput of each configuration with the baseline, a regression is a drop of more than `tolerance`"""
+    previous = {(x["executor"], x["num_workers"]): x for x in baseline["results"]}
+    out = []
+    for result in results:
+        before = previous.get((result["executor"], result["num_workers"]))
+        if before is None:
+            continue
+        ratio = result["files_per_second"] / before["files_per_second"]
+        out.append(
+            {
+                "executor": result["executor"],
+                "num_workers": result["num_workers"],
+                "files_per_second": result["files_per_second"],
+                "baseline_files_per_second": before["files_per_second"],
+                "throughput_ratio": ratio,
+                "peak_rss_ratio": result["peak_rss"] / before["peak_rss"] if before["peak_rss"] else None,
+                "regressed": ratio < 1 - tolerance,
+            }
+        )
+    return out
+
+
+def get_mismatches(out: dict, baseline: dict) -> list[str]:
+    """What differs between a run and the baseline that makes their throughputs incomparable"""
+    return [
+        f"{key} {baseline.get(key)!r} != {out[key]!r}"
+        for key in ["corpus", "extra_args", "machine", "cpu_count"]
+        if baseline.get(key) != out[key]
+    ]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the cli end to end")
+    parser.add_argument("--corpus_dir", type=Path, default=None, help="Input directory (a mixed corpus is generated otherwise)")
+    parser.add_argument("--num_files", type=int, default=200, help="Number of files of a generated corpus")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[2_000, 20_000, 200_000], help="Approximate file sizes of a generated corpus"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of a generated corpus")
+    parser.add_argument("--num_workers", type=int, nargs="+", default=[1, 2, 4], help="Numbers of workers to run with")
+    parser.add_argument("--executor", type=str, default="process", choices=list(EXECUTOR_REGISTRY), help="Backend running the workers")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per configuration (the median is kept)")
+    parser.add_argument("--baseline", type=Path, default=None, help="Results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative drop of throughput from the baseline")
+    parser.add_argument("--save_baseline", type=Path, default=None, help="Save the results as the new baseline")
+    parser.add_argument("--out_file", type=Path, default=None, help="Where to save the results as json")
+    args, extra_args = parser.parse_known_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = args.corpus_dir
+        if corpus_dir is None:
+            corpus_dir = Path(tmp_dir) / "corpus"
+            generate_mixed_corpus(corpus_dir, sizes=args.sizes, num_files=args.num_files, seed=args.seed)
+        manifest_path = get_manifest_path(corpus_dir)
+        corpus = {k: v for k, v in json.loads(manifest_path.read_text()).items() if k != "files"} if manifest_path.exists() else None
+        results = bench_cli(corpus_dir, num_workers=args.num_workers, executor=args.executor, repeat=args.repeat, extra_args=extra_args)
+
+    out = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus,
+        "extra_args": extra_args,
+        "results": results,
+    }
+    regressed = False
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        mismatches = get_mismatches(out, baseline)
+        if mismatches:
+            logger.warning(f"Not comparing with {args.baseline}, the run differs from it: {', '.join(mismatches)}")
+        out["comparison"] = [] if mismatches else compare(results, baseline, tolerance=args.tolerance)
+        for x in out["comparison"]:
+            if x["regressed"]:
+                regressed = True
+                logger.error(f"Throughput of {x['executor']} x{x['num_workers']} regressed to {x['throughput_ratio']:.0%} of the baseline")
+
+    text = json.dumps(out, indent=4)
+    for path in [args.out_file, args.save_baseline]:
+        if path is not None:
+            path.write_text(text)
+    print(text)
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compare the executor backends of the CLI processor on the same corpus
+
+Usage: python -m benchmarks.bench_executors --in_dir <corpus> --num_workers 4
+"""
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from dd_pyparse.core.utils.executors import EXECUTOR_REGISTRY
+from dd_pyparse.interfaces._cli import process
+from dd_pyparse.utils.logging import logger
+
+# fields that legitimately differ between two runs over the same corpus
+VOLATILE_FIELDS = {"id", "parent_id", "date_ingested", "absolute_path"}
+
+
+def load_records(out_dir: Path) -> list[dict]:
+    """Load the records written by the processor (json and batched jsonl)"""
+    records = []
+    for path in out_dir.iterdir():
+        if path.suffix == ".json":
+            records.append(json.loads(path.read_text()))
+        elif path.suffix == ".jsonl":
+            records.extend(json.loads(line) for line in path.read_text().splitlines() if line)
+    return records
+
+
+def normalize(records: list[dict]) -> list[str]:
+    """Make records comparable across runs"""
+    return sorted(json.dumps({k: v for k, v in record.items() if k not in VOLATILE_FIELDS}, sort_keys=True) for record in records)
+
+
+def run_backend(in_dir: Path, executor: str, num_workers: int, **kwargs) -> tuple[dict, list[str]]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = Path(tmp_dir) / "out"
+        children_dir = Path(tmp_dir) / "children"
+        start = time.perf_counter()
+        process(
+            in_dir=in_dir,
+            children_dir=children_dir,
+            out_dir=out_dir,
+            dataset="benchmark",
+            num_workers=num_workers,
+            extract_children=True,
+            executor=executor,
+            **kwargs,
+        )
+        elapsed = time.perf_counter() - start
+        records = load_records(out_dir)
+
+    num_files = sum(1 for path in in_dir.rglob("*") if path.is_file())
+    num_bytes = sum(path.stat().st_size for path in in_dir.rglob("*") if path.is_file())
+    result = {
+        "executor": executor,
+        "num_workers": num_workers,
+        "seconds": elapsed,
+        "files_per_second": num_files / elapsed,
+        "mb_per_second": num_bytes / 1024**2 / elapsed,
+        "num_records": len(records),
+    }
+    return result, normalize(records)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare executor backends")
+    parser.add_argument("--in_dir", type=Path, required=True, help="Corpus directory")
+    parser.add_argument("--num_workers", type=int, default=4, help="Number of workers")
+    parser.add_argument("--executors", type=str, nargs="+", default=["process", "thread"], choices=list(EXECUTOR_REGISTRY))
+    parser.add_argument("--batch_size", type=int, default=1, help="Max number of small files per task")
+    parser.add_argument("--out_file", type=Path, default=None, help="Where to save the results as json")
+    args = parser.parse_args()
+
+    results = []
+    reference = None
+    for executor in args.executors:
+        result, records = run_backend(args.in_dir, executor=executor, num_workers=args.num_workers, batch_size=args.batch_size)
+        reference = records if reference is None else reference
+        result["identical_output"] = records == reference
+        logger.info(f"{result=}")
+        results.append(result)
+
+    out = json.dumps(results, indent=4)
+    if args.out_file is not None:
+        args.out_file.write_text(out)
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Microbenchmark every parser of the registry on a synthetic corpus
+
+Usage: python -m benchmarks.bench_parsers --sizes 10000 100000 1000000 --repeat 5 --out_file parsers.json
+       python -m benchmarks.bench_parsers --corpus_dir <corpus> --baseline parsers.json
+       python -m benchmarks.bench_parsers --memory --sizes 100000 1000000 10000000 --out_file memory.json
+"""
+import gc
+import json
+import math
+import platform
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.corpus import GENERATORS, generate_corpus, get_manifest_path, load_corpus
+from dd_pyparse.core.parsers import PARSER_REGISTRY
+from dd_pyparse.core.parsers.base import FileParser, FileStreamer
+from dd_pyparse.core.utils.costs import fit_line
+from dd_pyparse.core.utils.memory import get_peak_rss, get_rss, reset_peak_rss
+from dd_pyparse.schemas.enums import FileType
+from dd_pyparse.utils.logging import logger
+
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+# exponent of peak memory over input size above which a parser is flagged
+SUPERLINEAR_EXPONENT = 1.2
+
+
+def invoke(parser: type[FileParser | FileStreamer], path: Path, extract_children: bool, out_dir: Path) -> float:
+    """Run a parser on a file like the processor does and return the seconds it took"""
+    start = time.perf_counter()
+    if issubclass(parser, FileParser):
+        parser.parse(file=path, extract_children=extract_children, out_dir=out_dir)
+    else:
+        for _ in parser.stream(file_path=path, extract_children=extract_children, out_dir=out_dir):
+            pass
+    return time.perf_counter() - start
+
+
+def summarize(latencies: list[float], num_bytes: int) -> dict:
+    """Throughput and latency percentiles of the runs of a parser"""
+    seconds = sum(latencies)
+    # the inclusive method stays within the observed range with few runs
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "num_runs": len(latencies),
+        "seconds": seconds,
+        "files_per_second": len(latencies) / seconds if seconds else None,
+        "mb_per_second": num_bytes / 1024**2 / seconds if seconds else None,
+        "mean": statistics.fmean(latencies),
+        **{f"p{round(q * 100)}": cuts[round(q * 100) - 1] for q in QUANTILES},
+        "max": max(latencies),
+    }
+
+
+def bench_parser(
+    file_type: FileType, files: list[dict], corpus_dir: Path, repeat: int = 3, warmup: int = 1, extract_children: bool = True
+) -> dict:
+    """Time the parser of a file type on each of its files, `repeat` times after `warmup` untimed runs"""
+    parser, _ = PARSER_REGISTRY[file_type]
+    result = {"file_type": str(file_type), "parser": parser.__name__, "num_files": len(files), "errors": 0}
+    by_size: dict[int, tuple[list[float], int]] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for file in files:
+            path = corpus_dir / file["path"]
+            try:
+                for _ in range(warmup):
+                    invoke(parser, path, extract_children=extract_children, out_dir=Path(tmp_dir))
+                latencies = [invoke(parser, path, extract_children=extract_children, out_dir=Path(tmp_dir)) for _ in range(repeat)]
+            except Exception as e:
+                logger.warning(f"{parser.__name__} failed on {path}: {e!r}")
+                result["errors"] += 1
+                result.setdefault("error", repr(e))
+                continue
+            runs, num_bytes = by_size.get(file["target_size"], ([], 0))
+            by_size[file["target_size"]] = (runs + latencies, num_bytes + file["file_size"] * repeat)
+
+    if not by_size:
+        return result
+    latencies = [x for runs, _ in by_size.values() for x in runs]
+    result |= summarize(latencies, sum(num_bytes for _, num_bytes in by_size.values()))
+    result["by_size"] = {str(size): summarize(runs, num_bytes) for size, (runs, num_bytes) in sorted(by_size.items())}
+    return result
+
+
+class RssSampler:
+    """Sample the RSS of this process from a background thread and keep the max"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = get_rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss() or 0)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss() or 0)
+
+
+def measure_memory(parser: type[FileParser | FileStreamer], path: Path, extract_children: bool, out_dir: Path) -> dict:
+    """Peak and retained Python allocations (tracemalloc) and peak RSS growth of a parser call
+
+    Note: tracemalloc only sees allocations made through Python's allocators
+    (numpy included), RSS also covers native libraries. The RSS peak comes from
+    VmHWM when it can be reset, otherwise from sampling. Retained is what is
+    still allocated once the result is dropped and garbage collected.
+    """
+    gc.collect()
+    rss_before = get_rss() or 0
+    exact_rss = reset_peak_rss()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    with RssSampler() as sampler:
+        invoke(parser, path, extract_children=extract_children, out_dir=out_dir)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    peak_rss = max(sampler.peak, (get_peak_rss() or 0) if exact_rss else 0)
+    return {"peak": peak, "retained": retained, "peak_rss": max(peak_rss - rss_before, 0)}
+
+
+def summarize_memory(measurements: list[dict]) -> dict:
+    """Medians of the measurements of files of about the same size and their ratio to the input size"""
+    out = {"num_files": len(measurements)}
+    for key in ["file_size", "peak", "retained", "peak_rss"]:
+        out[key] = statistics.median(x[key] for x in measurements)
+    out["peak_ratio"] = out["peak"] / out["file_size"] if out["file_size"] else None
+    out["peak_rss_ratio"] = out["peak_rss"] / out["file_size"] if out["file_size"] else None
+    return out
+
+
+def bench_memory(file_type: FileType, files: list[dict], corpus_dir: Path, extract_children: bool = True, **kwargs) -> dict:
+    """Measure the memory of the parser of a file type on each of its files, after an untimed warmup on the first
+
+    Note: the scaling exponent is the slope of log peak over log input size, so
+    about 1 when memory grows linearly with the input and over 1 when it grows faster.
+    """
+    parser, _ = PARSER_REGISTRY[file_type]
+    result = {"file_type": str(file_type), "parser": parser.__name__, "num_files": len(files), "errors": 0}
+    by_size: dict[int, list[dict]] = {}
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i, file in enumerate(files):
+                path = corpus_dir / file["path"]
+                try:
+                    if i == 0:
+                        # imports and caches of the first call aren't retained by the next ones
+                        invoke(parser, path, extract_children=extract_children, out_dir=Path(tmp_dir))
+                    measurement = measure_memory(parser, path, extract_children=extract_children, out_dir=Path(tmp_dir))
+                except Exception as e:
+                    logger.warning(f"{parser.__name__} failed on {path}: {e!r}")
+                    result["errors"] += 1
+                    result.setdefault("error", repr(e))
+                    continue
+                by_size.setdefault(file["target_size"], []).append(measurement | {"file_size": file["file_size"]})
+    finally:
+        tracemalloc.stop()
+
+    if not by_size:
+        return result
+    measurements = [x for xs in by_size.values() for x in xs]
+    result |= {
+        "max_peak": max(x["peak"] for x in measurements),
+        "max_retained": max(x["retained"] for x in measurements),
+        "max_peak_rss": max(x["peak_rss"] for x in measurements),
+    }
+    points = [(math.log(x["file_size"]), math.log(x["peak"])) for x in measurements if x["file_size"] > 0 and x["peak"] > 0]
+    if len({x for x, _ in points}) > 1:
+        _, exponent = fit_line(*zip(*points))
+        result["scaling_exponent"] = exponent
+        result["superlinear"] = exponent > SUPERLINEAR_EXPONENT
+    result["by_size"] = {str(size): summarize_memory(xs) for size, xs in sorted(by_size.items())}
+    return result
+
+
+def bench_parsers(corpus_dir: Path, file_types: list[FileType] = None, memory: bool = False, **kwargs) -> list[dict]:
+    """Benchmark (the time or memory of) the parser of every file type of the registry, noting those without files in the corpus"""
+    files = load_corpus(corpus_dir)
+    results = []
+    for file_type in file_types or list(PARSER_REGISTRY):
+        parser, _ = PARSER_REGISTRY[file_type]
+        of_type = [file for file in files if file["file_type"] == file_type]
+        if not of_type:
+            reason = "no files in the corpus" if file_type in GENERATORS else "no generator for this file type"
+            results.append({"file_type": str(file_type), "parser": parser.__name__, "skipped": reason})
+            continue
+        if memory:
+            result = bench_memory(file_type, of_type, corpus_dir, **kwargs)
+            logger.info(
+                f"{result['parser']} ({file_type}): peak {(result.get('max_peak') or 0) / 1024**2:.1f} MB, "
+                f"retained {(result.get('max_retained') or 0) / 1024**2:.1f} MB, scaling exponent {result.get('scaling_exponent')}"
+            )
+        else:
+            result = bench_parser(file_type, of_type, corpus_dir, **kwargs)
+            logger.info(
+                f"{result['parser']} ({file_type}): {result.get('files_per_second') or 0:.1f} files/s, p50 {result.get('p50') or 0:.4f}s"
+            )
+        results.append(result)
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict]) -> list[dict]:
+    """Ratio of the throughput and median latency (or peak memory) to a previous run, per file type"""
+    previous = {x["file_type"]: x for x in baseline}
+    out = []
+    for result in results:
+        before = previous.get(result["file_type"], {})
+        if "files_per_second" in result and "files_per_second" in before:
+            ratios = {
+                "throughput_ratio": result["files_per_second"] / before["files_per_second"],
+                "p50_ratio": result["p50"] / before["p50"] if before["p50"] else None,
+            }
+        elif "max_peak" in result and "max_peak" in before:
+            ratios = {
+                "peak_ratio": result["max_peak"] / before["max_peak"] if before["max_peak"] else None,
+                "retained_ratio": result["max_retained"] / before["max_retained"] if before["max_retained"] else None,
+            }
+        else:
+            continue
+        out.append({"file_type": result["file_type"], "parser": result["parser"], **ratios})
+    return out
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark every parser on a synthetic corpus")
+    parser.add_argument("--corpus_dir", type=Path, default=None, help="Corpus generated by benchmarks.corpus (one is generated otherwise)")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Approximate file sizes of a generated corpus"
+    )
+    parser.add_argument("--num_files", type=int, default=3, help="Number of files per file type and size of a generated corpus")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of a generated corpus")
+    parser.add_argument(
+        "--file_types", type=FileType, nargs="+", default=None, choices=list(PARSER_REGISTRY), help="File types to benchmark"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per file")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per file")
+    parser.add_argument(
+        "--extract_children", action=argparse.BooleanOptionalAction, default=True, help="Extract children to a temporary directory"
+    )
+    parser.add_argument("--memory", action="store_true", help="Measure peak and retained memory instead of time")
+    parser.add_argument("--baseline", type=Path, default=None, help="Previous results to compare against")
+    parser.add_argument("--out_file", type=Path, default=None, help="Where to save the results as json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = args.corpus_dir
+        if corpus_dir is None:
+            corpus_dir = Path(tmp_dir) / "corpus"
+            file_types = [file_type for file_type in args.file_types if file_type in GENERATORS] if args.file_types else None
+            generate_corpus(corpus_dir, sizes=args.sizes, num_files=args.num_files, seed=args.seed, file_types=file_types)
+        corpus = json.loads(get_manifest_path(corpus_dir).read_text())
+        results = bench_parsers(
+            corpus_dir,
+            file_types=args.file_types,
+            memory=args.memory,
+            repeat=args.repeat,
+            warmup=args.warmup,
+            extract_children=args.extract_children,
+        )
+
+    out = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "corpus": {k: v for k, v in corpus.items() if k != "files"},
+        "mode": "memory" if args.memory else "time",
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "results": results,
+    }
+    if args.baseline is not None:
+        out["comparison"] = compare(results, json.loads(args.baseline.read_text())["results"])
+
+    out = json.dumps(out, indent=4)
+    if args.out_file is not None:
+        args.out_file.write_text(out)
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
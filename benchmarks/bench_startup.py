@@ -0,0 +1,231 @@
+"""Startup costs: importing the package (per module like `-X importtime`), spawning a processor worker and the API becoming ready
+
+Usage: python -m benchmarks.bench_startup --repeat 5 --out_file startup.json
+"""
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+# dd_pyparse is imported lazily, this module is imported again by spawned workers and must not skew them
+from loguru import logger
+
+MODULES = ["dd_pyparse.core.parsers", "dd_pyparse.interfaces._cli", "dd_pyparse.interfaces._fastapi"]
+APP = "dd_pyparse.interfaces._fastapi:app"
+
+
+def run_measured(cmd: list[str]) -> tuple[float, int, str]:
+    """Run a command and return its wall time, peak RSS in bytes and stderr"""
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=err)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        err.seek(0)
+        stderr = err.read().decode(errors="replace")
+    if process.returncode:
+        raise RuntimeError(f"{cmd} exited with {process.returncode}:\n{stderr[-2000:]}")
+    return wall, usage.ru_maxrss * 1024, stderr
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """Self and cumulative microseconds of every module from the output of `-X importtime`
+
+    Note: a module imported again while its package is still initializing gets a
+    second (short) line, so self times are summed and the longest cumulative kept.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        previous_self, previous_cumulative = modules.get(name.strip(), (0, 0))
+        modules[name.strip()] = (previous_self + int(self_us), max(previous_cumulative, int(cumulative_us)))
+    return modules
+
+
+def bench_import(module: str, repeat: int = 5, top: int = 25) -> dict:
+    """Wall time, peak RSS and per module import times (medians over `repeat` fresh interpreters) of importing a module
+
+    Note: the interpreter alone is measured as well so its startup can be told
+    apart, and a first untimed run compiles the bytecode.
+    """
+    run_measured([sys.executable, "-c", f"import {module}"])
+    bare = [run_measured([sys.executable, "-c", "pass"])[:2] for _ in range(repeat)]
+    runs = [run_measured([sys.executable, "-X", "importtime", "-c", f"import {module}"]) for _ in range(repeat)]
+
+    timings = [parse_importtime(stderr) for _, _, stderr in runs]
+    names = set().union(*timings)
+    by_module = {
+        name: (
+            statistics.median(x.get(name, (0, 0))[0] for x in timings),
+            statistics.median(x.get(name, (0, 0))[1] for x in timings),
+        )
+        for name in names
+    }
+    # top level packages, e.g. the cost of cv2 or pandas with all their submodules
+    by_package = {}
+    for name, (self_us, _) in by_module.items():
+        package = name.split(".")[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+
+    return {
+        "module": module,
+        "num_runs": repeat,
+        "wall_seconds": statistics.median(wall for wall, _, _ in runs),
+        "interpreter_seconds": statistics.median(wall for wall, _ in bare),
+        "import_seconds": by_module.get(module, (0, 0))[1] / 1e6,
+        "peak_rss": statistics.median(rss for _, rss, _ in runs),
+        "interpreter_rss": statistics.median(rss for _, rss in bare),
+        "num_modules": len(by_module),
+        "slowest_modules": [
+            {"module": name, "self_seconds": self_us / 1e6, "cumulative_seconds": cumulative_us / 1e6}
+            for name, (self_us, cumulative_us) in sorted(by_module.items(), key=lambda x: -x[1][0])[:top]
+        ],
+        "by_package": [
+            {"package": package, "self_seconds": self_us / 1e6}
+            for package, self_us in sorted(by_package.items(), key=lambda x: -x[1])[:top]
+        ],
+    }
+
+
+def _report_ready(processor, ready_at, rss):
+    # runs in the worker once the processor has been shipped to it
+    with open("/proc/self/statm") as fb:
+        rss.value = int(fb.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    ready_at.value = time.time()
+
+
+def bench_worker_spawn(start_method: str, repeat: int = 5) -> dict:
+    """Seconds until a processor worker runs (the processor shipped to it) and its RSS by then
+
+    Note: with `spawn` and `forkserver` the worker imports the package when the
+    processor is unpickled, with `fork` it inherits the modules of the dispatcher.
+    """
+    from dd_pyparse.interfaces._cli import Processor
+
+    context = multiprocessing.get_context(start_method)
+    latencies, rss_values = [], []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        multiprocessing.set_start_method(start_method, force=True)
+        # the processor's queues belong to the context its workers are started with
+        processor = Processor(in_dir=Path(tmp_dir), children_dir=Path(tmp_dir), out_dir=Path(tmp_dir), dataset="benchmark", num_workers=1)
+        for _ in range(repeat):
+            ready_at, rss = context.Value("d", 0.0), context.Value("q", 0)
+            start = time.time()
+            worker = processor.executor.spawn(partial(_report_ready, processor, ready_at, rss))
+            worker.join()
+            if worker.exitcode:
+                raise RuntimeError(f"Worker exited with {worker.exitcode}")
+            latencies.append(ready_at.value - start)
+            rss_values.append(rss.value)
+    return {
+        "start_method": start_method,
+        "num_runs": repeat,
+        "ready_seconds": statistics.median(latencies),
+        "max_ready_seconds": max(latencies),
+        "worker_rss": statistics.median(rss_values),
+    }
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_process_rss(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as fb:
+            for line in fb:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def bench_api(repeat: int = 3, timeout: float = 300.0, poll_interval: float = 0.01) -> dict:
+    """Seconds from starting the API server until `/health` answers, and its RSS by then"""
+    latencies, rss_values = [], []
+    for _ in range(repeat):
+        port = get_free_port()
+        cmd = [sys.executable, "-m", "uvicorn", APP, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+        start = time.perf_counter()
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"API server exited with {process.returncode}")
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"API server not ready after {timeout} seconds")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(poll_interval)
+            latencies.append(time.perf_counter() - start)
+            rss_values.append(get_process_rss(process.pid))
+        finally:
+            process.terminate()
+            process.wait()
+    return {
+        "num_runs": repeat,
+        "ready_seconds": statistics.median(latencies),
+        "max_ready_seconds": max(latencies),
+        "rss": statistics.median(x for x in rss_values if x is not None) if any(rss_values) else None,
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark import, worker spawn and API startup")
+    parser.add_argument("--modules", type=str, nargs="+", default=MODULES, help="Modules to time the import of")
+    parser.add_argument("--start_methods", type=str, nargs="+", default=["fork", "spawn"], choices=multiprocessing.get_all_start_methods())
+    parser.add_argument("--api", action=argparse.BooleanOptionalAction, default=True, help="Time the API becoming ready")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each measurement (medians are reported)")
+    parser.add_argument("--top", type=int, default=25, help="Number of slowest modules and packages to report")
+    parser.add_argument("--out_file", type=Path, default=None, help="Where to save the results as json")
+    args = parser.parse_args()
+
+    out = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "imports": [],
+        "worker_spawn": [],
+        "api": None,
+    }
+    for module in args.modules:
+        result = bench_import(module, repeat=args.repeat, top=args.top)
+        logger.info(f"import {module}: {result['import_seconds']:.2f}s, peak RSS {result['peak_rss'] / 1024**2:.0f} MB")
+        out["imports"].append(result)
+    for start_method in args.start_methods:
+        result = bench_worker_spawn(start_method, repeat=args.repeat)
+        logger.info(f"{start_method} worker: ready in {result['ready_seconds']:.2f}s, RSS {result['worker_rss'] / 1024**2:.0f} MB")
+        out["worker_spawn"].append(result)
+    if args.api:
+        out["api"] = bench_api(repeat=args.repeat)
+        logger.info(f"API: ready in {out['api']['ready_seconds']:.2f}s")
+
+    text = json.dumps(out, indent=4)
+    if args.out_file is not None:
+        args.out_file.write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""Generate a deterministic synthetic corpus with a few files of controlled sizes per file type
+
+Usage: python -m benchmarks.corpus --out_dir <corpus> --sizes 10000 100000 1000000 --num_files 3
+"""
+import gzip
+import io
+import json
+import os
+import random
+import tarfile
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+from pathlib import Path
+from typing import Callable
+
+from dd_pyparse.schemas.enums import FileType
+from dd_pyparse.utils.logging import logger
+
+# fixed timestamps so the same seed gives the same bytes
+EPOCH = datetime(2020, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna "
+    "aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis aute "
+    "irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non "
+    "proident sunt culpa qui officia deserunt mollit anim id est laborum"
+).split()
+
+
+def get_manifest_path(corpus_dir: Path) -> Path:
+    """The manifest of a corpus is kept next to it so parsing the corpus directory doesn't parse it too"""
+    return corpus_dir.with_name(f"{corpus_dir.name}.json")
+
+
+def sentence(rng: random.Random, num_words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(num_words)).capitalize() + "."
+
+
+def paragraphs(rng: random.Random, size: int, length: int = 400) -> list[str]:
+    """Paragraphs of about `length` characters adding up to about `size` characters"""
+    out, total = [], 0
+    while total < size:
+        paragraph = " ".join(sentence(rng) for _ in range(max(length // 80, 1)))
+        out.append(paragraph)
+        total += len(paragraph) + 1
+    return out
+
+
+def rows(rng: random.Random, size: int) -> list[list]:
+    """Table rows (header included) adding up to about `size` characters as csv"""
+    out, total = [["id", "name", "amount", "date", "comment"]], 0
+    while total < size:
+        row = [
+            len(out),
+            rng.choice(WORDS).title(),
+            round(rng.uniform(0, 10_000), 2),
+            f"2020-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            sentence(rng, 6),
+        ]
+        out.append(row)
+        total += sum(len(str(x)) for x in row) + len(row)
+    return out
+
+
+def make_txt(rng: random.Random, size: int) -> bytes:
+    return "\n\n".join(paragraphs(rng, size)).encode()
+
+
+def make_log(rng: random.Random, size: int) -> bytes:
+    lines, total = [], 0
+    while total < size:
+        level = rng.choice(["INFO", "DEBUG", "WARNING", "ERROR"])
+        line = f"{EPOCH:%Y-%m-%d %H:%M:%S}.{len(lines):06d} {level} worker-{rng.randint(0, 7)} {sentence(rng, 8)}"
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines).encode()
+
+
+def make_code(rng: random.Random, size: int) -> bytes:
+    functions, total = [], 0
+    while total < size:
+        name = "_".join(rng.choice(WORDS) for _ in range(2))
+        function = f'def {name}_{len(functions)}(x: int) -> int:\n    """{sentence(rng, 8)}"""\n    return x * {rng.randint(2, 100)}\n'
+        functions.append(function)
+        total += len(function) + 2
+    return "\n\n".join(functions).encode()
+
+
+def make_csv(rng: random.Random, size: int, delimiter: str = ",") -> bytes:
+    return "\n".join(delimiter.join(str(x) for x in row) for row in rows(rng, size)).encode()
+
+
+def make_tsv(rng: random.Random, size: int) -> bytes:
+    return make_csv(rng, size, delimiter="\t")
+
+
+def make_json(rng: random.Random, size: int) -> bytes:
+    header, *records = rows(rng, size)
+    return json.dumps([dict(zip(header, row)) for row in records], indent=2).encode()
+
+
+def make_xml(rng: random.Random, size: int) -> bytes:
+    header, *records = rows(rng, size)
+    items = "".join("<record>" + "".join(f"<{k}>{v}</{k}>" for k, v in zip(header, row)) + "</record>\n" for row in records)
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<records>\n{items}</records>\n'.encode()
+
+
+def make_html(rng: random.Random, size: int) -> bytes:
+    body = "\n".join(f"<h2>{sentence(rng, 4)}</h2>\n<p>{paragraph}</p>" for paragraph in paragraphs(rng, size))
+    return f"<!DOCTYPE html>\n<html><head><title>{sentence(rng, 4)}</title></head>\n<body>\n{body}\n</body></html>\n".encode()
+
+
+def make_pdf(rng: random.Random, size: int) -> bytes:
+    """A minimal pdf of text pages with the standard Helvetica font"""
+    pages, total = [], 0
+    while total < size:
+        lines = [sentence(rng, 10) for _ in range(40)]
+        stream = "BT /F1 10 Tf 14 TL 72 740 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        pages.append(stream)
+        total += len(stream) + 250
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for stream in pages:
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def make_image(rng: random.Random, size: int) -> bytes:
+    """A png of noise, which barely compresses so the file is about `size` bytes"""
+    from PIL import Image
+
+    side = max(int((size / 3) ** 0.5), 1)
+    img = Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def fix_zip_times(data: bytes) -> bytes:
+    """Rewrite the members of an office document (a zip) with a fixed timestamp, in the same order"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, zipfile.ZipFile(buffer, "w") as archive:
+        for info in source.infolist():
+            archive.writestr(
+                zipfile.ZipInfo(info.filename, date_time=EPOCH.timetuple()[:6]), source.read(info), compress_type=info.compress_type
+            )
+    return buffer.getvalue()
+
+
+def make_docx(rng: random.Random, size: int) -> bytes:
+    from docx import Document
+
+    document = Document()
+    document.core_properties.created = document.core_properties.modified = EPOCH
+    document.add_heading(sentence(rng, 4), level=1)
+    for i, paragraph in enumerate(paragraphs(rng, size)):
+        if i % 10 == 9:
+            document.add_heading(sentence(rng, 4), level=2)
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return fix_zip_times(buffer.getvalue())
+
+
+def make_pptx(rng: random.Random, size: int) -> bytes:
+    from pptx import Presentation
+
+    presentation = Presentation()
+    presentation.core_properties.created = presentation.core_properties.modified = EPOCH
+    layout = presentation.slide_layouts[1]
+    for paragraph in paragraphs(rng, size, length=600):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = sentence(rng, 4)
+        slide.placeholders[1].text = paragraph
+        slide.notes_slide.notes_text_frame.text = sentence(rng)
+    buffer = io.BytesIO()
+    presentation.save(buffer)
+    return fix_zip_times(buffer.getvalue())
+
+
+def _make_spreadsheet(rng: random.Random, size: int, engine: str = None) -> bytes:
+    import pandas as pd
+
+    header, *records = rows(rng, size)
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine=engine) as writer:
+        # a few sheets to exercise the per sheet handling
+        for i in range(3):
+            pd.DataFrame(records[i::3], columns=header).to_excel(writer, sheet_name=f"Sheet{i + 1}", index=False)
+        if hasattr(writer.book, "set_properties"):
+            # xlsxwriter stamps the document with the current time otherwise
+            writer.book.set_properties({"created": EPOCH})
+    return fix_zip_times(buffer.getvalue())
+
+
+def make_xlsx(rng: random.Random, size: int) -> bytes:
+    # pandas picks whichever xlsx writer (openpyxl or xlsxwriter) is installed
+    return _make_spreadsheet(rng, size)
+
+
+def make_ods(rng: random.Random, size: int) -> bytes:
+    return _make_spreadsheet(rng, size, engine="odf")
+
+
+def make_message(rng: random.Random, size: int, index: int = 0) -> EmailMessage:
+    """An email with a text and html body and about half its size in attachments"""
+    msg = EmailMessage()
+    msg["From"] = f"{rng.choice(WORDS)}@example.com"
+    msg["To"] = ", ".join(f"{rng.choice(WORDS)}@example.org" for _ in range(rng.randint(1, 3)))
+    msg["Subject"] = sentence(rng, 5)
+    msg["Date"] = format_datetime(EPOCH.replace(minute=index % 60))
+    msg["Message-ID"] = f"<{index}.{rng.getrandbits(64):x}@example.com>"
+    text = "\n\n".join(paragraphs(rng, size // 2))
+    msg.set_content(text)
+    msg.add_alternative(f"<html><body><p>{text}</p></body></html>", subtype="html")
+    msg.add_attachment(make_csv(rng, size // 4), maintype="text", subtype="csv", filename="table.csv")
+    msg.add_attachment(make_pdf(rng, size // 4), maintype="application", subtype="pdf", filename="report.pdf")
+    for part in msg.walk():
+        if part.is_multipart():
+            part.set_boundary(f"=={rng.getrandbits(64):016x}==")
+    return msg
+
+
+def make_eml(rng: random.Random, size: int) -> bytes:
+    return make_message(rng, size).as_bytes()
+
+
+def make_mbox(rng: random.Random, size: int, num_messages: int = 10) -> bytes:
+    out = b""
+    for i in range(num_messages):
+        msg = make_message(rng, size // num_messages, index=i)
+        msg.set_unixfrom(f"From MAILER-DAEMON {time.asctime(EPOCH.timetuple())}")
+        # body lines starting with "From " are escaped as in mboxo
+        out += msg.as_bytes(unixfrom=True, policy=msg.policy.clone(mangle_from_=True)) + b"\n"
+    return out
+
+
+def members(rng: random.Random, size: int, num_members: int = 8) -> list[tuple[str, bytes]]:
+    """Mixed files to put in archives, the first ones in a sub directory"""
+    makers = [(".txt", make_txt), (".csv", make_csv), (".json", make_json), (".html", make_html), (".pdf", make_pdf)]
+    out = []
+    for i in range(num_members):
+        extension, make = makers[i % len(makers)]
+        folder = "nested/" if i < num_members // 2 else ""
+        out.append((f"{folder}member_{i}{extension}", make(rng, size // num_members)))
+    return out
+
+
+def pack_zip(entries: list[tuple[str, bytes]]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries:
+            archive.writestr(zipfile.ZipInfo(name, date_time=EPOCH.timetuple()[:6]), data, compress_type=zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def pack_tar(entries: list[tuple[str, bytes]]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            info.size, info.mtime = len(data), EPOCH.timestamp()
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def make_zip(rng: random.Random, size: int) -> bytes:
+    return pack_zip(members(rng, size))
+
+
+def make_tar(rng: random.Random, size: int) -> bytes:
+    return pack_tar(members(rng, size))
+
+
+def make_nested(rng: random.Random, size: int, depth: int = 3) -> bytes:
+    """A zip of files, an email with attachments and a tar of the same, and so on `depth` levels deep (zips and tars alternate)"""
+    entries = [*members(rng, size // 2, num_members=4), ("mail/message.eml", make_eml(rng, size // 4))]
+    if depth > 1:
+        entries.append((f"level_{depth - 1}{'.zip' if depth % 2 == 0 else '.tar'}", make_nested(rng, size // 4, depth=depth - 1)))
+    return pack_zip(entries) if depth % 2 else pack_tar(entries)
+
+
+def make_sevenzip(rng: random.Random, size: int) -> bytes:
+    import py7zr
+
+    buffer = io.BytesIO()
+    # members are added from files as py7zr stamps in-memory ones with the current time
+    with tempfile.TemporaryDirectory() as tmp_dir, py7zr.SevenZipFile(buffer, "w") as archive:
+        for i, (name, data) in enumerate(members(rng, size)):
+            path = Path(tmp_dir) / str(i)
+            path.write_bytes(data)
+            os.utime(path, (EPOCH.timestamp(), EPOCH.timestamp()))
+            archive.write(path, name)
+    return buffer.getvalue()
+
+
+def make_gzip(rng: random.Random, size: int) -> bytes:
+    return gzip.compress(make_txt(rng, size), mtime=0)
+
+
+# file types without a generator (doc, ppt, xls, msg, rar, video) need proprietary writers or external tools
+GENERATORS: dict[FileType, tuple[str, Callable[[random.Random, int], bytes]]] = {
+    FileType.code: (".py", make_code),
+    FileType.csv: (".csv", make_csv),
+    FileType.docx: (".docx", make_docx),
+    FileType.eml: (".eml", make_eml),
+    FileType.gzip: (".txt.gz", make_gzip),
+    FileType.html: (".html", make_html),
+    FileType.image: (".png", make_image),
+    FileType.json: (".json", make_json),
+    FileType.log: (".log", make_log),
+    FileType.mbox: (".mbox", make_mbox),
+    FileType.ods: (".ods", make_ods),
+    FileType.pdf: (".pdf", make_pdf),
+    FileType.pptx: (".pptx", make_pptx),
+    FileType.sevenzip: (".7z", make_sevenzip),
+    FileType.tar: (".tar", make_tar),
+    FileType.tsv: (".tsv", make_tsv),
+    FileType.txt: (".txt", make_txt),
+    FileType.xlsx: (".xlsx", make_xlsx),
+    FileType.xml: (".xml", make_xml),
+    FileType.zip: (".zip", make_zip),
+}
+
+
+def generate_corpus(out_dir: Path, sizes: list[int], num_files: int = 3, seed: int = 0, file_types: list[FileType] = None) -> list[dict]:
+    """Write `num_files` files of about each size for every file type and return (and save) the manifest
+
+    Note: every file is generated from its own seed so a file doesn't change when
+    other types or sizes are added. Sizes are approximate, in particular for
+    compressed formats, so the manifest records the actual size as well.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for file_type in file_types or list(GENERATORS):
+        extension, make = GENERATORS[file_type]
+        try:
+            files = [(size, i, make(random.Random(f"{seed}-{file_type}-{size}-{i}"), size)) for size in sizes for i in range(num_files)]
+        except ImportError as e:
+            logger.warning(f"Skipping {file_type} files as their writer isn't installed: {e}")
+            continue
+        for size, i, data in files:
+            path = out_dir / str(file_type) / f"{file_type}_{size}_{i}{extension}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            manifest.append(
+                {"path": str(path.relative_to(out_dir)), "file_type": str(file_type), "target_size": size, "file_size": len(data)}
+            )
+
+    get_manifest_path(out_dir).write_text(json.dumps({"seed": seed, "sizes": sizes, "num_files": num_files, "files": manifest}, indent=4))
+    logger.info(f"Generated {len(manifest)} files in {out_dir}")
+    return manifest
+
+
+# file types of a mixed corpus, weighted towards the common ones, and nested archives (as zip files)
+MIXED = [
+    (FileType.txt, 4),
+    (FileType.pdf, 3),
+    (FileType.eml, 3),
+    (FileType.docx, 2),
+    (FileType.csv, 2),
+    (FileType.html, 2),
+    (FileType.json, 2),
+    (FileType.image, 2),
+    (FileType.zip, 1),
+    (FileType.tar, 1),
+    (FileType.pptx, 1),
+    (FileType.xlsx, 1),
+    ("nested", 2),
+]
+
+
+def generate_mixed_corpus(out_dir: Path, sizes: list[int], num_files: int = 100, seed: int = 0) -> list[dict]:
+    """Write a tree of `num_files` files of mixed types and sizes, including nested archives and emails with attachments
+
+    Note: types whose writer isn't installed are replaced by txt files so the
+    number of files doesn't depend on the environment.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(f"{seed}-mixed")
+    file_types, weights = zip(*MIXED)
+    manifest = []
+    for i in range(num_files):
+        file_type, size = rng.choices(file_types, weights=weights)[0], rng.choice(sizes)
+        file_rng = random.Random(f"{seed}-mixed-{i}")
+        extension, make = (".zip", make_nested) if file_type == "nested" else GENERATORS[file_type]
+        try:
+            data = make(file_rng, size)
+        except ImportError:
+            (extension, make), file_type = GENERATORS[FileType.txt], FileType.txt
+            data = make(file_rng, size)
+        path = out_dir / f"dir_{i % 5}" / f"sub_{i % 3}" / f"file_{i}{extension}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        manifest.append({"path": str(path.relative_to(out_dir)), "file_type": str(file_type), "target_size": size, "file_size": len(data)})
+
+    meta = {"seed": seed, "sizes": sizes, "num_files": num_files, "mixed": True, "files": manifest}
+    get_manifest_path(out_dir).write_text(json.dumps(meta, indent=4))
+    logger.info(f"Generated {len(manifest)} mixed files in {out_dir}")
+    return manifest
+
+
+def load_corpus(corpus_dir: Path) -> list[dict]:
+    """Load the manifest of a generated corpus"""
+    return json.loads(get_manifest_path(corpus_dir).read_text())["files"]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark corpus")
+    parser.add_argument("--out_dir", type=Path, required=True, help="Where to write the corpus (its manifest is written next to it)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Approximate file sizes in bytes")
+    parser.add_argument("--num_files", type=int, default=3, help="Number of files per file type and size")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--file_types", type=FileType, nargs="+", default=None, choices=list(GENERATORS), help="File types to generate")
+    parser.add_argument("--mixed", action="store_true", help="Generate a tree of num_files files of mixed types and sizes instead")
+    args = parser.parse_args()
+    if args.mixed:
+        generate_mixed_corpus(args.out_dir, sizes=args.sizes, num_files=args.num_files, seed=args.seed)
+    else:
+        generate_corpus(args.out_dir, sizes=args.sizes, num_files=args.num_files, seed=args.seed, file_types=args.file_types)
+
+
+if __name__ == "__main__":
+    main()
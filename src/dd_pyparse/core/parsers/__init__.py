@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Literal
+from typing import Iterator, Literal
 
 from dd_pyparse.core.parsers.base import (FileParser, FileStreamer,
                                           get_file_meta)
@@ -27,6 +27,7 @@ from dd_pyparse.core.parsers.xls import XlsParser
 from dd_pyparse.core.parsers.xlsx import XlsxParser
 from dd_pyparse.core.parsers.xml import XmlParser
 from dd_pyparse.core.parsers.zip import ZipParser
+from dd_pyparse.core.utils.timeouts import get_timeout, time_limit
 from dd_pyparse.schemas.data import Archive, Code, Document, Email, Image, Log, Table, Video
 from dd_pyparse.schemas.enums import DataType, FileType
 from dd_pyparse.utils.exceptions import UnsupportedFileType
@@ -70,18 +71,67 @@ def route_parser(file_type: FileType) -> tuple[FileParser | FileStreamer, DataTy
     return parser, validator
 
 
-def parse(file_path: Path, mode: Literal["dict", "json"] = "dict", extract_children: bool = False, out_dir: Path = None, **kwargs) -> dict:
-    """Parse a file and return a dictionary of metadata"""
-    out = get_file_meta(file_path)
+def parse(
+    file_path: Path,
+    mode: Literal["dict", "json"] = "dict",
+    extract_children: bool = False,
+    out_dir: Path = None,
+    timeout_multiplier: float = None,
+    file_meta: dict = None,
+    **kwargs,
+) -> dict:
+    """Parse a file and return a dictionary of metadata (within the timeout of its file type when given a multiplier)
+
+    Note: `file_meta` is what `get_file_meta` returns when known already, e.g.
+    from hashing an upload as it was received, so the file isn't read for it.
+    """
+    out = dict(file_meta) if file_meta is not None else get_file_meta(file_path)
     processor, validator = route_parser(file_type=out["file_type"])
+    timeout = None
+    if timeout_multiplier is not None:
+        timeout = get_timeout(out["file_type"], multiplier=timeout_multiplier, file_size=out.get("file_size"))
 
-    if issubclass(processor, FileParser):
-        update = processor.parse(file=file_path, extract_children=extract_children, out_dir=out_dir, **kwargs)
-        out = update | out
+    with time_limit(timeout):
+        if issubclass(processor, FileParser):
+            update = processor.parse(file=file_path, extract_children=extract_children, out_dir=out_dir, **kwargs)
+            out = update | out
 
-    elif issubclass(processor, FileStreamer):
-        children = [child for child in processor.stream(file_path=file_path, extract_children=extract_children, out_dir=out_dir, **kwargs)]
-        out["children"] = children if children else None
+        elif issubclass(processor, FileStreamer):
+            children = list(processor.stream(file_path=file_path, extract_children=extract_children, out_dir=out_dir, **kwargs))
+            out["children"] = children if children else None
 
     out = validator(**out)
     return out.model_dump(mode=mode, exclude_none=True)
+
+
+def stream(
+    file_path: Path,
+    mode: Literal["dict", "json"] = "dict",
+    extract_children: bool = False,
+    out_dir: Path = None,
+    timeout_multiplier: float = None,
+    file_meta: dict = None,
+    **kwargs,
+) -> Iterator[dict]:
+    """Parse a file into records, the file first and then each child of an archive or mailbox as it is produced
+
+    Note: children are linked to the file by `parent_id` instead of being nested
+    in it, so memory stays flat however many a streamer yields. Other file types
+    yield their single record as `parse` returns it.
+    """
+    out = dict(file_meta) if file_meta is not None else get_file_meta(file_path)
+    processor, validator = route_parser(file_type=out["file_type"])
+    if not issubclass(processor, FileStreamer):
+        options = {"extract_children": extract_children, "out_dir": out_dir, "timeout_multiplier": timeout_multiplier}
+        yield parse(file_path, mode=mode, file_meta=out, **options, **kwargs)
+        return
+
+    timeout = None
+    if timeout_multiplier is not None:
+        timeout = get_timeout(out["file_type"], multiplier=timeout_multiplier, file_size=out.get("file_size"))
+    parent = validator(**out)
+    yield parent.model_dump(mode=mode, exclude_none=True)
+    with time_limit(timeout):
+        for child in processor.stream(file_path=file_path, extract_children=extract_children, out_dir=out_dir, **kwargs):
+            child.parent_id = parent.id
+            yield child.model_dump(mode=mode, exclude_none=True)
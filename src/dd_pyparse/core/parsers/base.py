@@ -1,3 +1,4 @@
+import time
 from abc import abstractmethod
 from datetime import datetime
 from functools import singledispatch
@@ -6,6 +7,7 @@ from pathlib import Path
 
 from dd_pyparse.core.utils.filetype import get_extension, route_mime_type
 from dd_pyparse.core.utils.general import get_hashes
+from dd_pyparse.core.utils.metrics import metrics
 from dd_pyparse.schemas.base import Base
 
 @singledispatch
@@ -18,15 +20,19 @@ def get_file_meta(file, *args, **kwargs) -> dict:
 @get_file_meta.register(Path)
 def _(file, encoding: str = None) -> dict:
     """Get metadata about the file"""
+    start = time.perf_counter()
     with open(file, "rb", encoding=encoding) as fb:
         mime_type, file_type = route_mime_type(file_name=file.name, file=fb)
+    metrics.observe("stage_seconds", time.perf_counter() - start, stage="detect", file_type=file_type)
     file_stat = file.stat()
+    with metrics.time("stage_seconds", stage="hash", file_type=file_type):
+        hashes = get_hashes(file)
 
     return {
         "absolute_path": file.absolute(),
         "date_modified": datetime.fromtimestamp(file_stat.st_mtime),
         "date_created": datetime.fromtimestamp(file_stat.st_ctime),
-        "hash": get_hashes(file),
+        "hash": hashes,
         "file_extension": file.suffix,
         "file_name": file.name,
         "file_size": file_stat.st_size,
@@ -76,12 +82,18 @@ except ImportError:
 
 
 class FileParser:
+    # bump when a change in the parser could change its output or whether it fails
+    version: str = "1"
+
     @abstractmethod
     def parse(self, file: Path | bytes, **kwargs) -> Base:
         raise NotImplementedError
 
 
 class FileStreamer:
+    # bump when a change in the parser could change its output or whether it fails
+    version: str = "1"
+
     @abstractmethod
     def stream(self, file_path: Path, extract_children: bool = False, out_dir: Path = None, **kwargs) -> Base:
         raise NotImplementedError
@@ -7,6 +7,7 @@ from pandas.errors import ParserError
 
 from dd_pyparse.core.parsers.base import FileParser
 from dd_pyparse.core.parsers.txt import TxtParser
+from dd_pyparse.core.utils.metrics import metrics
 
 
 class CsvParser(FileParser):
@@ -25,4 +26,5 @@ class CsvParser(FileParser):
             return {"text": {"source": text}}
         except ParserError:
             logger.warning(f"Failed to parse {file.name} as csv into table. Falling back to txt")
+            metrics.inc("fallbacks", parser="CsvParser", fallback="TxtParser")
             return TxtParser.parse(file=file, encoding=encoding, **kwargs)
\ No newline at end of file
@@ -114,7 +114,7 @@ class PdfParser(FileParser):
             )
             if output and output.text:
                 _children.append(output)
-        elif isinstance(child, LTImage):
+        elif isinstance(child, LTImage) and img_handler is not None:
             output = PdfParser.parse_img(child=child, img_handler=img_handler)
             if output:
                 _children.append(output)
@@ -194,6 +194,7 @@ class PdfParser(FileParser):
         cleaned: bool = True,
         delimiter: str = " ",
         extract_children: bool = False,
+        extract_images: bool = True,
         max_pages: int = None,
         out_dir: Path = None,
         page_delimiter: str = "\n\n",
@@ -206,7 +207,8 @@ class PdfParser(FileParser):
             file = BytesIO(file)
 
         out = PdfParser.get_metadata(file, password=password)
-        img_handler = PDFImageHandler(extract_children=extract_children, out_dir=out_dir)
+        # images are skipped altogether (not even described) when not extracted
+        img_handler = PDFImageHandler(extract_children=extract_children, out_dir=out_dir) if extract_images else None
 
         max_pages = 0 if max_pages is None else max_pages
         pages = extract_pages(file, maxpages=max_pages, page_numbers=page_numbers, password=password)
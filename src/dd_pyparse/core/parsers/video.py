@@ -22,16 +22,19 @@ class VideoParser(FileParser):
     @staticmethod
     def parse(
         file: Path,
+        probe: bool = True,
         **kwargs,
     ) -> dict:
-        """Parse a video file"""
+        """Parse a video file (`probe=False` skips the ffmpeg variable fps and duration probes)"""
 
         cap = cv2.VideoCapture(str(file))
-        return {
+        out = {
             "height": cap.get(cv2.CAP_PROP_FRAME_HEIGHT),
             "width": cap.get(cv2.CAP_PROP_FRAME_WIDTH),
             "fps": cap.get(cv2.CAP_PROP_FPS),
             "num_frames": cap.get(cv2.CAP_PROP_FRAME_COUNT),
-            "is_variable_fps": VideoParser.check_is_variable_fps(file),
-            "duration": VideoParser.get_duration(file),
         }
+        if probe:
+            out["is_variable_fps"] = VideoParser.check_is_variable_fps(file)
+            out["duration"] = VideoParser.get_duration(file)
+        return out
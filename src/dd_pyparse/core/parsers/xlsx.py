@@ -10,6 +10,7 @@ from pandas import ExcelFile, read_excel
 from dd_pyparse.core.parsers.base import FileParser
 from dd_pyparse.core.parsers.pdf import PdfParser
 from dd_pyparse.core.utils.externals import convert_with_libre
+from dd_pyparse.core.utils.metrics import metrics
 from dd_pyparse.core.utils.text import clean
 
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -55,12 +56,14 @@ class XlsxParser(FileParser):
         cleaned: bool = True,
         paginated: bool = False,
         sheet_delimiter: str = "\n",
+        max_sheets: int = None,
+        max_rows: int = None,
         **kwargs,
     ) -> str:
-        """Parse the text from an xlsx file"""
+        """Parse the text from an xlsx file, optionally truncated to the first sheets and rows"""
         sheets = []
-        for i, sheet_name in enumerate(excel.sheet_names):
-            df = read_excel(excel, sheet_name=i)
+        for i, sheet_name in enumerate(excel.sheet_names[:max_sheets]):
+            df = read_excel(excel, sheet_name=i, nrows=max_rows)
             if df.empty is False:
                 sheet_text = df.to_string(index=False, na_rep=" ")
                 if cleaned:
@@ -74,6 +77,8 @@ class XlsxParser(FileParser):
     def parse(
         file: Path | bytes,
         cleaned: bool = True,
+        max_sheets: int = None,
+        max_rows: int = None,
         **kwargs,
     ) -> dict:
         """Parse an xlsx file"""
@@ -87,12 +92,13 @@ class XlsxParser(FileParser):
         try:
             excel = ExcelFile(file)
             out = XlsxParser.parse_meta(excel=excel, raw=True)
-            text = XlsxParser.parse_text(excel=excel, cleaned=cleaned)
+            text = XlsxParser.parse_text(excel=excel, cleaned=cleaned, max_sheets=max_sheets, max_rows=max_rows)
             if text:
                 out["text"] = {"source": text}
             return out
         except ValueError:
             logger.info(f"Pandas failed to parse {file.name} as xlsx. Falling back to pdf conversion and parsing")
+            metrics.inc("fallbacks", parser="XlsxParser", fallback="LibreOffice")
             with tempfile.TemporaryDirectory() as tmp_dir:
                 tmp_path = convert_with_libre(
                     file_path=file,
@@ -0,0 +1,77 @@
+from dd_pyparse.core.utils.costs import CostModel
+from dd_pyparse.core.utils.filetype import EXT_TO_FILETYPE_MIME_MAP, get_extension
+from dd_pyparse.schemas.data.parents.file import File
+from dd_pyparse.schemas.enums import FileType
+
+
+def guess_file_type(file_name: str) -> FileType:
+    """Cheaply guess the file type from the extension (for scheduling only, not routing)"""
+    file_ext = get_extension(file_name)
+    file_type, _ = EXT_TO_FILETYPE_MIME_MAP.get(file_ext, (FileType.unknown, None))
+    return file_type
+
+
+class BatchPlanner:
+    """Group small files into batches so one queue round-trip covers several parses
+
+    Note: batches close when they reach `max_batch_size` files or when the summed
+    latency estimate of their files reaches `target_latency` seconds. Estimates come
+    from a cost model fitted on previous runs when it covers the file type, else
+    from a moving average of latencies observed by the workers per file type.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 64,
+        max_file_size: int = 10 * 1024,
+        target_latency: float = 0.5,
+        default_latency: float = 0.01,
+        smoothing: float = 0.2,
+        cost_model: CostModel = None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_file_size = max_file_size
+        self.target_latency = target_latency
+        self.default_latency = default_latency
+        self.smoothing = smoothing
+        self.cost_model = cost_model
+        self.latencies: dict[FileType, float] = {}
+
+        self._batch: list[File] = []
+        self._batch_latency = 0.0
+
+    def estimate(self, file_type: FileType, file_size: int = None) -> float:
+        """Estimate the latency in seconds of parsing a small file of a given type"""
+        if self.cost_model is not None and file_type in self.cost_model.seconds:
+            return self.cost_model.predict(file_type, file_size)
+        return self.latencies.get(file_type, self.default_latency)
+
+    def observe(self, file_type: FileType, seconds: float):
+        """Update the moving average latency of a file type"""
+        previous = self.latencies.get(file_type)
+        if previous is None:
+            self.latencies[file_type] = seconds
+        else:
+            self.latencies[file_type] = (1 - self.smoothing) * previous + self.smoothing * seconds
+
+    def is_batched(self, file_size: int) -> bool:
+        """Check whether files of a size are batched, only their latencies are worth observing"""
+        return self.max_batch_size > 1 and (file_size or 0) <= self.max_file_size
+
+    def add(self, file: File, file_size: int) -> list[list[File]]:
+        """Add a file and return the batches that are ready to be dispatched"""
+        if not self.is_batched(file_size):
+            return [[file]]
+
+        self._batch.append(file)
+        self._batch_latency += self.estimate(guess_file_type(file.absolute_path.name), file_size=file_size)
+        if len(self._batch) >= self.max_batch_size or self._batch_latency >= self.target_latency:
+            return [self.flush()]
+        return []
+
+    def flush(self) -> list[File]:
+        """Return the pending batch and start a new one"""
+        batch = self._batch
+        self._batch = []
+        self._batch_latency = 0.0
+        return batch
@@ -0,0 +1,143 @@
+import sqlite3
+import statistics
+import time
+from typing import Iterable
+
+from dd_pyparse.core.utils.stores import SQLiteStore
+from dd_pyparse.schemas.enums import FileType
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id TEXT NOT NULL,
+    file_type TEXT,
+    mime_type TEXT,
+    file_size INTEGER,
+    num_units INTEGER,
+    elapsed REAL,
+    peak_rss INTEGER,
+    predicted REAL,
+    status TEXT,
+    recorded REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_run ON tasks (run_id);
+CREATE INDEX IF NOT EXISTS tasks_recorded ON tasks (recorded);
+"""
+COLUMNS = ["run_id", "file_type", "mime_type", "file_size", "num_units", "elapsed", "peak_rss", "predicted", "status", "recorded"]
+
+
+def fit_line(xs: list[float], ys: list[float]) -> tuple[float, float]:
+    """Least squares fit of `y = intercept + slope * x` with a non-negative slope"""
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance if variance else 0.0
+    slope = max(slope, 0.0)
+    return mean_y - slope * mean_x, slope
+
+
+class CostModel:
+    """Per file type linear models of parse seconds and peak RSS given the file size
+
+    Note: types with fewer than `min_samples` observations fall back to a model
+    fitted on every type, and predictions are floored at `min_seconds`.
+    """
+
+    def __init__(
+        self, seconds: dict[str, tuple[float, float]] = None, rss: dict[str, tuple[float, float]] = None, min_seconds: float = 1e-4
+    ):
+        self.seconds = seconds or {}
+        self.rss = rss or {}
+        self.min_seconds = min_seconds
+
+    def __bool__(self) -> bool:
+        return bool(self.seconds)
+
+    @classmethod
+    def fit(cls, rows: Iterable[dict], min_samples: int = 5) -> "CostModel":
+        """Fit the models from (file_type, file_size, elapsed, peak_rss) observations"""
+        by_type: dict[str, list[dict]] = {}
+        for row in rows:
+            by_type.setdefault(row["file_type"], []).append(row)
+        by_type["*"] = [row for rows in by_type.values() for row in rows]
+
+        seconds, rss = {}, {}
+        for file_type, observations in by_type.items():
+            if len(observations) < min_samples:
+                continue
+            sizes = [row["file_size"] or 0 for row in observations]
+            seconds[file_type] = fit_line(sizes, [row["elapsed"] for row in observations])
+            with_rss = [(size, row["peak_rss"]) for size, row in zip(sizes, observations) if row["peak_rss"]]
+            if len(with_rss) >= min_samples:
+                rss[file_type] = fit_line(*zip(*with_rss))
+        return cls(seconds=seconds, rss=rss)
+
+    def _coefficients(self, models: dict, file_type: FileType | str) -> tuple[float, float] | None:
+        return models.get(file_type, models.get("*"))
+
+    def predict(self, file_type: FileType | str, file_size: int) -> float | None:
+        """Predict the seconds of processing a file (None without observations)"""
+        coefficients = self._coefficients(self.seconds, file_type)
+        if coefficients is None:
+            return None
+        intercept, slope = coefficients
+        return max(intercept + slope * (file_size or 0), self.min_seconds)
+
+    def predict_rss(self, file_type: FileType | str, file_size: int) -> int | None:
+        """Predict the peak RSS in bytes of the worker processing a file (None without observations)"""
+        coefficients = self._coefficients(self.rss, file_type)
+        if coefficients is None:
+            return None
+        intercept, slope = coefficients
+        return int(max(intercept + slope * (file_size or 0), 0))
+
+
+def compute_accuracy(rows: Iterable[dict]) -> dict:
+    """Compare predicted and observed seconds overall and per file type"""
+    by_type: dict[str, list[tuple[float, float]]] = {}
+    for row in rows:
+        if row["predicted"] is not None and row["elapsed"]:
+            by_type.setdefault(row["file_type"] or "unknown", []).append((row["predicted"], row["elapsed"]))
+
+    def summarize(pairs: list[tuple[float, float]]) -> dict:
+        errors = [abs(predicted - observed) / observed for predicted, observed in pairs]
+        return {
+            "num_files": len(pairs),
+            "median_relative_error": statistics.median(errors),
+            "mean_relative_error": statistics.fmean(errors),
+            # over 1 when the model overestimates the total
+            "total_ratio": sum(p for p, _ in pairs) / sum(o for _, o in pairs),
+        }
+
+    pairs = [pair for pairs in by_type.values() for pair in pairs]
+    if not pairs:
+        return {"num_files": 0}
+    return {**summarize(pairs), "by_file_type": {file_type: summarize(x) for file_type, x in sorted(by_type.items())}}
+
+
+class CostStore(SQLiteStore):
+    """Local SQLite store of per task telemetry used to fit the cost model"""
+
+    schema = SCHEMA
+    row_factory = sqlite3.Row
+
+    def record(self, rows: list[dict]):
+        """Record the telemetry of processed files"""
+        now = time.time()
+        self._conn.executemany(
+            f"INSERT INTO tasks ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [tuple(now if column == "recorded" else row.get(column) for column in COLUMNS) for row in rows],
+        )
+
+    def load(self, run_id: str = None, status: str = None, limit: int = 100_000) -> list[dict]:
+        """Load the most recent telemetry, optionally of a run or with a status"""
+        conditions, params = [], []
+        for column, value in [("run_id", run_id), ("status", status)]:
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._conn.execute(f"SELECT * FROM tasks {where} ORDER BY recorded DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def fit(self, **kwargs) -> CostModel:
+        """Fit a cost model on the recent telemetry of successful tasks"""
+        return CostModel.fit(self.load(status="ok"), **kwargs)
@@ -0,0 +1,234 @@
+import multiprocessing
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable
+
+from loguru import logger
+
+
+class Executor(ABC):
+    """A backend that runs the workers and provides the primitives they share"""
+
+    name: str = None
+    # workers share the dispatcher's process, so they can't be interrupted by signals or profiled concurrently with cProfile
+    threaded: bool = False
+
+    @abstractmethod
+    def joinable_queue(self):
+        """A queue with `task_done` and `join`"""
+
+    @abstractmethod
+    def queue(self):
+        """A plain queue"""
+
+    @abstractmethod
+    def value(self, typecode: str, initial: Any):
+        """A shared value with `.value` and `get_lock()`"""
+
+    @abstractmethod
+    def array(self, typecode: str, size: int):
+        """A shared zero initialized array with indexing and `get_lock()`"""
+
+    @abstractmethod
+    def condition(self):
+        """A shared condition variable"""
+
+    @abstractmethod
+    def spawn(self, target: Callable):
+        """Start a worker running `target` and return a handle with `is_alive()` and `join()`"""
+
+
+class ProcessExecutor(Executor):
+    """Workers are processes (the default)"""
+
+    name = "process"
+
+    def joinable_queue(self):
+        return multiprocessing.JoinableQueue()
+
+    def queue(self):
+        return multiprocessing.Queue()
+
+    def value(self, typecode: str, initial: Any):
+        return multiprocessing.Value(typecode, initial)
+
+    def array(self, typecode: str, size: int):
+        return multiprocessing.Array(typecode, size)
+
+    def condition(self):
+        return multiprocessing.Condition()
+
+    def spawn(self, target: Callable):
+        worker = multiprocessing.Process(target=target)
+        worker.start()
+        return worker
+
+
+class _ThreadValue:
+    def __init__(self, initial: Any):
+        self.value = initial
+        self._lock = threading.Lock()
+
+    def get_lock(self) -> threading.Lock:
+        return self._lock
+
+
+class _ThreadArray(list):
+    def __init__(self, size: int):
+        super().__init__([0] * size)
+        self._lock = threading.Lock()
+
+    def get_lock(self) -> threading.Lock:
+        return self._lock
+
+
+class ThreadExecutor(Executor):
+    """Workers are threads, which is cheaper for I/O bound work like hashing and archive listing"""
+
+    name = "thread"
+    threaded = True
+
+    def joinable_queue(self):
+        return queue.Queue()
+
+    def queue(self):
+        return queue.Queue()
+
+    def value(self, typecode: str, initial: Any):
+        return _ThreadValue(initial)
+
+    def array(self, typecode: str, size: int):
+        return _ThreadArray(size)
+
+    def condition(self):
+        return threading.Condition()
+
+    def spawn(self, target: Callable):
+        worker = threading.Thread(target=target, daemon=True)
+        worker.start()
+        return worker
+
+
+class _RayWorker:
+    def __init__(self, ref):
+        self.ref = ref
+
+    def is_alive(self) -> bool:
+        import ray
+
+        _, pending = ray.wait([self.ref], timeout=0)
+        return bool(pending)
+
+    def join(self):
+        import ray
+
+        ray.get(self.ref)
+
+
+class _RayJoinableQueue:
+    """A ray queue with unfinished task accounting for `task_done` and `join`"""
+
+    def __init__(self, poll_interval: float = 0.1):
+        import ray
+        from ray.util.queue import Queue
+
+        @ray.remote
+        class Counter:
+            def __init__(self):
+                self.count = 0
+
+            def add(self, n: int) -> int:
+                self.count += n
+                return self.count
+
+        self._queue = Queue()
+        self._counter = Counter.remote()
+        self.poll_interval = poll_interval
+
+    def put(self, item: Any):
+        import ray
+
+        # count the item before it becomes visible so join never sees a false zero
+        if item is not None:
+            ray.get(self._counter.add.remote(1))
+        self._queue.put(item)
+
+    def get(self, block: bool = True, timeout: float = None):
+        return self._queue.get(block=block, timeout=timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def task_done(self):
+        self._counter.add.remote(-1)
+
+    def join(self):
+        import ray
+
+        while ray.get(self._counter.add.remote(0)) > 0:
+            time.sleep(self.poll_interval)
+
+
+class RayExecutor(Executor):
+    """Workers are ray tasks on a local (or given) ray cluster
+
+    Note: ray has no shared locks or condition variables so autoscaling, the
+    memory budget and live progress are not available with this backend.
+    """
+
+    name = "ray"
+
+    def __init__(self, address: str = None):
+        try:
+            import ray
+        except ImportError:
+            raise ImportError("You need to install ray to use the ray executor: `pip install ray`")
+
+        ray.init(address=address, ignore_reinit_error=True)
+        logger.info(f"Connected to ray cluster with {ray.cluster_resources().get('CPU')} CPUs")
+
+    def joinable_queue(self):
+        return _RayJoinableQueue()
+
+    def queue(self):
+        from ray.util.queue import Queue
+
+        return Queue()
+
+    def value(self, typecode: str, initial: Any):
+        raise NotImplementedError("Shared values are not supported by the ray executor")
+
+    def array(self, typecode: str, size: int):
+        raise NotImplementedError("Shared arrays are not supported by the ray executor")
+
+    def condition(self):
+        raise NotImplementedError("Condition variables are not supported by the ray executor")
+
+    def spawn(self, target: Callable):
+        import ray
+
+        @ray.remote
+        def run():
+            target()
+
+        return _RayWorker(run.remote())
+
+
+EXECUTOR_REGISTRY: dict[str, type[Executor]] = {
+    ProcessExecutor.name: ProcessExecutor,
+    ThreadExecutor.name: ThreadExecutor,
+    RayExecutor.name: RayExecutor,
+}
+
+
+def get_executor(name: str, **kwargs) -> Executor:
+    """Get an executor backend by name"""
+    try:
+        return EXECUTOR_REGISTRY[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown executor: {name=}. Choose from {list(EXECUTOR_REGISTRY)}")
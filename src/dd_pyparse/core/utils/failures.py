@@ -0,0 +1,107 @@
+import json
+import shutil
+import sqlite3
+import time
+import traceback
+from pathlib import Path
+
+from loguru import logger
+
+from dd_pyparse.core.utils.stores import SQLiteStore
+from dd_pyparse.utils.info import service_info
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS failures (
+    sha256 TEXT NOT NULL,
+    parser TEXT NOT NULL,
+    version TEXT NOT NULL,
+    exception TEXT,
+    message TEXT,
+    seconds REAL,
+    count INTEGER NOT NULL DEFAULT 1,
+    path TEXT,
+    first_seen REAL,
+    last_seen REAL,
+    PRIMARY KEY (sha256, parser, version)
+);
+"""
+# errors of the environment (a missing optional package or binary, an unreadable path) rather than the input
+ENVIRONMENT_ERRORS = (ImportError, FileNotFoundError, PermissionError)
+
+
+def is_input_failure(error: Exception) -> bool:
+    """Check whether an error is a parser failing on (or timing out on) its input, the failures worth remembering"""
+    return not isinstance(error, ENVIRONMENT_ERRORS)
+
+
+def get_parser_version(parser: type) -> str:
+    """Version of a parser's behaviour, i.e. the package and parser versions"""
+    return f"{service_info.version}+{getattr(parser, 'version', '0')}"
+
+
+class FailureRegistry(SQLiteStore):
+    """Persistent record of inputs that failed or timed out, keyed by sha256 and parser version
+
+    Note: a new parser (or package) version starts with a clean slate so fixes get
+    a chance to parse previously bad inputs, and an input is only known bad after
+    `max_failures` failures so a one-off (e.g. a timeout under load) is retried.
+    """
+
+    schema = SCHEMA
+    row_factory = sqlite3.Row
+
+    def __init__(self, db_path: Path, max_failures: int = 3, timeout: float = 60.0):
+        self.max_failures = max_failures
+        super().__init__(db_path, timeout=timeout)
+
+    def lookup(self, sha256: str, parser: type) -> dict | None:
+        """Get the failure record of an input if it failed at least `max_failures` times"""
+        row = self._conn.execute(
+            "SELECT * FROM failures WHERE sha256 = ? AND parser = ? AND version = ? AND count >= ?",
+            (sha256, parser.__name__, get_parser_version(parser), self.max_failures),
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def record(self, sha256: str, parser: type, error: Exception, seconds: float, path: Path = None):
+        """Record a failure of a parser on an input"""
+        now = time.time()
+        self._conn.execute(
+            """
+            INSERT INTO failures (sha256, parser, version, exception, message, seconds, path, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sha256, parser, version) DO UPDATE SET
+                exception = excluded.exception,
+                message = excluded.message,
+                seconds = excluded.seconds,
+                path = excluded.path,
+                count = count + 1,
+                last_seen = excluded.last_seen
+            """,
+            (sha256, parser.__name__, get_parser_version(parser), type(error).__name__, str(error), seconds, str(path), now, now),
+        )
+
+
+def quarantine(file_path: Path, quarantine_dir: Path, sha256: str, parser: type, error: Exception, seconds: float):
+    """Copy a failing input and a description of the failure to the quarantine directory"""
+    file_path = Path(file_path)
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+    out_path = quarantine_dir / f"{sha256}{file_path.suffix}"
+    if out_path.exists():
+        return
+    shutil.copy2(file_path, out_path)
+    with open(quarantine_dir / f"{sha256}.json", "w") as fb:
+        json.dump(
+            {
+                "path": str(file_path),
+                "sha256": sha256,
+                "parser": parser.__name__,
+                "version": get_parser_version(parser),
+                "exception": type(error).__name__,
+                "message": str(error),
+                "traceback": "".join(traceback.format_exception(error)),
+                "seconds": seconds,
+            },
+            fb,
+            indent=4,
+        )
+    logger.info(f"Quarantined {file_path} to {out_path}")
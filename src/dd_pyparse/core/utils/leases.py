@@ -0,0 +1,116 @@
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable
+from uuid import uuid4
+
+from dd_pyparse.core.utils.stores import SQLiteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, expires);
+"""
+
+
+class LeaseQueue(SQLiteStore):
+    """A work queue in a SQLite database shared by several hosts (e.g. on NFS)
+
+    Note: hosts claim tasks with leases that expire unless renewed, so the tasks
+    of a host that dies are claimed again by the others once their leases lapse.
+    Claims run in IMMEDIATE transactions so a task is never leased twice, and the
+    rollback journal is kept because WAL does not work on network file systems.
+    Tasks that were leased `max_attempts` times without completing are failed.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, db_path: Path, owner: str = None, lease_seconds: float = 300.0, max_attempts: int = 3, timeout: float = 60.0):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        super().__init__(db_path, timeout=timeout)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = super()._connect()
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def _transaction(self, sql: str, params: Iterable = (), many: bool = False) -> int:
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount
+
+    def add(self, tasks: Iterable[tuple[str, int]]) -> int:
+        """Add (path, size) tasks, ignoring those already known, and return how many were new"""
+        now = time.time()
+        return self._transaction(
+            "INSERT OR IGNORE INTO tasks (path, size, updated) VALUES (?, ?, ?)",
+            [(path, size, now) for path, size in tasks],
+            many=True,
+        )
+
+    def claim(self, n: int) -> list[tuple[str, int]]:
+        """Lease up to n pending or expired tasks"""
+        conn = self._conn
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE tasks SET state = 'failed', owner = NULL, updated = ? WHERE state = 'leased' AND expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = conn.execute(
+                "SELECT path, size FROM tasks WHERE state = 'pending' OR (state = 'leased' AND expires < ?) LIMIT ?",
+                (now, n),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, expires = ?, attempts = attempts + 1, updated = ? WHERE path = ?",
+                [(self.owner, now + self.lease_seconds, now, path) for path, _ in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def renew(self) -> int:
+        """Extend the leases of every task this owner holds"""
+        now = time.time()
+        return self._transaction(
+            "UPDATE tasks SET expires = ?, updated = ? WHERE owner = ? AND state = 'leased'",
+            (now + self.lease_seconds, now, self.owner),
+        )
+
+    def complete(self, paths: Iterable[str], state: str = "done") -> int:
+        """Mark leased tasks of this owner as done (or failed)"""
+        now = time.time()
+        return self._transaction(
+            "UPDATE tasks SET state = ?, owner = NULL, expires = NULL, updated = ? WHERE path = ? AND owner = ? AND state = 'leased'",
+            [(state, now, path, self.owner) for path in paths],
+            many=True,
+        )
+
+    def counts(self) -> dict[str, int]:
+        """Count the tasks per state"""
+        return dict(self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+    def is_finished(self) -> bool:
+        """Check that no task is pending or leased (by any host)"""
+        counts = self.counts()
+        return counts.get("pending", 0) == 0 and counts.get("leased", 0) == 0
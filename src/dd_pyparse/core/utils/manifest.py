@@ -0,0 +1,111 @@
+import json
+import os
+import socket
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator
+
+from loguru import logger
+
+MANIFEST_DIR = "_manifest"
+
+
+def get_manifest_dir(out_dir: Path) -> Path:
+    return out_dir / MANIFEST_DIR
+
+
+class ManifestWriter:
+    """Append-only record of processed files, one file per worker so writers never interleave"""
+
+    def __init__(self, out_dir: Path, shard_tag: str):
+        manifest_dir = get_manifest_dir(out_dir)
+        manifest_dir.mkdir(parents=True, exist_ok=True)
+        worker_tag = f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+        self.path = manifest_dir / f"manifest-{shard_tag}-{worker_tag}.jsonl"
+        self._fb = open(self.path, "a")
+
+    def write(self, entry: dict):
+        self._fb.write(json.dumps(entry, default=str) + "\n")
+        self._fb.flush()
+
+    def close(self):
+        self._fb.close()
+
+
+def read_manifests(out_dir: Path, pattern: str = "manifest-*.jsonl") -> Iterator[dict]:
+    """Read the entries of every worker manifest matching a pattern"""
+    for path in sorted(get_manifest_dir(out_dir).glob(pattern)):
+        with open(path) as fb:
+            for line in fb:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def load_processed(out_dir: Path) -> dict[str, tuple[int, float]]:
+    """Map the relative path of every file in the manifests to its size and mtime when processed"""
+    return {
+        entry["relative_path"]: (entry.get("file_size"), entry.get("mtime"))
+        for entry in read_manifests(out_dir)
+        if entry.get("relative_path")
+    }
+
+
+def is_processed(processed: tuple[int, float] | None, file_size: int, mtime: float) -> bool:
+    """Check a file against its manifest entry, a file changed since it was processed is processed again"""
+    if processed is None or processed[1] is None:
+        return False
+    # mtimes go through a datetime so they only match to the microsecond
+    return processed[0] == file_size and abs(processed[1] - mtime) < 1e-3
+
+
+def compute_stats(entries: list[dict]) -> dict:
+    """Summarize manifest entries overall and per file type"""
+    by_file_type = defaultdict(lambda: {"num_files": 0, "num_errors": 0, "num_bytes": 0, "seconds": 0.0})
+    for entry in entries:
+        stats = by_file_type[entry.get("file_type") or "unknown"]
+        stats["num_files"] += 1
+        stats["num_errors"] += entry["status"] == "error"
+        stats["num_bytes"] += entry.get("file_size") or 0
+        stats["seconds"] += entry.get("elapsed") or 0.0
+
+    return {
+        "num_files": sum(x["num_files"] for x in by_file_type.values()),
+        "num_errors": sum(x["num_errors"] for x in by_file_type.values()),
+        "num_bytes": sum(x["num_bytes"] for x in by_file_type.values()),
+        "seconds": sum(x["seconds"] for x in by_file_type.values()),
+        "by_file_type": dict(sorted(by_file_type.items())),
+    }
+
+
+def write_shard_stats(out_dir: Path, shard_tag: str, run_id: str, **extra) -> dict:
+    """Write the stats of a run of a shard from its worker manifests, earlier runs' entries are left out"""
+    entries = {}
+    for entry in read_manifests(out_dir, f"manifest-{shard_tag}-*.jsonl"):
+        if entry.get("run_id") == run_id:
+            entries[entry["path"]] = entry
+    stats = {"shard": shard_tag, "run_id": run_id, **extra, **compute_stats(list(entries.values()))}
+    with open(get_manifest_dir(out_dir) / f"stats-{shard_tag}.json", "w") as fb:
+        json.dump(stats, fb, indent=4, default=str)
+    return stats
+
+
+def merge_manifests(out_dir: Path) -> dict:
+    """Merge the manifests and stats of every shard (and node) into `manifest.jsonl` and `stats.json`"""
+    manifest_dir = get_manifest_dir(out_dir)
+    entries = {}
+    for entry in read_manifests(out_dir):
+        # a file retried by a later run supersedes its earlier entry
+        entries[entry["path"]] = entry
+
+    with open(manifest_dir / "manifest.jsonl", "w") as fb:
+        for entry in entries.values():
+            fb.write(json.dumps(entry, default=str) + "\n")
+
+    shards = [json.loads(path.read_text()) for path in sorted(manifest_dir.glob("stats-*.json"))]
+    stats = {**compute_stats(list(entries.values())), "shards": shards}
+    with open(manifest_dir / "stats.json", "w") as fb:
+        json.dump(stats, fb, indent=4, default=str)
+
+    logger.info(f"Merged {len(entries)} manifest entries from {len(shards)} shards in {manifest_dir}")
+    return stats
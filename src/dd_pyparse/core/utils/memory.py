@@ -0,0 +1,137 @@
+import os
+import re
+from contextlib import contextmanager
+from multiprocessing import Condition, Value
+from pathlib import Path
+
+from loguru import logger
+
+from dd_pyparse.schemas.enums import FileType
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+# rough peak memory per byte of input for parsers that materialize their input
+MEMORY_MULTIPLIERS: dict[FileType, float] = {
+    FileType.csv: 6.0,
+    FileType.gzip: 4.0,
+    FileType.image: 6.0,
+    FileType.json: 8.0,
+    FileType.ods: 10.0,
+    FileType.pdf: 3.0,
+    FileType.rar: 2.0,
+    FileType.sevenzip: 2.0,
+    FileType.tar: 2.0,
+    FileType.tsv: 6.0,
+    FileType.xls: 10.0,
+    FileType.xlsx: 10.0,
+    FileType.zip: 2.0,
+}
+DEFAULT_MULTIPLIER = 1.5
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def estimate_footprint(file_type: FileType, file_size: int, multipliers: dict[FileType, float] = MEMORY_MULTIPLIERS) -> int:
+    """Estimate the peak memory in bytes of parsing a file"""
+    return int(file_size * multipliers.get(file_type, DEFAULT_MULTIPLIER))
+
+
+def get_available_memory(cgroup_root: Path = CGROUP_ROOT) -> int:
+    """Get the memory available to this process honoring the cgroup (v2) limit"""
+    available = None
+    with open("/proc/meminfo") as fb:
+        for line in fb:
+            if line.startswith("MemAvailable:"):
+                available = int(line.split()[1]) * 1024
+                break
+
+    try:
+        limit = (cgroup_root / "memory.max").read_text().strip()
+        if limit != "max":
+            used = int((cgroup_root / "memory.current").read_text())
+            cgroup_available = int(limit) - used
+            available = cgroup_available if available is None else min(available, cgroup_available)
+    except (OSError, ValueError):
+        pass
+
+    if available is None:
+        raise RuntimeError("Unable to determine available memory")
+    return available
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak RSS (VmHWM) of this process so it can be measured per task (Linux only)"""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_rss() -> int | None:
+    """Get the current RSS in bytes of this process"""
+    try:
+        with open("/proc/self/statm") as fb:
+            return int(fb.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def get_peak_rss() -> int | None:
+    """Get the peak RSS in bytes of this process since it started or was last reset"""
+    try:
+        with open("/proc/self/status") as fb:
+            for line in fb:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def parse_memory_size(value: str, auto_fraction: float = 0.8) -> int:
+    """Parse a size like `512M`, `8G` or `auto` (a fraction of the available memory) to bytes"""
+    value = value.strip().upper()
+    if value == "AUTO":
+        return int(get_available_memory() * auto_fraction)
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMGT]?)I?B?", value)
+    if match is None:
+        raise ValueError(f"Invalid memory size: {value}")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+class MemoryBudget:
+    """A memory budget shared by worker processes
+
+    Note: tasks reserve their estimated footprint before parsing and wait while the
+    budget is exhausted. A task larger than the whole budget is capped to it, so it
+    runs once nothing else holds a reservation rather than never.
+    """
+
+    def __init__(self, budget: int, condition=None, reserved=None):
+        self.budget = budget
+        # primitives can be provided by an executor backend, e.g. threading ones
+        self._condition = Condition() if condition is None else condition
+        self._reserved = Value("q", 0, lock=False) if reserved is None else reserved
+
+    @property
+    def reserved(self) -> int:
+        return self._reserved.value
+
+    @contextmanager
+    def reserve(self, size: int):
+        """Reserve memory for the duration of the context"""
+        size = min(size, self.budget)
+        with self._condition:
+            if self._reserved.value + size > self.budget:
+                logger.debug(f"Waiting for {size} bytes of memory ({self._reserved.value}/{self.budget} reserved)")
+            while self._reserved.value + size > self.budget:
+                self._condition.wait()
+            self._reserved.value += size
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved.value -= size
+                self._condition.notify_all()
@@ -0,0 +1,220 @@
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+METRICS_DIR = "_metrics"
+PREFIX = "dd_pyparse"
+# upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0, float("inf"))
+
+
+def _key(name: str, labels: dict) -> str:
+    # keys are json friendly so snapshots merge across processes
+    return json.dumps([name, sorted((k, str(v)) for k, v in labels.items())])
+
+
+class Metrics:
+    """Thread safe counters, gauges and latency histograms of a process
+
+    Note: metrics are keyed by name and labels, e.g. the stage and file type.
+    Snapshots are plain dicts so the processes of a run can dump theirs to files
+    and be merged by the dispatcher.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters: dict[str, float] = {}
+            self.gauges: dict[str, float] = {}
+            self.histograms: dict[str, list] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            # bucket counts followed by the sum
+            histogram = self.histograms.setdefault(key, [0] * len(BUCKETS) + [0.0])
+            histogram[bisect_left(BUCKETS, seconds)] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        """Observe the duration of the context"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {key: list(histogram) for key, histogram in self.histograms.items()},
+            }
+
+    def dump(self, path: Path):
+        """Atomically write a snapshot"""
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}")
+        with open(tmp_path, "w") as fb:
+            json.dump(self.snapshot(), fb)
+        os.replace(tmp_path, path)
+
+
+# metrics of this process, parsers record fallbacks here
+metrics = Metrics()
+
+
+def get_metrics_dir(out_dir: Path) -> Path:
+    return out_dir / METRICS_DIR
+
+
+def get_metrics_path(out_dir: Path, shard_tag: str) -> Path:
+    """Path of the snapshot of this process"""
+    return get_metrics_dir(out_dir) / f"metrics-{shard_tag}-{socket.gethostname()}-{os.getpid()}.json"
+
+
+def merge_snapshots(snapshots: list[dict]) -> dict:
+    """Sum counters and histograms of several processes (gauges are labeled per worker so they don't collide)"""
+    merged = {"counters": {}, "gauges": {}, "histograms": {}}
+    for snapshot in snapshots:
+        for key, value in snapshot["counters"].items():
+            merged["counters"][key] = merged["counters"].get(key, 0) + value
+        merged["gauges"].update(snapshot["gauges"])
+        for key, histogram in snapshot["histograms"].items():
+            previous = merged["histograms"].get(key)
+            merged["histograms"][key] = histogram if previous is None else [a + b for a, b in zip(previous, histogram)]
+    return merged
+
+
+def read_snapshots(out_dir: Path, pattern: str = "metrics-*.json") -> dict:
+    """Merge the snapshots dumped by the processes of a run"""
+    snapshots = []
+    for path in sorted(get_metrics_dir(out_dir).glob(pattern)):
+        try:
+            snapshots.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            logger.warning(f"Unable to read metrics {path}")
+    return merge_snapshots(snapshots)
+
+
+def quantile(histogram: list, q: float) -> float | None:
+    """Estimate a quantile from histogram buckets (the upper bound of the bucket holding it)"""
+    counts = histogram[:-1]
+    total = sum(counts)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip(BUCKETS, counts):
+        seen += count
+        if seen >= q * total:
+            return bound
+    return BUCKETS[-1]
+
+
+def build_report(snapshot: dict) -> dict:
+    """Summarize a merged snapshot into a readable report"""
+    report = {"counters": [], "gauges": [], "histograms": []}
+    for kind in ["counters", "gauges"]:
+        for key, value in sorted(snapshot[kind].items()):
+            name, labels = json.loads(key)
+            report[kind].append({"name": name, **dict(labels), "value": value})
+    for key, histogram in sorted(snapshot["histograms"].items()):
+        name, labels = json.loads(key)
+        count = sum(histogram[:-1])
+        report["histograms"].append(
+            {
+                "name": name,
+                **dict(labels),
+                "count": count,
+                "seconds": histogram[-1],
+                "mean": histogram[-1] / count if count else None,
+                "p50": quantile(histogram, 0.5),
+                "p95": quantile(histogram, 0.95),
+                "p99": quantile(histogram, 0.99),
+            }
+        )
+    return report
+
+
+def _format_labels(labels: list, **extra) -> str:
+    labels = [*labels, *extra.items()]
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def to_prometheus(snapshot: dict) -> str:
+    """Render a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for kind, prom_type, suffix in [("counters", "counter", "_total"), ("gauges", "gauge", "")]:
+        typed = set()
+        for key, value in sorted(snapshot[kind].items()):
+            name, labels = json.loads(key)
+            metric = f"{PREFIX}_{name}{suffix}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} {prom_type}")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    typed = set()
+    for key, histogram in sorted(snapshot["histograms"].items()):
+        name, labels = json.loads(key)
+        metric = f"{PREFIX}_{name}"
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram[:-1]):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else str(bound)
+            lines.append(f"{metric}_bucket{_format_labels(labels, le=le)} {cumulative}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {histogram[-1]}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port: int, get_snapshot: Callable[[], dict], host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve `/metrics` in the Prometheus text format from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = to_prometheus(get_snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Metrics request {format % args}")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
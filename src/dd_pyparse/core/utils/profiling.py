@@ -0,0 +1,176 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from loguru import logger
+
+from dd_pyparse.core.utils.stores import ThreadLocalState
+
+PROFILE_DIR = "_profile"
+PROFILERS = ["cprofile", "sample"]
+
+
+def get_profile_dir(out_dir: Path) -> Path:
+    return out_dir / PROFILE_DIR
+
+
+class StackSampler:
+    """Low overhead profiler sampling the stack of a thread from a background thread
+
+    Note: stacks are counted in the folded format of flame graph tools, i.e.
+    `module:function;module:function` from the outermost frame.
+    """
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def write_folded(stacks: Counter, path: Path):
+    with open(path, "w") as fb:
+        for stack, count in stacks.most_common():
+            fb.write(f"{stack} {count}\n")
+
+
+def read_folded(path: Path) -> Counter:
+    stacks = Counter()
+    with open(path) as fb:
+        for line in fb:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            stacks[stack] += int(count)
+    return stacks
+
+
+class ParserProfiler(ThreadLocalState):
+    """Profile parser invocations, aggregated per parser class, keeping full profiles of slow files
+
+    Note: with `cprofile` every invocation gets its own profiler whose stats are
+    added to the worker's aggregate of the parser class, which costs more than
+    `sample` but gives exact call counts. Profiles of files slower than
+    `slow_seconds` are kept under `slow/` named by the parser and file hash.
+    """
+
+    def __init__(self, profile_dir: Path, run_tag: str, profiler: str = "cprofile", slow_seconds: float = 10.0, interval: float = 0.005):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}")
+        self.profile_dir = profile_dir
+        self.run_tag = run_tag
+        self.profiler = profiler
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        super().__init__()
+
+    @property
+    def _aggregates(self) -> dict:
+        if getattr(self._local, "aggregates", None) is None:
+            self._local.aggregates = {}
+        return self._local.aggregates
+
+    @property
+    def _extension(self) -> str:
+        return ".prof" if self.profiler == "cprofile" else ".folded"
+
+    @contextmanager
+    def profile(self, parser: str, sha256: str = None, path: Path = None):
+        """Profile the context as an invocation of a parser"""
+        start = time.perf_counter()
+        if self.profiler == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                seconds = time.perf_counter() - start
+                if parser in self._aggregates:
+                    self._aggregates[parser].add(profile)
+                else:
+                    self._aggregates[parser] = pstats.Stats(profile)
+                if seconds > self.slow_seconds:
+                    self._keep_slow(parser, sha256=sha256, path=path, seconds=seconds, dump=profile.dump_stats)
+        else:
+            sampler = StackSampler(threading.get_ident(), interval=self.interval)
+            try:
+                with sampler:
+                    yield
+            finally:
+                seconds = time.perf_counter() - start
+                self._aggregates.setdefault(parser, Counter()).update(sampler.stacks)
+                if seconds > self.slow_seconds:
+                    self._keep_slow(parser, sha256=sha256, path=path, seconds=seconds, dump=lambda p: write_folded(sampler.stacks, p))
+
+    def _keep_slow(self, parser: str, sha256: str, path: Path, seconds: float, dump):
+        slow_dir = self.profile_dir / "slow"
+        slow_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{parser}-{sha256 or 'unknown'}"
+        dump(slow_dir / f"{name}{self._extension}")
+        with open(slow_dir / f"{name}.json", "w") as fb:
+            json.dump({"parser": parser, "sha256": sha256, "path": str(path), "seconds": seconds, "profiler": self.profiler}, fb, indent=4)
+        logger.info(f"Kept the profile of {path} ({sha256}) which took {seconds:.1f} seconds with {parser}")
+
+    def dump(self):
+        """Write the aggregates of this worker, one file per parser class"""
+        worker_tag = f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+        for parser, aggregate in self._aggregates.items():
+            parser_dir = self.profile_dir / parser
+            parser_dir.mkdir(parents=True, exist_ok=True)
+            out_path = parser_dir / f"{self.run_tag}-{worker_tag}{self._extension}"
+            if self.profiler == "cprofile":
+                aggregate.dump_stats(out_path)
+            else:
+                write_folded(aggregate, out_path)
+        self._local.aggregates = None
+
+
+def merge_profiles(profile_dir: Path, run_tag: str, top: int = 30) -> list[Path]:
+    """Merge the per worker aggregates of a run into one profile (and a text summary) per parser class"""
+    out_paths = []
+    for parser_dir in sorted(path for path in profile_dir.iterdir() if path.is_dir() and path.name != "slow"):
+        for extension in [".prof", ".folded"]:
+            paths = sorted(parser_dir.glob(f"{run_tag}-*{extension}"))
+            if not paths:
+                continue
+            out_path = profile_dir / f"{parser_dir.name}{extension}"
+            if extension == ".prof":
+                stats = pstats.Stats(*map(str, paths))
+                stats.dump_stats(out_path)
+                summary = io.StringIO()
+                pstats.Stats(str(out_path), stream=summary).sort_stats("cumulative").print_stats(top)
+                out_path.with_suffix(".txt").write_text(summary.getvalue())
+            else:
+                stacks = Counter()
+                for path in paths:
+                    stacks.update(read_folded(path))
+                write_folded(stacks, out_path)
+            out_paths.append(out_path)
+    return out_paths
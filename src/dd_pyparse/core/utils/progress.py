@@ -0,0 +1,161 @@
+import json
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+from threading import Event
+from typing import Callable, TextIO
+
+from dd_pyparse.schemas.enums import FileType
+
+FILE_TYPES = list(FileType)
+# counters of each file type, predicted seconds come from the cost model
+FIELDS = ["queued", "done", "bytes", "errors", "seconds", "predicted_queued", "predicted_done"]
+PROGRESS_MODES = ["auto", "tty", "json", "none"]
+
+
+class ProgressCounters:
+    """Per file type progress counters in a shared array that the dispatcher and workers update
+
+    Note: files are counted by the type guessed from their extension on both
+    sides so queued and done counts line up. The last slot counts in-flight files.
+    """
+
+    size = len(FILE_TYPES) * len(FIELDS) + 1
+
+    def __init__(self, array):
+        self._array = array
+
+    def _index(self, file_type: FileType, field: str) -> int:
+        return FILE_TYPES.index(file_type) * len(FIELDS) + FIELDS.index(field)
+
+    def queued(self, file_type: FileType, predicted: float = 0.0):
+        with self._array.get_lock():
+            self._array[self._index(file_type, "queued")] += 1
+            self._array[self._index(file_type, "predicted_queued")] += predicted
+
+    def started(self):
+        with self._array.get_lock():
+            self._array[-1] += 1
+
+    def finished(self, file_type: FileType, file_size: int, seconds: float, error: bool, predicted: float = 0.0):
+        with self._array.get_lock():
+            self._array[-1] -= 1
+            updates = {"done": 1, "bytes": file_size, "errors": int(error), "seconds": seconds, "predicted_done": predicted}
+            for field, value in updates.items():
+                self._array[self._index(file_type, field)] += value
+
+    def snapshot(self) -> tuple[dict[str, dict], int]:
+        """Get the counters of every file type seen so far and the number of in-flight files"""
+        with self._array.get_lock():
+            values = list(self._array)
+        by_file_type = {}
+        for i, file_type in enumerate(FILE_TYPES):
+            start, end = i * len(FIELDS), (i + 1) * len(FIELDS)
+            counters = dict(zip(FIELDS, values[start:end]))
+            if counters["queued"] or counters["done"]:
+                by_file_type[str(file_type)] = counters
+        return by_file_type, int(values[-1])
+
+
+def estimate_remaining(counters: dict) -> float | None:
+    """Estimate the worker seconds left for a file type
+
+    Note: cost model predictions are rescaled by how far off they have been so far,
+    otherwise the average seconds per file observed so far is used.
+    """
+    remaining = counters["queued"] - counters["done"]
+    if remaining <= 0:
+        return 0.0
+    predicted = counters["predicted_queued"] - counters["predicted_done"]
+    if predicted > 0:
+        correction = counters["seconds"] / counters["predicted_done"] if counters["predicted_done"] else 1.0
+        return predicted * correction
+    if counters["done"]:
+        return remaining * counters["seconds"] / counters["done"]
+    return None
+
+
+def format_eta(seconds: float | None) -> str:
+    return "?" if seconds is None else str(timedelta(seconds=round(seconds)))
+
+
+class ProgressReporter:
+    """Periodically report throughput, backlog and ETA as a status line or json lines"""
+
+    def __init__(
+        self,
+        counters: ProgressCounters,
+        get_backlog: Callable[[], int],
+        get_num_workers: Callable[[], int],
+        mode: str = "auto",
+        interval: float = None,
+        stream: TextIO = sys.stderr,
+    ):
+        self.counters = counters
+        self.get_backlog = get_backlog
+        self.get_num_workers = get_num_workers
+        self.stream = stream
+        self.mode = ("tty" if stream.isatty() else "json") if mode == "auto" else mode
+        self.interval = interval or (1.0 if self.mode == "tty" else 30.0)
+        self._last = (time.monotonic(), 0, 0)
+
+    def status(self) -> dict:
+        """Compute the current progress"""
+        by_file_type, in_flight = self.counters.snapshot()
+        num_workers = max(self.get_num_workers(), 1)
+        now = time.monotonic()
+        done = sum(x["done"] for x in by_file_type.values())
+        num_bytes = sum(x["bytes"] for x in by_file_type.values())
+        last_time, last_done, last_bytes = self._last
+        elapsed = max(now - last_time, 1e-9)
+        self._last = (now, done, num_bytes)
+
+        remaining = {file_type: estimate_remaining(x) for file_type, x in by_file_type.items()}
+        return {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "done": int(done),
+            "queued": int(sum(x["queued"] for x in by_file_type.values())),
+            "files_per_second": (done - last_done) / elapsed,
+            "mb_per_second": (num_bytes - last_bytes) / elapsed / 1024**2,
+            "queue_depth": self.get_backlog(),
+            "in_flight": in_flight,
+            "errors": int(sum(x["errors"] for x in by_file_type.values())),
+            "eta_seconds": None if None in remaining.values() else sum(remaining.values()) / num_workers,
+            "by_file_type": {
+                file_type: {
+                    "done": int(x["done"]),
+                    "queued": int(x["queued"]),
+                    "errors": int(x["errors"]),
+                    "bytes": int(x["bytes"]),
+                    "eta_seconds": None if remaining[file_type] is None else remaining[file_type] / num_workers,
+                }
+                for file_type, x in by_file_type.items()
+            },
+        }
+
+    def render(self, status: dict) -> str:
+        """Render a status as a single terminal line"""
+        line = (
+            f"{status['done']}/{status['queued']} files | {status['files_per_second']:.1f} files/s | "
+            f"{status['mb_per_second']:.1f} MB/s | queue {status['queue_depth']} | in-flight {status['in_flight']} | "
+            f"errors {status['errors']} | ETA {format_eta(status['eta_seconds'])}"
+        )
+        by_file_type = sorted(status["by_file_type"].items(), key=lambda x: -(x[1]["eta_seconds"] or 0))
+        for file_type, x in by_file_type:
+            line += f" | {file_type} {x['done']}/{x['queued']} ETA {format_eta(x['eta_seconds'])}"
+        return line[: shutil.get_terminal_size().columns - 1]
+
+    def report(self, final: bool = False):
+        status = self.status()
+        if self.mode == "tty":
+            self.stream.write("\r\x1b[K" + self.render(status) + ("\n" if final else ""))
+        else:
+            self.stream.write(json.dumps(status) + "\n")
+        self.stream.flush()
+
+    def run(self, stop: Event):
+        """Report every `interval` seconds until stopped, then a final time"""
+        while not stop.wait(self.interval):
+            self.report()
+        self.report(final=True)
@@ -0,0 +1,177 @@
+import math
+import os
+import time
+from pathlib import Path
+
+from loguru import logger
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def get_cgroup_cpu_quota(cgroup_root: Path = CGROUP_ROOT) -> float | None:
+    """Get the number of CPUs allowed by the cgroup (v2 or v1) quota if there is one"""
+    try:
+        cpu_max = cgroup_root / "cpu.max"
+        if cpu_max.exists():
+            quota, period = cpu_max.read_text().split()
+            return None if quota == "max" else int(quota) / int(period)
+
+        cfs_quota = cgroup_root / "cpu" / "cpu.cfs_quota_us"
+        if cfs_quota.exists():
+            quota = int(cfs_quota.read_text())
+            period = int((cgroup_root / "cpu" / "cpu.cfs_period_us").read_text())
+            return None if quota <= 0 else quota / period
+    except (OSError, ValueError) as e:
+        logger.debug(f"Unable to read cgroup cpu quota: {e}")
+    return None
+
+
+def get_cgroup_cpu_usage(cgroup_root: Path = CGROUP_ROOT) -> float | None:
+    """Get the CPU seconds used by the cgroup (v2 or v1) if there is one"""
+    try:
+        cpu_stat = cgroup_root / "cpu.stat"
+        if cpu_stat.exists():
+            for line in cpu_stat.read_text().splitlines():
+                name, value = line.split()
+                if name == "usage_usec":
+                    return int(value) / 1e6
+
+        cpuacct_usage = cgroup_root / "cpuacct" / "cpuacct.usage"
+        if cpuacct_usage.exists():
+            return int(cpuacct_usage.read_text()) / 1e9
+    except (OSError, ValueError) as e:
+        logger.debug(f"Unable to read cgroup cpu usage: {e}")
+    return None
+
+
+def get_cgroup_io_stall(cgroup_root: Path = CGROUP_ROOT) -> float | None:
+    """Get the seconds some tasks of the cgroup (v2) stalled on I/O if pressure is tracked"""
+    try:
+        io_pressure = cgroup_root / "io.pressure"
+        if io_pressure.exists():
+            # some avg10=0.00 avg60=0.00 avg300=0.00 total=12345
+            some = io_pressure.read_text().splitlines()[0].split()
+            return int(dict(x.split("=") for x in some[1:])["total"]) / 1e6
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        logger.debug(f"Unable to read cgroup io pressure: {e}")
+    return None
+
+
+def get_affinity_cpu_count() -> int:
+    """Get the number of CPUs the process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_cpu_count() -> int:
+    """Get the number of usable CPUs honoring the affinity mask and cgroup quota"""
+    cpu_count = get_affinity_cpu_count()
+    quota = get_cgroup_cpu_quota()
+    if quota is not None:
+        cpu_count = min(cpu_count, max(1, math.ceil(quota)))
+    return cpu_count
+
+
+class CpuSampler:
+    """Sample CPU utilization and iowait between calls, of the cgroup when there is one
+
+    Note: in a cgroup utilization is its CPU usage over its quota (or the CPUs it
+    may run on) and iowait its I/O pressure, /proc/stat is host-wide so it is
+    only the fallback (and the iowait of cgroups without pressure tracking).
+    """
+
+    def __init__(self, stat_path: Path = Path("/proc/stat"), cgroup_root: Path = CGROUP_ROOT):
+        self.stat_path = stat_path
+        self.cgroup_root = cgroup_root
+        self.in_cgroup = get_cgroup_cpu_usage(cgroup_root) is not None
+        self.cpu_count = (get_cgroup_cpu_quota(cgroup_root) or get_affinity_cpu_count()) if self.in_cgroup else None
+        self._last = self._read()
+        self._last_cgroup = self._read_cgroup()
+
+    def _read(self) -> list[int] | None:
+        try:
+            with open(self.stat_path) as fb:
+                # cpu user nice system idle iowait irq softirq steal ...
+                return [int(x) for x in fb.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+
+    def _read_cgroup(self) -> tuple[float, float | None, float] | None:
+        if not self.in_cgroup:
+            return None
+        usage = get_cgroup_cpu_usage(self.cgroup_root)
+        return None if usage is None else (usage, get_cgroup_io_stall(self.cgroup_root), time.monotonic())
+
+    def _sample_host(self) -> tuple[float, float]:
+        current = self._read()
+        if current is None or self._last is None:
+            return 0.0, 0.0
+        deltas = [c - p for c, p in zip(current, self._last)]
+        self._last = current
+
+        total = sum(deltas)
+        if total <= 0:
+            return 0.0, 0.0
+        idle, iowait = deltas[3], deltas[4]
+        return (total - idle - iowait) / total, iowait / total
+
+    def sample(self) -> tuple[float, float]:
+        """Get the (utilization, iowait) fractions since the last sample"""
+        current = self._read_cgroup()
+        if current is None or self._last_cgroup is None:
+            return self._sample_host()
+        (usage, stall, now), (last_usage, last_stall, last) = current, self._last_cgroup
+        self._last_cgroup = current
+        seconds = now - last
+        if seconds <= 0:
+            return 0.0, 0.0
+        utilization = min((usage - last_usage) / (seconds * self.cpu_count), 1.0)
+        if stall is None or last_stall is None:
+            return utilization, self._sample_host()[1]
+        return utilization, min((stall - last_stall) / seconds, 1.0)
+
+
+class Autoscaler:
+    """Decide how many workers to run from CPU utilization, iowait and queue backlog
+
+    Note: workers are added while there is backlog and the CPUs are not saturated
+    (or are waiting on I/O) and removed when the CPUs are oversubscribed or the
+    workers are idle.
+    """
+
+    def __init__(
+        self,
+        min_workers: int = 1,
+        max_workers: int = None,
+        cpu_count: int = None,
+        high_utilization: float = 0.9,
+        low_utilization: float = 0.5,
+        high_iowait: float = 0.2,
+        step: int = 1,
+    ):
+        self.cpu_count = cpu_count or get_cpu_count()
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers or 2 * self.cpu_count)
+        self.high_utilization = high_utilization
+        self.low_utilization = low_utilization
+        self.high_iowait = high_iowait
+        self.step = step
+
+    @property
+    def initial_workers(self) -> int:
+        return self.clamp(self.cpu_count)
+
+    def clamp(self, num_workers: int) -> int:
+        return min(self.max_workers, max(self.min_workers, num_workers))
+
+    def decide(self, num_workers: int, backlog: int, utilization: float, iowait: float) -> int:
+        """Get the target number of workers"""
+        if backlog > num_workers and (iowait >= self.high_iowait or utilization < self.high_utilization):
+            return self.clamp(num_workers + self.step)
+        if utilization >= self.high_utilization and iowait < self.high_iowait and num_workers > self.cpu_count:
+            return self.clamp(num_workers - self.step)
+        if backlog < num_workers and utilization < self.low_utilization:
+            return self.clamp(num_workers - self.step)
+        return self.clamp(num_workers)
@@ -0,0 +1,32 @@
+import argparse
+from hashlib import blake2b
+from pathlib import Path
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse a zero-based `INDEX/COUNT` shard specification"""
+    try:
+        index, count = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like INDEX/COUNT, got {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def get_shard(relative_path: str, count: int) -> int:
+    """Get the shard of a path from a stable hash (unlike `hash`, the same on every node and run)"""
+    digest = blake2b(relative_path.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def in_shard(file_path: Path, root: Path, shard: tuple[int, int]) -> bool:
+    """Check whether a discovered file belongs to a shard by its path relative to the input root"""
+    index, count = shard
+    return get_shard(file_path.relative_to(root).as_posix(), count) == index
+
+
+def format_shard(shard: tuple[int, int] | None) -> str:
+    """Format a shard for file names, e.g. `0-of-4`"""
+    index, count = (0, 1) if shard is None else shard
+    return f"{index}-of-{count}"
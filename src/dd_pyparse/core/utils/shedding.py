@@ -0,0 +1,83 @@
+import argparse
+
+from dd_pyparse.schemas.enums import FileType
+
+# parser options per degradation level, level 0 is a full parse
+DEGRADATION_LEVELS: list[dict[FileType, dict]] = [
+    {},
+    {
+        FileType.pdf: {"max_pages": 50, "extract_images": False},
+        FileType.video: {"probe": False},
+        FileType.xlsx: {"max_sheets": 10, "max_rows": 10_000},
+    },
+    {
+        FileType.pdf: {"max_pages": 5, "extract_images": False},
+        FileType.video: {"probe": False},
+        FileType.xlsx: {"max_sheets": 1, "max_rows": 1_000},
+    },
+]
+
+# seconds a file type should take to parse, slower types are degraded one extra level under pressure
+FILE_TYPE_LATENCY_TARGETS: dict[FileType, float] = {
+    FileType.pdf: 5.0,
+    FileType.video: 2.0,
+    FileType.xlsx: 5.0,
+}
+DEFAULT_LATENCY_TARGET = 2.0
+
+
+def parse_thresholds(value: str) -> list[int]:
+    """Parse increasing comma separated backlog thresholds, e.g. `100,1000`"""
+    try:
+        thresholds = [int(x) for x in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Thresholds must be comma separated integers, got {value}")
+    if thresholds != sorted(thresholds) or thresholds[0] < 1:
+        raise argparse.ArgumentTypeError(f"Thresholds must be positive and increasing, got {value}")
+    return thresholds
+
+
+class LoadShedder:
+    """Downgrade parser options when the backlog grows
+
+    Note: each backlog threshold that is reached raises the degradation level by
+    one. Under pressure, file types whose observed latency misses their target
+    are degraded one level further. Levels beyond the last one are capped to it.
+    """
+
+    def __init__(
+        self,
+        thresholds: list[int],
+        levels: list[dict[FileType, dict]] = DEGRADATION_LEVELS,
+        latency_targets: dict[FileType, float] = FILE_TYPE_LATENCY_TARGETS,
+        smoothing: float = 0.2,
+    ):
+        self.thresholds = thresholds
+        self.levels = levels
+        self.latency_targets = latency_targets
+        self.smoothing = smoothing
+        self.latencies: dict[FileType, float] = {}
+
+    @property
+    def max_level(self) -> int:
+        return len(self.levels) - 1
+
+    def observe(self, file_type: FileType, seconds: float):
+        """Update the moving average parse latency of a file type"""
+        previous = self.latencies.get(file_type)
+        self.latencies[file_type] = seconds if previous is None else (1 - self.smoothing) * previous + self.smoothing * seconds
+
+    def backlog_level(self, backlog: int) -> int:
+        return min(sum(backlog >= threshold for threshold in self.thresholds), self.max_level)
+
+    def level(self, file_type: FileType, backlog: int) -> int:
+        """Get the degradation level of a file type given the backlog"""
+        level = self.backlog_level(backlog)
+        latency = self.latencies.get(file_type)
+        if level and latency is not None and latency > self.latency_targets.get(file_type, DEFAULT_LATENCY_TARGET):
+            level += 1
+        return min(level, self.max_level)
+
+    def options(self, file_type: FileType, level: int) -> dict:
+        """Get the parser options of a file type at a degradation level"""
+        return self.levels[level].get(file_type, {})
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class ThreadLocalState:
+    """Keep per thread state in `_local`, left behind when the object is shipped to another process
+
+    Note: `_local` is recreated empty on unpickling (e.g. in a spawned worker),
+    anything kept in it is opened again lazily where it is used.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+
+class SQLiteStore(ThreadLocalState):
+    """A SQLite database used from every thread and worker process of a run
+
+    Note: sqlite connections can't cross forks or threads, so each thread opens
+    its own and opens it again after a fork. Subclasses give the `schema` and
+    may override `_connect` to configure new connections.
+    """
+
+    schema = ""
+    row_factory = None
+
+    def __init__(self, db_path: Path, timeout: float = 60.0):
+        super().__init__()
+        self.db_path = Path(db_path)
+        self.timeout = timeout
+        self._conn.executescript(self.schema)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        conn.row_factory = self.row_factory
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return self._local.conn
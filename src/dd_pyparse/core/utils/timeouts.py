@@ -0,0 +1,59 @@
+import signal
+import threading
+from contextlib import contextmanager
+
+from dd_pyparse.schemas.enums import FileType
+from dd_pyparse.utils.exceptions import ParseTimeout
+
+# seconds a single file may take to parse before it is abandoned
+FILE_TYPE_TIMEOUTS: dict[FileType, float] = {
+    FileType.doc: 300.0,
+    FileType.gzip: 1800.0,
+    FileType.image: 60.0,
+    FileType.mbox: 3600.0,
+    FileType.msg: 120.0,
+    FileType.ods: 300.0,
+    FileType.pdf: 600.0,
+    FileType.ppt: 300.0,
+    FileType.pptx: 300.0,
+    FileType.rar: 1800.0,
+    FileType.sevenzip: 1800.0,
+    FileType.tar: 1800.0,
+    FileType.video: 300.0,
+    FileType.xls: 300.0,
+    FileType.xlsx: 300.0,
+    FileType.zip: 1800.0,
+}
+DEFAULT_TIMEOUT = 120.0
+# slowest parsing throughput allowed on top of the timeout of the file type, so large files get longer
+MIN_BYTES_PER_SECOND = 1024 * 1024
+
+
+def get_timeout(file_type: FileType, multiplier: float = 1.0, file_size: int = 0) -> float | None:
+    """Get the parse timeout of a file of a type and size in seconds (None when disabled)"""
+    if not multiplier:
+        return None
+    return (FILE_TYPE_TIMEOUTS.get(file_type, DEFAULT_TIMEOUT) + (file_size or 0) / MIN_BYTES_PER_SECOND) * multiplier
+
+
+@contextmanager
+def time_limit(seconds: float | None):
+    """Raise ParseTimeout if the context runs longer than `seconds`
+
+    Note: this relies on SIGALRM so it is only enforced in the main thread of a
+    process (e.g. process workers) and is a no-op elsewhere.
+    """
+    if not seconds or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def _raise(signum, frame):
+        raise ParseTimeout(f"Timed out after {seconds} seconds")
+
+    previous = signal.signal(signal.SIGALRM, _raise)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
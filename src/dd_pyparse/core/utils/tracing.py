@@ -0,0 +1,87 @@
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from loguru import logger
+
+from dd_pyparse.core.utils.stores import ThreadLocalState
+
+TRACE_DIR = "_trace"
+
+
+def get_trace_dir(out_dir: Path) -> Path:
+    return out_dir / TRACE_DIR
+
+
+class TraceWriter(ThreadLocalState):
+    """Spans of the workers of a run in the Chrome trace event format (as read by Perfetto)
+
+    Note: every worker appends complete ("X") events to its own file, so writers
+    never interleave, and `merge_traces` joins them into one trace where each
+    worker process is a lane (and each worker thread a track within it).
+    """
+
+    def __init__(self, trace_dir: Path, run_tag: str):
+        self.trace_dir = trace_dir
+        self.run_tag = run_tag
+        super().__init__()
+
+    @property
+    def _fb(self):
+        if getattr(self._local, "pid", None) != os.getpid():
+            self.trace_dir.mkdir(parents=True, exist_ok=True)
+            pid, tid = os.getpid(), threading.get_native_id()
+            path = self.trace_dir / f"trace-{self.run_tag}-{socket.gethostname()}-{pid}-{tid}.json"
+            self._local.fb = open(path, "w")
+            self._local.pid = pid
+            # the trailing comma is dropped on merge (and tolerated by the trace viewers)
+            self._local.fb.write("[\n")
+            self._write({"name": "process_name", "ph": "M", "args": {"name": f"worker {socket.gethostname()}-{pid}"}})
+            self._write({"name": "thread_name", "ph": "M", "args": {"name": f"thread {tid}"}})
+        return self._local.fb
+
+    def _write(self, event: dict):
+        event = {"pid": os.getpid(), "tid": threading.get_native_id(), **event}
+        self._fb.write(json.dumps(event, default=str) + ",\n")
+
+    @contextmanager
+    def span(self, name: str, cat: str = "pipeline", **args):
+        """Record the duration of the context, the yielded args can be updated within it"""
+        start = time.time_ns() // 1000
+        try:
+            yield args
+        finally:
+            self._write({"name": name, "cat": cat, "ph": "X", "ts": start, "dur": time.time_ns() // 1000 - start, "args": args})
+
+    def flush(self):
+        if getattr(self._local, "fb", None) is not None:
+            self._local.fb.flush()
+
+    def close(self):
+        if getattr(self._local, "fb", None) is not None:
+            self._local.fb.close()
+            self._local.fb = None
+            self._local.pid = None
+
+
+def read_trace(path: Path) -> list[dict]:
+    """Read the events of a (possibly unterminated) trace file"""
+    text = path.read_text().rstrip().rstrip(",")
+    return json.loads(text if text.endswith("]") else text + "]")
+
+
+def merge_traces(out_dir: Path, run_tag: str, out_path: Path) -> int:
+    """Merge the trace files of the workers of a run and return the number of events"""
+    events = []
+    for path in sorted(get_trace_dir(out_dir).glob(f"trace-{run_tag}-*.json")):
+        try:
+            events.extend(read_trace(path))
+        except ValueError:
+            logger.warning(f"Unable to read trace {path}")
+    with open(out_path, "w") as fb:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fb, default=str)
+    return len(events)
@@ -0,0 +1,118 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+from loguru import logger
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """A minimal recursive inotify watcher (Linux only)
+
+    Note: directories created (or moved in) after the watcher started are watched
+    too, and the files they already contain are reported since their events may
+    have fired before the watch was added.
+    """
+
+    def __init__(self, root: Path):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+        self.overflowed = False
+        self._watches: dict[int, Path] = {}
+        self.add_tree(root)
+
+    def add_watch(self, path: Path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            logger.warning(f"Unable to watch {path}: {os.strerror(errno)}")
+            return
+        self._watches[wd] = path
+
+    def add_tree(self, root: Path) -> list[Path]:
+        """Watch a directory recursively and return the files it already contains"""
+        files = []
+        for dir_path, _, file_names in os.walk(root):
+            self.add_watch(Path(dir_path))
+            files.extend(Path(dir_path) / file_name for file_name in file_names)
+        return files
+
+    def read(self, timeout: float = None) -> list[Path]:
+        """Wait for events and return the paths of files that were written or moved in"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            parent = self._watches.get(wd)
+            if parent is None or not name:
+                continue
+
+            path = parent / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    paths.extend(self.add_tree(path))
+            elif mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO):
+                paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Debouncer:
+    """Hold paths until they have been quiet (no new events) for `quiet_period` seconds"""
+
+    def __init__(self, quiet_period: float = 5.0):
+        self.quiet_period = quiet_period
+        self._pending: dict[Path, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, path: Path, at: float = None):
+        """Record activity on a path (at a wall clock time, now by default)"""
+        at = time.time() if at is None else at
+        self._pending[path] = max(at, self._pending.get(path, at))
+
+    def ready(self, now: float = None) -> list[Path]:
+        """Pop the paths that have been quiet long enough"""
+        now = time.time() if now is None else now
+        ready = [path for path, at in self._pending.items() if now - at >= self.quiet_period]
+        for path in ready:
+            del self._pending[path]
+        return ready
@@ -1,10 +1,36 @@
-from multiprocessing import JoinableQueue, Process
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
 from pathlib import Path
-from typing import Type
+from queue import Empty
+from threading import Event, Thread, current_thread, local, main_thread
+from typing import Iterator, Type
+from uuid import uuid4
 
 from dd_pyparse.core.parsers import route_parser
 from dd_pyparse.core.parsers.base import (FileParser, FileStreamer,
                                           get_file_meta)
+from dd_pyparse.core.utils.batching import BatchPlanner, guess_file_type
+from dd_pyparse.core.utils.costs import CostStore, compute_accuracy
+from dd_pyparse.core.utils.executors import EXECUTOR_REGISTRY, Executor, ProcessExecutor, get_executor
+from dd_pyparse.core.utils.failures import FailureRegistry, is_input_failure, quarantine
+from dd_pyparse.core.utils.leases import LeaseQueue
+from dd_pyparse.core.utils.manifest import ManifestWriter, is_processed, load_processed, merge_manifests, write_shard_stats
+from dd_pyparse.core.utils.memory import MemoryBudget, estimate_footprint, get_peak_rss, get_rss, parse_memory_size, reset_peak_rss
+from dd_pyparse.core.utils.metrics import build_report, get_metrics_dir, get_metrics_path, metrics, read_snapshots, serve_metrics
+from dd_pyparse.core.utils.progress import PROGRESS_MODES, ProgressCounters, ProgressReporter
+from dd_pyparse.core.utils.profiling import PROFILERS, ParserProfiler, get_profile_dir, merge_profiles
+from dd_pyparse.core.utils.scaling import Autoscaler, CpuSampler, get_cpu_count
+from dd_pyparse.core.utils.sharding import format_shard, in_shard, parse_shard
+from dd_pyparse.core.utils.shedding import LoadShedder, parse_thresholds
+from dd_pyparse.core.utils.timeouts import get_timeout, time_limit
+from dd_pyparse.core.utils.tracing import TraceWriter, get_trace_dir, merge_traces
+from dd_pyparse.core.utils.watch import Debouncer, Inotify
 from dd_pyparse.schemas.base import Base
 from dd_pyparse.schemas.data.parents.file import File
 from dd_pyparse.schemas.enums import FileType
@@ -18,117 +44,844 @@ class Processor:
         children_dir: Path,
         out_dir: Path,
         dataset: str,
-        num_workers: int,
+        num_workers: int = None,
         extract_children: bool = False,
         pattern: str = "*",
+        batch_size: int = 1,
+        batch_max_file_size: int = 10 * 1024,
+        batch_target_latency: float = 0.5,
+        autoscale: bool = False,
+        min_workers: int = 1,
+        max_workers: int = None,
+        autoscale_interval: float = 5.0,
+        memory_budget: int = None,
+        executor: Executor = None,
+        shard: tuple[int, int] = None,
+        work_queue: Path = None,
+        lease_seconds: float = 300.0,
+        lease_batch_size: int = 16,
+        timeout_multiplier: float = 0.0,
+        failures_db: Path = None,
+        max_failures: int = 3,
+        failure_policy: str = "fallback",
+        quarantine_dir: Path = None,
+        shed_thresholds: list[int] = None,
+        cost_db: Path = None,
+        metrics_port: int = None,
+        metrics_interval: float = 5.0,
+        trace: bool = False,
+        profile: str = None,
+        profile_slow_seconds: float = 10.0,
+        progress: str = None,
+        progress_interval: float = None,
         **kwargs,
     ):
         self.in_dir = in_dir
         self.children_dir = children_dir
         self.out_dir = out_dir
         self.dataset = dataset
-        self.num_workers = num_workers
         self.extract_children = extract_children
         self.pattern = pattern
+        self.shard = shard
+        self.shard_tag = format_shard(shard)
         self.kwargs = kwargs
 
-        self.queue = JoinableQueue()
+        # the executor provides the workers and every primitive they share
+        self.executor = ProcessExecutor() if executor is None else executor
+        if self.executor.threaded and timeout_multiplier:
+            raise ValueError(f"Parse timeouts rely on SIGALRM, which {self.executor.name} workers can't receive, use another executor")
+        if self.executor.threaded and profile == "cprofile" and sys.version_info >= (3, 12):
+            raise ValueError(f"cProfile can't profile {self.executor.name} workers concurrently on Python 3.12+, use --profile sample")
+        # per worker state (workers may be threads)
+        self._local = local()
+
+        # per task telemetry of previous runs fits a cost model used to plan batches and estimate the remaining time
+        self.run_id = uuid4().hex
+        self.costs = CostStore(cost_db) if cost_db else None
+        self.cost_model = self.costs.fit() if self.costs is not None else None
+
+        # queue items are batches (lists) of files
+        self.queue = self.executor.joinable_queue()
+        self.planner = BatchPlanner(
+            max_batch_size=batch_size,
+            max_file_size=batch_max_file_size,
+            target_latency=batch_target_latency,
+            cost_model=self.cost_model,
+        )
+        # workers report observed latencies back to the dispatcher when batching
+        self.feedback = self.executor.queue() if batch_size > 1 else None
+
+        # when autoscaling, workers retire themselves while the retire counter is positive
+        self.autoscaler = Autoscaler(min_workers=min_workers, max_workers=max_workers) if autoscale else None
+        self.autoscale_interval = autoscale_interval
+        self.num_workers = self.autoscaler.initial_workers if autoscale else (num_workers or get_cpu_count())
+        self.workers = []
+        self._retire = self.executor.value("i", 0) if autoscale else None
+
+        # parsing waits while the estimated memory of in-flight files exceeds the budget
+        self.memory = None
+        if memory_budget:
+            self.memory = MemoryBudget(memory_budget, condition=self.executor.condition(), reserved=self.executor.value("q", 0))
+
+        # hosts sharing a work queue lease files from it instead of processing everything they discover
+        self.leases = LeaseQueue(work_queue, lease_seconds=lease_seconds) if work_queue else None
+        self.lease_batch_size = lease_batch_size
+
+        # files that failed before with the same parser version are skipped, get a metadata-only record or are retried
+        self.timeout_multiplier = timeout_multiplier
+        self.failures = FailureRegistry(failures_db, max_failures=max_failures) if failures_db else None
+        self.failure_policy = failure_policy
+        self.quarantine_dir = quarantine_dir
+
+        # parser options are downgraded as the backlog crosses thresholds
+        self.shedder = LoadShedder(thresholds=shed_thresholds) if shed_thresholds else None
+
+        # workers dump the metrics of their process to files that the dispatcher merges and serves
+        self.metrics_port = metrics_port
+        self.metrics_interval = metrics_interval
+        self._metrics_server = None
+        self._dispatcher_pid = os.getpid()
+
+        # spans of every worker are written as chrome trace events and merged at the end of the run
+        self.tracer = TraceWriter(get_trace_dir(out_dir), run_tag=f"{self.shard_tag}-{self.run_id}") if trace else None
+
+        # parser invocations are profiled per parser class, slow files keep their own profile
+        self.profiler = None
+        if profile:
+            self.profiler = ParserProfiler(
+                get_profile_dir(out_dir),
+                run_tag=f"{self.shard_tag}-{self.run_id}",
+                profiler=profile,
+                slow_seconds=profile_slow_seconds,
+            )
+
+        # the dispatcher and workers count queued and finished files in shared memory for live progress
+        self.progress = None
+        self.progress_mode = progress
+        self.progress_interval = progress_interval
+        if progress and progress != "none":
+            try:
+                self.progress = ProgressCounters(self.executor.array("d", ProgressCounters.size))
+            except NotImplementedError as e:
+                logger.warning(f"Progress is not available: {e}")
+
+        # in watch mode the dispatcher decides when to stop so workers ignore Ctrl-C
+        self._watching = False
+
+    def __getstate__(self) -> dict:
+        # worker handles and thread locals stay with the dispatcher when the processor is shipped to a worker
+        state = self.__dict__.copy()
+        state["workers"] = []
+        state["_metrics_server"] = None
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._local = local()
+
+    @property
+    def _buffer(self) -> list[str] | None:
+        return getattr(self._local, "buffer", None)
+
+    @_buffer.setter
+    def _buffer(self, buffer: list[str] | None):
+        self._local.buffer = buffer
+
+    @property
+    def _level(self) -> int | None:
+        """Degradation level of the file being processed (None without load shedding)"""
+        return getattr(self._local, "level", None)
+
+    @_level.setter
+    def _level(self, level: int | None):
+        self._local.level = level
+
+    @property
+    def _manifest(self) -> ManifestWriter:
+        if getattr(self._local, "manifest", None) is None:
+            self._local.manifest = ManifestWriter(self.out_dir, shard_tag=self.shard_tag)
+        return self._local.manifest
+
+    def _update_latencies(self):
+        """Drain latency observations reported by the workers"""
+        if self.feedback is None:
+            return
+        while True:
+            try:
+                observations = self.feedback.get_nowait()
+            except Empty:
+                break
+            for file_type, seconds in observations:
+                self.planner.observe(file_type, seconds)
+
+    def _discover(self) -> Iterator[Path]:
+        """Find the files to process in the input directory"""
+        logger.info(f"Searching for files in {self.in_dir}" + (f" for shard {self.shard_tag}" if self.shard else ""))
+        for file_path in self.in_dir.rglob(self.pattern):
+            # children are not discovered here so they always follow their parent's shard
+            if file_path.is_file() and (self.shard is None or in_shard(file_path, root=self.in_dir, shard=self.shard)):
+                yield file_path
+
+    def _estimate(self, file_path: Path, file_size: int) -> float:
+        """Predict the seconds of processing a file with the cost model (0 without one)"""
+        if not self.cost_model:
+            return 0.0
+        return self.cost_model.predict(guess_file_type(file_path.name), file_size) or 0.0
+
+    def _track_queued(self, file_path: Path, file_size: int = None):
+        """Count a queued file for the progress"""
+        if self.progress is None:
+            return
+        if file_size is None:
+            file_size = self._get_size(file_path)
+        self.progress.queued(guess_file_type(file_path.name), predicted=self._estimate(file_path, file_size))
+
+    @staticmethod
+    def _get_size(file_path: Path) -> int:
+        try:
+            return file_path.stat().st_size
+        except OSError:
+            return 0
 
     def _get_files(self):
         num_files = 0
-        logger.info(f"Searching for files in {self.in_dir}")
-        for file_path in self.in_dir.rglob(self.pattern):
-            if file_path.is_file():
-                self.queue.put(File(absolute_path=str(file_path)))
-                num_files += 1
-        logger.info(f"Found {num_files} files")
+        num_batches = 0
+        seconds = 0.0
+        for file_path in self._discover():
+            file_size = file_path.stat().st_size
+            seconds += self._estimate(file_path, file_size)
+            self._track_queued(file_path, file_size)
+            batches = self.planner.add(File(absolute_path=str(file_path)), file_size=file_size)
+            for batch in batches:
+                self.queue.put(batch)
+                num_batches += 1
+            num_files += 1
+            if batches:
+                self._update_latencies()
+        batch = self.planner.flush()
+        if batch:
+            self.queue.put(batch)
+            num_batches += 1
+        logger.info(f"Found {num_files} files in {num_batches} batches")
+        if self.cost_model:
+            per_worker = seconds / self.num_workers
+            logger.info(f"Estimated {seconds:.0f} seconds of processing, about {per_worker:.0f} seconds with {self.num_workers} workers")
+
+    def _seed_work_queue(self, chunk_size: int = 1000):
+        """Add the discovered files to the shared work queue (every host does this, duplicates are ignored)"""
+        num_files = 0
+        num_new = 0
+        tasks = []
+        for file_path in self._discover():
+            tasks.append((file_path.relative_to(self.in_dir).as_posix(), file_path.stat().st_size))
+            if len(tasks) >= chunk_size:
+                num_new += self.leases.add(tasks)
+                num_files += len(tasks)
+                tasks = []
+        if tasks:
+            num_new += self.leases.add(tasks)
+            num_files += len(tasks)
+        logger.info(f"Found {num_files} files of which {num_new} are new to the work queue {self.leases.db_path}")
+
+    def _get_leased_files(self):
+        """Feed the local queue from the shared work queue until no host has work left"""
+        num_files = 0
+        while True:
+            if self._get_backlog() >= self.num_workers:
+                time.sleep(0.1)
+                continue
+
+            leased = self.leases.claim(self.lease_batch_size)
+            if leased:
+                for relative_path, file_size in leased:
+                    self._track_queued(self.in_dir / relative_path, file_size)
+                    for batch in self.planner.add(File(absolute_path=str(self.in_dir / relative_path)), file_size=file_size):
+                        self.queue.put(batch)
+                batch = self.planner.flush()
+                if batch:
+                    self.queue.put(batch)
+                num_files += len(leased)
+                self._update_latencies()
+                continue
+
+            # finishing in-flight files completes our own leases
+            self.queue.join()
+            if self.leases.is_finished():
+                break
+            # other hosts hold the remaining leases, which lapse if they die
+            time.sleep(min(self.leases.lease_seconds / 10, 5.0))
+        logger.info(f"Leased {num_files} files as {self.leases.owner}")
+
+    def _renew_leases(self, stop: Event):
+        """Keep the leases of queued and in-flight files alive"""
+        while not stop.wait(self.leases.lease_seconds / 3):
+            self.leases.renew()
+
+    def _span(self, name: str, **args):
+        """Trace the duration of a context when tracing"""
+        return nullcontext(args) if self.tracer is None else self.tracer.span(name, **args)
+
+    def _profile(self, parser: type, out: dict):
+        """Profile a parser invocation when profiling"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(parser.__name__, sha256=(out.get("hash") or {}).get("sha256"), path=out.get("absolute_path"))
+
+    @contextmanager
+    def _stage(self, stage: str, **labels):
+        """Time a pipeline stage in the metrics (and trace it)"""
+        with metrics.time("stage_seconds", stage=stage, **labels), self._span(stage, **labels):
+            yield
 
     def _handle_child(self, child: Type[Base]):
-        if child.__repr_name__() == "File":
-            logger.debug(f"Putting file {child.absolute_path} in queue")
-            self.queue.put(child)
-        else:
-            logger.debug(f"Writing {child}")
-            self.write(child)
+        with self._span("handle_child", child_type=child.__repr_name__()):
+            if child.__repr_name__() == "File":
+                logger.debug(f"Putting file {child.absolute_path} in queue")
+                self._track_queued(Path(child.absolute_path), child.file_size)
+                self.queue.put([child])
+            else:
+                logger.debug(f"Writing {child}")
+                self.write(child)
 
-    def _process(self, file: Type[File]):
-        """Process a file"""
-        out = get_file_meta(file.absolute_path)
+    def _process(self, file: Type[File], out: dict) -> str:
+        """Process a file given its metadata and return its status"""
         file_type = out.get("file_type")
-        
+
         if file_type in [FileType.unknown]:
             logger.warning(f"Could not determine file type for {file.absolute_path=}, {file_type=}")
             # keep reference to file
             self.write(File(**out))
+            return "ok"
+
+        with self._span("route_parser", file_type=file_type):
+            parser, validator = route_parser(file_type)
+        sha256 = (out.get("hash") or {}).get("sha256")
+        failure = self.failures.lookup(sha256, parser) if self.failures is not None else None
+        if failure is not None and self.failure_policy != "retry":
+            logger.info(f"Known failure of {parser.__name__} on {file.absolute_path}: {failure['exception']}, {self.failure_policy}")
+            if self.failure_policy == "fallback":
+                # keep reference to file
+                self.write(File(**out))
+            return self.failure_policy
+
+        options = self._shed_load(file_type)
+        with self._reserve_memory(file_type=file_type, file_size=out.get("file_size") or 0):
+            start = time.perf_counter()
+            try:
+                with time_limit(get_timeout(file_type, multiplier=self.timeout_multiplier, file_size=out.get("file_size"))):
+                    self._local.num_units = self._parse(file=file, out=out, parser=parser, validator=validator, options=options)
+            except Exception as e:
+                self._handle_failure(file, sha256=sha256, parser=parser, error=e, seconds=time.perf_counter() - start)
+                raise
+        if self.shedder is not None:
+            self.shedder.observe(file_type, time.perf_counter() - start)
+        return "ok"
+
+    def _shed_load(self, file_type: FileType) -> dict:
+        """Pick the degradation level of a file from the backlog and return its parser options"""
+        if self.shedder is None:
+            return {}
+        backlog = self._get_backlog()
+        self._level = self.shedder.level(file_type, backlog=backlog)
+        if self._level:
+            logger.debug(f"Parsing {file_type} at degradation level {self._level} ({backlog=})")
+        return self.shedder.options(file_type, self._level)
+
+    def _handle_failure(self, file: File, sha256: str, parser: type, error: Exception, seconds: float):
+        """Remember a failure and quarantine the offending file"""
+        if not is_input_failure(error):
+            logger.warning(f"Not recording the failure of {parser.__name__} on {file.absolute_path}, it isn't the input's: {error!r}")
             return
-        
-        parser, validator = route_parser(file_type)
+        if self.failures is not None:
+            self.failures.record(sha256, parser, error=error, seconds=seconds, path=file.absolute_path)
+        if self.quarantine_dir is not None:
+            try:
+                quarantine(file.absolute_path, self.quarantine_dir, sha256=sha256, parser=parser, error=error, seconds=seconds)
+            except OSError as e:
+                logger.error(f"Unable to quarantine {file.absolute_path}: {e}")
 
+    def _reserve_memory(self, file_type: FileType, file_size: int):
+        """Reserve the estimated memory footprint of a file from the shared budget"""
+        if self.memory is None:
+            return nullcontext()
+        return self.memory.reserve(estimate_footprint(file_type=file_type, file_size=file_size))
+
+    def _parse(
+        self, file: File, out: dict, parser: Type[FileParser | FileStreamer], validator: Type[Base], options: dict = None
+    ) -> int | None:
+        """Parse a file with its routed parser, write the results and return its page or member count when known"""
+        kwargs = self.kwargs | (options or {})
+        labels = {"file_type": out.get("file_type"), "parser": parser.__name__}
         if parser.__base__ == FileParser:
-            out |= parser.parse(file=file.absolute_path, extract_children=self.extract_children, out_dir=self.children_dir, **self.kwargs)
+            with self._stage("parse", **labels), self._profile(parser, out):
+                update = parser.parse(file=file.absolute_path, extract_children=self.extract_children, out_dir=self.children_dir, **kwargs)
+                out = out | update
 
             out = out | file.model_dump(mode="dict", exclude_none=True)
-            out = validator(**out)
+            with self._stage("validate", **labels):
+                out = validator(**out)
+            num_units = getattr(out, "num_pages", None) or (len(out.children) if out.children else None)
             if out.children and self.extract_children:
                 for child in out.children:
                     self._handle_child(child)
                 del out.children
             self.write(out)
+            return num_units
 
         elif parser.__base__ == FileStreamer:
-            for child in parser.stream(file_path=file.absolute_path, extract_children=self.extract_children, out_dir=self.children_dir, **self.kwargs):
-                child.parent_id = file.id
-                if child.children and self.extract_children:
-                    for _child in child.children:
-                        self._handle_child(_child)
-                    del child.children
-                self._handle_child(child)
+            num_units = 0
+            # includes handling the children as they are streamed
+            with self._stage("stream", **labels), self._profile(parser, out):
+                children = parser.stream(
+                    file_path=file.absolute_path, extract_children=self.extract_children, out_dir=self.children_dir, **kwargs
+                )
+                for child in children:
+                    child.parent_id = file.id
+                    if child.children and self.extract_children:
+                        for _child in child.children:
+                            self._handle_child(_child)
+                        del child.children
+                    self._handle_child(child)
+                    num_units += 1
 
             out = out | file.model_dump(mode="dict", exclude_none=True)
-            out = validator(**out)
+            with self._stage("validate", **labels):
+                out = validator(**out)
             self.write(out)
+            return num_units
 
         else:
-            raise TypeError(f"Cannot parse {file_type}")
+            raise TypeError(f"Cannot parse {out.get('file_type')}")
+
+    def _process_batch(self, batch: list[File]):
+        """Process a batch of files and write their results together"""
+        observations = []
+        entries = []
+        telemetry = []
+        batch_start = time.perf_counter()
+        # buffer the output of multi-file batches so they are written at once
+        self._buffer = [] if len(batch) > 1 else None
+        for file in batch:
+            start = time.perf_counter()
+            meta, status, error = {}, "error", None
+            self._level = None if self.shedder is None else 0
+            self._local.num_units = None
+            reset_peak_rss()
+            if self.progress is not None:
+                self.progress.started()
+            with self._span("file", path=str(file.absolute_path)) as span:
+                try:
+                    with self._span("get_file_meta"):
+                        meta = get_file_meta(file.absolute_path)
+                    status = self._process(file, meta)
+                    # large files are dispatched alone, their latencies would inflate the estimates of small ones
+                    if self.planner.is_batched(meta.get("file_size")):
+                        observations.append((meta["file_type"], time.perf_counter() - start))
+                except Exception as e:
+                    logger.error(f"Error processing {file.absolute_path}: {e}")
+                    error = e
+                span.update(file_type=meta.get("file_type"), file_size=meta.get("file_size"), status=status, degradation_level=self._level)
+            elapsed = time.perf_counter() - start
+            if self.progress is not None:
+                self._track_finished(file, meta=meta, status=status, elapsed=elapsed)
+            peak_rss = get_peak_rss()
+            self._local.peak_rss = max(getattr(self._local, "peak_rss", 0), peak_rss or 0)
+            entries.append(self._get_manifest_entry(file, meta=meta, status=status, elapsed=elapsed, error=error))
+            if self.costs is not None and meta:
+                telemetry.append(self._get_telemetry(meta, status=status, elapsed=elapsed, peak_rss=peak_rss))
+            self._record_metrics(meta, status=status, elapsed=elapsed)
+        with self._stage("flush"):
+            self.flush()
+        # only record files once their output is written
+        for entry in entries:
+            self._manifest.write(entry)
+        if self.leases is not None:
+            for failed, state in [(False, "done"), (True, "failed")]:
+                paths = [e["relative_path"] for e in entries if e["relative_path"] and (e["status"] == "error") == failed]
+                self.leases.complete(paths, state=state)
+        if telemetry:
+            self.costs.record(telemetry)
+        if self.feedback is not None and observations:
+            self.feedback.put(observations)
+
+        worker = self._worker_tag
+        metrics.inc("worker_files", len(batch), worker=worker)
+        metrics.inc("worker_busy_seconds", time.perf_counter() - batch_start, worker=worker)
+        metrics.set("worker_rss_bytes", get_rss() or 0, worker=worker)
+        metrics.set("worker_peak_rss_bytes", self._local.peak_rss, worker=worker)
+        self._dump_metrics()
+        if self.tracer is not None:
+            self.tracer.flush()
+
+    @property
+    def _worker_tag(self) -> str:
+        return f"{socket.gethostname()}-{os.getpid()}-{current_thread().ident}"
+
+    def _track_finished(self, file: File, meta: dict, status: str, elapsed: float):
+        """Count a finished file for the progress, by the same guessed type and prediction it was queued with"""
+        file_path = Path(file.absolute_path)
+        file_size = meta.get("file_size")
+        if file_size is None:
+            file_size = self._get_size(file_path)
+        self.progress.finished(
+            guess_file_type(file_path.name),
+            file_size=file_size,
+            seconds=elapsed,
+            error=status == "error",
+            predicted=self._estimate(file_path, file_size),
+        )
+
+    def _record_metrics(self, meta: dict, status: str, elapsed: float):
+        """Count a processed file and observe its end to end latency"""
+        file_type = meta.get("file_type")
+        metrics.inc("files", file_type=file_type, status=status)
+        metrics.inc("bytes", meta.get("file_size") or 0, file_type=file_type)
+        metrics.inc("worker_bytes", meta.get("file_size") or 0, worker=self._worker_tag)
+        metrics.observe("file_seconds", elapsed, file_type=file_type)
+        if self._level:
+            metrics.inc("degraded_files", file_type=file_type, level=self._level)
+
+    def _dump_metrics(self, force: bool = False):
+        """Dump the metrics of this process for the dispatcher, at most every `metrics_interval` seconds"""
+        now = time.monotonic()
+        if not force and now - getattr(self._local, "metrics_dumped", 0) < self.metrics_interval:
+            return
+        self._local.metrics_dumped = now
+        path = get_metrics_path(self.out_dir, shard_tag=f"{self.shard_tag}-{self.run_id}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        metrics.dump(path)
+
+    def _get_telemetry(self, meta: dict, status: str, elapsed: float, peak_rss: int = None) -> dict:
+        """Describe the cost of a processed file for the cost model"""
+        file_type, file_size = meta.get("file_type"), meta.get("file_size")
+        return {
+            "run_id": self.run_id,
+            "file_type": None if file_type is None else str(file_type),
+            "mime_type": meta.get("mime_type"),
+            "file_size": file_size,
+            "num_units": self._local.num_units,
+            "elapsed": elapsed,
+            # per process, so shared by thread workers
+            "peak_rss": peak_rss,
+            "predicted": self.cost_model.predict(file_type, file_size) if self.cost_model else None,
+            "status": status,
+        }
+
+    def _get_manifest_entry(self, file: File, meta: dict, status: str, elapsed: float, error: Exception = None) -> dict:
+        """Describe a processed file for the manifest"""
+        file_path = Path(file.absolute_path)
+        date_modified = meta.get("date_modified")
+        return {
+            "path": str(file_path),
+            "relative_path": file_path.relative_to(self.in_dir).as_posix() if file_path.is_relative_to(self.in_dir) else None,
+            "id": file.id,
+            "parent_id": file.parent_id,
+            "file_type": meta.get("file_type"),
+            "file_size": meta.get("file_size"),
+            "mtime": date_modified.timestamp() if isinstance(date_modified, datetime) else None,
+            "sha256": (meta.get("hash") or {}).get("sha256"),
+            "status": status,
+            "error": None if error is None else f"{type(error).__name__}: {error}",
+            "elapsed": elapsed,
+            "shard": self.shard_tag,
+            "run_id": self.run_id,
+            "degradation_level": self._level,
+        }
+
+    def _should_retire(self) -> bool:
+        """Claim a pending retirement requested by the autoscaler"""
+        if self._retire is None:
+            return False
+        with self._retire.get_lock():
+            if self._retire.value > 0:
+                self._retire.value -= 1
+                return True
+        return False
 
     def _worker(self):
+        if self._watching and current_thread() is main_thread():
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if os.getpid() != self._dispatcher_pid:
+            # forked workers must not report what their parent recorded
+            metrics.reset()
         while True:
-            # get file from queue and make sure other workers don't process it
-            file = self.queue.get()
-            if file is None:
+            if self._should_retire():
+                logger.debug("Retiring worker")
                 break
+            # get batch from queue and make sure other workers don't process it
             try:
-                
-                self._process(file)
+                batch = self.queue.get() if self._retire is None else self.queue.get(timeout=self.autoscale_interval)
+            except Empty:
+                continue
+            if batch is None:
+                break
+            try:
+                self._process_batch(batch)
             except Exception as e:
-                logger.error(f"Error processing {file.absolute_path}: {e}")
+                logger.error(f"Error processing batch of {len(batch)} files: {e}")
             finally:
                 self.queue.task_done()
+        if getattr(self._local, "manifest", None) is not None:
+            self._local.manifest.close()
+        self._dump_metrics(force=True)
+        if self.tracer is not None:
+            self.tracer.close()
+        if self.profiler is not None:
+            self.profiler.dump()
 
-    def run(self):
-        """Run the processor"""
-        logger.info(f"Starting {self.num_workers} workers")
-        workers = []
+    def _start_worker(self):
+        self.workers.append(self.executor.spawn(self._worker))
+
+    def _get_backlog(self) -> int:
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            # not available on macOS
+            return 0
+
+    def _autoscale(self, stop: Event):
+        """Periodically grow or shrink the worker pool"""
+        sampler = CpuSampler()
+        while not stop.wait(self.autoscale_interval):
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            num_workers = len(self.workers) - self._retire.value
+            backlog = self._get_backlog()
+            utilization, iowait = sampler.sample()
+            target = self.autoscaler.decide(num_workers=num_workers, backlog=backlog, utilization=utilization, iowait=iowait)
+            if target == num_workers:
+                continue
+
+            logger.info(f"Scaling from {num_workers} to {target} workers ({backlog=}, {utilization=:.2f}, {iowait=:.2f})")
+            if target > num_workers:
+                for _ in range(target - num_workers):
+                    self._start_worker()
+            else:
+                with self._retire.get_lock():
+                    self._retire.value += num_workers - target
+
+    def _start_workers(self, stop: Event) -> list[Thread]:
+        """Start the workers and the background threads serving them until `stop` is set"""
+        logger.info(f"Starting {self.num_workers} {self.executor.name} workers")
         for _ in range(self.num_workers):
-            worker = Process(target=self._worker)
-            worker.start()
-            workers.append(worker)
+            self._start_worker()
 
-        self._get_files()
+        threads = []
+        if self.autoscaler is not None:
+            logger.info(f"Autoscaling between {self.autoscaler.min_workers} and {self.autoscaler.max_workers} workers")
+            threads.append(Thread(target=self._autoscale, args=(stop,), daemon=True))
+        if self.leases is not None:
+            threads.append(Thread(target=self._renew_leases, args=(stop,), daemon=True))
+        if self.progress is not None:
+            reporter = ProgressReporter(
+                self.progress,
+                get_backlog=self._get_backlog,
+                get_num_workers=lambda: len(self.workers),
+                mode=self.progress_mode,
+                interval=self.progress_interval,
+            )
+            threads.append(Thread(target=reporter.run, args=(stop,), daemon=True))
+        for thread in threads:
+            thread.start()
+        if self.metrics_port:
+            self._metrics_server = serve_metrics(self.metrics_port, self._get_metrics_snapshot)
+        return threads
+
+    def _stop_workers(self, stop: Event, threads: list[Thread]):
+        """Wait for the queued files then stop the workers and background threads"""
         self.queue.join()
+        stop.set()
+        for thread in threads:
+            thread.join()
 
         logger.info("Stopping workers")
-        for _ in range(self.num_workers):
+        for _ in self.workers:
             self.queue.put(None)
-        for worker in workers:
+        for worker in self.workers:
             worker.join()
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+
+    def _get_metrics_snapshot(self) -> dict:
+        """Merge the metrics dumped by the workers of this run"""
+        return read_snapshots(self.out_dir, pattern=f"metrics-{self.shard_tag}-{self.run_id}-*.json")
+
+    def _write_report(self, started: datetime, finished: datetime) -> dict:
+        """Write the performance report of this run from the metrics of every worker"""
+        report = build_report(self._get_metrics_snapshot())
+        seconds = (finished - started).total_seconds()
+        stages, workers = {}, {}
+        for histogram in report["histograms"]:
+            if histogram["name"] == "stage_seconds":
+                stages[histogram["stage"]] = stages.get(histogram["stage"], 0.0) + histogram["seconds"]
+        for counter in report["counters"] + report["gauges"]:
+            if "worker" in counter:
+                workers.setdefault(counter["worker"], {})[counter["name"].removeprefix("worker_")] = counter["value"]
+        for worker in workers.values():
+            worker["files_per_second"] = worker.get("files", 0) / worker["busy_seconds"] if worker.get("busy_seconds") else None
+        num_files = sum(c["value"] for c in report["counters"] if c["name"] == "files")
+        report = {
+            "run_id": self.run_id,
+            "shard": self.shard_tag,
+            "started": started,
+            "finished": finished,
+            "seconds": seconds,
+            "files_per_second": num_files / seconds if seconds else None,
+            "stage_seconds": stages,
+            "workers": workers,
+            **report,
+        }
+        out_path = get_metrics_dir(self.out_dir) / f"report-{self.shard_tag}.json"
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(out_path, "w") as fb:
+            json.dump(report, fb, indent=4, default=str)
+        files_per_second = report["files_per_second"] or 0
+        logger.info(f"Processed {num_files:.0f} files at {files_per_second:.1f} files/s, wrote performance report to {out_path}")
+        logger.info("Seconds per stage: " + ", ".join(f"{stage}={seconds:.2f}" for stage, seconds in sorted(stages.items())))
+        return report
+
+    def _write_stats(self, started: datetime):
+        extra = {}
+        if self.costs is not None:
+            extra["cost_model_accuracy"] = accuracy = compute_accuracy(self.costs.load(run_id=self.run_id))
+            if accuracy["num_files"]:
+                logger.info(
+                    f"Cost model predicted {accuracy['num_files']} files with a median relative error of "
+                    f"{accuracy['median_relative_error']:.0%} and {accuracy['total_ratio']:.2f}x the observed total"
+                )
+            else:
+                logger.info(f"Cost model had no previous telemetry in {self.costs.db_path}")
+        finished = datetime.now()
+        self._write_report(started, finished=finished)
+        if self.tracer is not None:
+            out_path = get_trace_dir(self.out_dir) / f"trace-{self.shard_tag}.json"
+            num_events = merge_traces(self.out_dir, run_tag=self.tracer.run_tag, out_path=out_path)
+            logger.info(f"Wrote {num_events} trace events to {out_path} (open in https://ui.perfetto.dev)")
+        if self.profiler is not None and self.profiler.profile_dir.exists():
+            out_paths = merge_profiles(self.profiler.profile_dir, run_tag=self.profiler.run_tag)
+            logger.info(f"Wrote {len(out_paths)} parser profiles to {self.profiler.profile_dir}")
+        stats = write_shard_stats(self.out_dir, shard_tag=self.shard_tag, run_id=self.run_id, started=started, finished=finished, **extra)
+        logger.info(f"Shard {self.shard_tag} has {stats['num_files']} processed files with {stats['num_errors']} errors")
+
+    def run(self):
+        """Run the processor"""
+        started = datetime.now()
+        stop = Event()
+        threads = self._start_workers(stop)
+        if self.leases is None:
+            self._get_files()
+        else:
+            self._seed_work_queue()
+            self._get_leased_files()
+        self._stop_workers(stop, threads)
+        self._write_stats(started)
+
+    def _is_watched(self, file_path: Path) -> bool:
+        """Check whether a reported path is an input file of this processor"""
+        for excluded in [self.out_dir, self.children_dir, self.quarantine_dir]:
+            # outputs written inside the input directory must not be picked up again
+            if excluded is not None and file_path.is_relative_to(excluded):
+                return False
+        return (
+            file_path.is_file()
+            and file_path.relative_to(self.in_dir).match(self.pattern)
+            and (self.shard is None or in_shard(file_path, root=self.in_dir, shard=self.shard))
+        )
+
+    def _enqueue_new(self, paths: list[Path], processed: dict[str, tuple[int, float]]) -> int:
+        """Queue the files that are not in the manifest (or changed since) and return how many"""
+        num_files = 0
+        for file_path in paths:
+            try:
+                if not self._is_watched(file_path):
+                    continue
+                stat = file_path.stat()
+            except OSError:
+                # removed before it settled
+                continue
+            relative_path = file_path.relative_to(self.in_dir).as_posix()
+            if is_processed(processed.get(relative_path), file_size=stat.st_size, mtime=stat.st_mtime):
+                continue
+            processed[relative_path] = (stat.st_size, stat.st_mtime)
+            self._track_queued(file_path, stat.st_size)
+            for batch in self.planner.add(File(absolute_path=str(file_path)), file_size=stat.st_size):
+                self.queue.put(batch)
+            num_files += 1
+        batch = self.planner.flush()
+        if batch:
+            self.queue.put(batch)
+        self._update_latencies()
+        return num_files
+
+    def watch(self, quiet_period: float = 5.0, poll_interval: float = 1.0):
+        """Process the input directory then keep processing files as they land until interrupted
+
+        Note: files are queued once they have had no events for `quiet_period`
+        seconds so partially written files are not parsed. Files already in the
+        manifest with the same size and mtime are skipped, so restarting the
+        watcher does not process anything twice.
+        """
+        if self.leases is not None:
+            raise ValueError("Watch mode does not support a shared work queue")
+
+        started = datetime.now()
+        self._watching = True
+        stop = Event()
+        threads = self._start_workers(stop)
+        processed = load_processed(self.out_dir)
+        debouncer = Debouncer(quiet_period)
+
+        def interrupt(signum, frame):
+            raise KeyboardInterrupt
+
+        previous = signal.signal(signal.SIGTERM, interrupt)
+        # watch before the initial scan so files landing during it are not missed
+        watcher = Inotify(self.in_dir)
+        try:
+            for file_path in self._discover():
+                debouncer.touch(file_path, at=file_path.stat().st_mtime)
+            logger.info(f"Watching {self.in_dir} with {len(processed)} files already processed")
+            while True:
+                for file_path in watcher.read(timeout=poll_interval):
+                    debouncer.touch(file_path)
+                if watcher.overflowed:
+                    logger.warning(f"Missed events in {self.in_dir}, rescanning")
+                    watcher.overflowed = False
+                    for file_path in self._discover():
+                        debouncer.touch(file_path)
+                num_files = self._enqueue_new(debouncer.ready(), processed=processed)
+                if num_files:
+                    logger.info(f"Queued {num_files} new files")
+        except KeyboardInterrupt:
+            logger.info(f"Stopping watch with {len(debouncer)} files still settling")
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            watcher.close()
+            self._stop_workers(stop, threads)
+            self._write_stats(started)
+
+    def flush(self):
+        """Write buffered records of a batch as newline-delimited json"""
+        if self._buffer:
+            out_path = self.out_dir / f"{uuid4().hex}.jsonl"
+            with open(out_path, "w") as fb:
+                fb.write("\n".join(self._buffer) + "\n")
+            logger.debug(f"Wrote {len(self._buffer)} records to {out_path}")
+        self._buffer = None
 
     def write(self, data: Type[File]):
         """Write a file to the filesystem"""
-        out_path = self.out_dir / f"{data.id}.json"
-        with open(out_path, "w") as fb:
-            out = data.model_dump_json(exclude_none=True, by_alias=True, indent=4)
-            fb.write(out)
+        if self._level is not None:
+            data.degradation_level = self._level
+        with self._stage("write", file_type=getattr(data, "file_type", None)):
+            if self._buffer is not None:
+                self._buffer.append(data.model_dump_json(exclude_none=True, by_alias=True))
+                return
+
+            out_path = self.out_dir / f"{data.id}.json"
+            with open(out_path, "w") as fb:
+                out = data.model_dump_json(exclude_none=True, by_alias=True, indent=4)
+                fb.write(out)
         logger.debug(f"Wrote {out_path}")
 
 
@@ -137,9 +890,37 @@ def process(
     children_dir: Path,
     out_dir: Path,
     dataset: str,
-    num_workers: int,
+    num_workers: int = None,
     extract_children: bool = False,
     pattern: str = "*",
+    batch_size: int = 1,
+    batch_max_file_size: int = 10 * 1024,
+    batch_target_latency: float = 0.5,
+    autoscale: bool = False,
+    min_workers: int = 1,
+    max_workers: int = None,
+    autoscale_interval: float = 5.0,
+    memory_budget: int = None,
+    executor: str = ProcessExecutor.name,
+    shard: tuple[int, int] = None,
+    work_queue: Path = None,
+    lease_seconds: float = 300.0,
+    lease_batch_size: int = 16,
+    timeout_multiplier: float = 0.0,
+    failures_db: Path = None,
+    max_failures: int = 3,
+    failure_policy: str = "fallback",
+    quarantine_dir: Path = None,
+    shed_thresholds: list[int] = None,
+    cost_db: Path = None,
+    metrics_port: int = None,
+    trace: bool = False,
+    profile: str = None,
+    profile_slow_seconds: float = 10.0,
+    progress: str = None,
+    progress_interval: float = None,
+    watch: bool = False,
+    watch_quiet_period: float = 5.0,
     **kwargs,
 ):
     """Process files"""
@@ -153,9 +934,38 @@ def process(
         num_workers=num_workers,
         extract_children=extract_children,
         pattern=pattern,
+        batch_size=batch_size,
+        batch_max_file_size=batch_max_file_size,
+        batch_target_latency=batch_target_latency,
+        autoscale=autoscale,
+        min_workers=min_workers,
+        max_workers=max_workers,
+        autoscale_interval=autoscale_interval,
+        memory_budget=memory_budget,
+        executor=get_executor(executor),
+        shard=shard,
+        work_queue=work_queue,
+        lease_seconds=lease_seconds,
+        lease_batch_size=lease_batch_size,
+        timeout_multiplier=timeout_multiplier,
+        failures_db=failures_db,
+        max_failures=max_failures,
+        failure_policy=failure_policy,
+        quarantine_dir=quarantine_dir,
+        shed_thresholds=shed_thresholds,
+        cost_db=cost_db,
+        metrics_port=metrics_port,
+        trace=trace,
+        profile=profile,
+        profile_slow_seconds=profile_slow_seconds,
+        progress=progress,
+        progress_interval=progress_interval,
         **kwargs,
     )
-    processor.run()
+    if watch:
+        processor.watch(quiet_period=watch_quiet_period)
+    else:
+        processor.run()
 
 
 def main():
@@ -172,7 +982,7 @@ def main():
             raise argparse.ArgumentTypeError('Boolean value expected.')
 
     parser = argparse.ArgumentParser(description="Process files")
-    parser.add_argument("--in_dir", type=Path, help="Input directory", required=True, default=None)
+    parser.add_argument("--in_dir", type=Path, help="Input directory", default=None)
     parser.add_argument(
         "--children_dir",
         type=Path,
@@ -180,12 +990,81 @@ def main():
         default=None,
     )
     parser.add_argument("--out_dir", type=Path, help="Output directory", required=True, default=None)
-    parser.add_argument("--dataset", type=str, help="Dataset", required=True, default=None)
-    parser.add_argument("--num_workers", type=int, help="Number of workers", required=True, default=None)
+    parser.add_argument("--dataset", type=str, help="Dataset", default=None)
+    parser.add_argument("--num_workers", type=int, help="Number of workers (defaults to the usable CPU count)", default=None)
     parser.add_argument("--extract_children", type=str2bool, default=True, help="Extract children")
     parser.add_argument("--pattern", type=str, help="Pattern", required=False, default="*")
+    parser.add_argument("--batch_size", type=int, default=1, help="Max number of small files per task (1 disables batching)")
+    parser.add_argument("--batch_max_file_size", type=int, default=10 * 1024, help="Max size in bytes of a file to be batched")
+    parser.add_argument("--batch_target_latency", type=float, default=0.5, help="Target seconds of parsing per batch")
+    parser.add_argument("--autoscale", type=str2bool, default=False, help="Scale workers with CPU utilization and backlog")
+    parser.add_argument("--min_workers", type=int, default=1, help="Min number of workers when autoscaling")
+    parser.add_argument("--max_workers", type=int, default=None, help="Max number of workers when autoscaling")
+    parser.add_argument("--autoscale_interval", type=float, default=5.0, help="Seconds between autoscaling decisions")
+    parser.add_argument(
+        "--memory_budget",
+        type=parse_memory_size,
+        default=None,
+        help="Memory shared by in-flight parses, e.g. 8G or auto (80%% of available memory)",
+    )
+    parser.add_argument(
+        "--executor",
+        type=str,
+        choices=list(EXECUTOR_REGISTRY),
+        default=ProcessExecutor.name,
+        help="Backend running the workers",
+    )
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Only process the zero-based shard INDEX/COUNT of the files")
+    parser.add_argument("--work_queue", type=Path, default=None, help="SQLite work queue shared by hosts, e.g. on NFS")
+    parser.add_argument("--lease_seconds", type=float, default=300.0, help="Seconds before a leased file is reclaimed if not renewed")
+    parser.add_argument("--lease_batch_size", type=int, default=16, help="Number of files leased at a time")
+    parser.add_argument(
+        "--timeout_multiplier", type=float, default=0.0, help="Enable and scale the per file type and size parse timeouts (0 disables)"
+    )
+    parser.add_argument("--failures_db", type=Path, default=None, help="SQLite registry of inputs that failed to parse")
+    parser.add_argument("--max_failures", type=int, default=3, help="Failures of a parser on an input before it is known bad")
+    parser.add_argument(
+        "--failure_policy",
+        type=str,
+        choices=["skip", "fallback", "retry"],
+        default="fallback",
+        help="What to do with known bad inputs: skip them, write a metadata-only record or parse them again",
+    )
+    parser.add_argument("--quarantine_dir", type=Path, default=None, help="Where to copy inputs that fail to parse")
+    parser.add_argument(
+        "--shed_thresholds",
+        type=parse_thresholds,
+        default=None,
+        help=(
+            "Backlog sizes (in batches) at which parsing degrades a level, e.g. 100,1000 "
+            "(partial PDFs without images, no video probes, truncated sheets)"
+        ),
+    )
+    parser.add_argument("--cost_db", type=Path, default=None, help="SQLite store of per file telemetry used to learn processing costs")
+    parser.add_argument("--metrics_port", type=int, default=None, help="Serve Prometheus metrics on this port while running")
+    parser.add_argument("--trace", type=str2bool, default=False, help="Write a Chrome trace of the workers' spans (viewable in Perfetto)")
+    parser.add_argument(
+        "--profile", type=str, choices=PROFILERS, default=None, help="Profile parser invocations with cProfile or stack sampling"
+    )
+    parser.add_argument("--profile_slow_seconds", type=float, default=10.0, help="Keep the full profile of files slower than this")
+    parser.add_argument(
+        "--progress",
+        type=str,
+        choices=PROGRESS_MODES,
+        default="none",
+        help="Live progress on stderr, off by default: a status line, json lines or auto (a status line on a terminal, else json lines)",
+    )
+    parser.add_argument("--progress_interval", type=float, default=None, help="Seconds between progress reports (1 for tty, 30 for json)")
+    parser.add_argument("--watch", type=str2bool, default=False, help="Keep processing files as they land in in_dir until interrupted")
+    parser.add_argument("--watch_quiet_period", type=float, default=5.0, help="Seconds without changes before a watched file is processed")
+    parser.add_argument("--merge_manifests", type=str2bool, default=False, help="Merge the manifests and stats of all shards and exit")
     args = parser.parse_args()
     logger.info(f"Running with {args=}")
+    if args.merge_manifests:
+        merge_manifests(args.out_dir)
+        return
+    if args.in_dir is None or args.dataset is None:
+        parser.error("--in_dir and --dataset are required unless merging manifests")
     if args.extract_children and not args.children_dir:
         raise ValueError("Must provide children_dir if extract_children is True")
 
@@ -197,6 +1076,34 @@ def main():
         num_workers=args.num_workers,
         extract_children=args.extract_children,
         pattern=args.pattern,
+        batch_size=args.batch_size,
+        batch_max_file_size=args.batch_max_file_size,
+        batch_target_latency=args.batch_target_latency,
+        autoscale=args.autoscale,
+        min_workers=args.min_workers,
+        max_workers=args.max_workers,
+        autoscale_interval=args.autoscale_interval,
+        memory_budget=args.memory_budget,
+        executor=args.executor,
+        shard=args.shard,
+        work_queue=args.work_queue,
+        lease_seconds=args.lease_seconds,
+        lease_batch_size=args.lease_batch_size,
+        timeout_multiplier=args.timeout_multiplier,
+        failures_db=args.failures_db,
+        max_failures=args.max_failures,
+        failure_policy=args.failure_policy,
+        quarantine_dir=args.quarantine_dir,
+        shed_thresholds=args.shed_thresholds,
+        cost_db=args.cost_db,
+        metrics_port=args.metrics_port,
+        trace=args.trace,
+        profile=args.profile,
+        profile_slow_seconds=args.profile_slow_seconds,
+        progress=args.progress,
+        progress_interval=args.progress_interval,
+        watch=args.watch,
+        watch_quiet_period=args.watch_quiet_period,
     )
 
 if __name__ == "__main__":
@@ -1,23 +1,69 @@
-from dd_pyparse.core.parsers import parse
+import asyncio
+import hashlib
+import json
+import shutil
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from dd_pyparse.core.utils.metrics import metrics, to_prometheus
 from dd_pyparse.schemas.settings import Settings
-from dd_pyparse.utils.exceptions import (python_exception_handler,
+from dd_pyparse.utils.cache import ResultCache, get_cache_key, reingest
+from dd_pyparse.utils.exceptions import (ParseTimeout, UnsupportedFileType,
+                                         python_exception_handler,
                                          validation_exception_handler)
-from dd_pyparse.utils.health import ServiceHealthStatus, service_health
+from dd_pyparse.utils.health import (ServiceHealth, ServiceHealthStatus,
+                                     service_health)
 from dd_pyparse.utils.info import ServiceInfo, service_info
+from dd_pyparse.utils.jobs import JobManager, JobQueueFull, JobState, JobStatus
 from dd_pyparse.utils.logging import logger
+from dd_pyparse.utils.pool import (ParserPool, parse_file, parse_upload,
+                                   stream_file, stream_upload)
+from dd_pyparse.utils.references import FileReference, resolve_reference
+from dd_pyparse.utils.uploads import (IncomingFile, receive_multipart,
+                                      receive_tar)
 
 try:
     import uvicorn
-    from fastapi import FastAPI, File, Query, UploadFile
+    from fastapi import FastAPI, HTTPException, Query, Request, status
+    from fastapi.concurrency import run_in_threadpool
     from fastapi.exceptions import RequestValidationError
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import (FileResponse, PlainTextResponse,
+                                   StreamingResponse)
 except ImportError:
     logger.error("Failed to import uvicorn and/or fastapi. Please install them with `pip install uvicorn fastapi`")
     exit(1)
 
 settings = Settings()
+pool = ParserPool(size=settings.pool_size, timeout=settings.request_timeout, start_method=settings.pool_start_method)
+cache = ResultCache(max_entries=settings.cache_size, disk_dir=settings.cache_dir) if settings.cache_size or settings.cache_dir else None
+jobs = JobManager(
+    pool,
+    jobs_dir=settings.jobs_dir,
+    max_queued=settings.job_queue_size,
+    concurrency=settings.job_concurrency or max(pool.size // 2, 1),
+    ttl=settings.job_ttl,
+)
+
+TAR_CONTENT_TYPES = ["application/x-tar", "application/tar", "application/x-gtar", "application/gzip", "application/octet-stream"]
+
 
-app = FastAPI(title=service_info.title, version=service_info.version, description=service_info.description)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(pool.start)
+    await jobs.start()
+    service_health.status = ServiceHealthStatus.OK
+    yield
+    service_health.status = ServiceHealthStatus.PENDING
+    await jobs.stop()
+    pool.shutdown()
+
+
+app = FastAPI(title=service_info.title, version=service_info.version, description=service_info.description, lifespan=lifespan)
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"])
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
@@ -25,8 +71,21 @@ app.add_exception_handler(Exception, python_exception_handler)
 
 
 @app.get("/health")
-async def health() -> ServiceHealthStatus:
-    return service_health.status
+async def health() -> ServiceHealth:
+    return ServiceHealth(status=service_health.status, pool=pool.stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    """Metrics in the Prometheus text format, including the pool's saturation and the cache's hit rate"""
+    for name, value in pool.stats.model_dump().items():
+        metrics.set(f"pool_{name}", value)
+    metrics.set("jobs_queued", jobs.queued)
+    metrics.set("jobs_running", jobs.running)
+    if cache is not None:
+        for name in ["entries", "hit_rate"]:
+            metrics.set(f"cache_{name}", cache.stats[name])
+    return to_prometheus(metrics.snapshot())
 
 
 @app.get("/info")
@@ -34,22 +93,253 @@ async def info() -> ServiceInfo:
     return service_info
 
 
-@app.post("/infer")
+def get_upload_body(field: str, many: bool = False) -> dict:
+    """Document a multipart body the endpoint receives itself (without spooling it first)"""
+    schema = {"type": "string", "format": "binary"}
+    if many:
+        schema = {"type": "array", "items": schema}
+    content = {"multipart/form-data": {"schema": {"type": "object", "required": [field], "properties": {field: schema}}}}
+    return {"requestBody": {"required": True, "content": content}}
+
+
+async def receive_upload(request: Request, out_dir: Path) -> IncomingFile:
+    files = await receive_multipart(request, out_dir, field="file")
+    if len(files) != 1:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Expected one file in `file`, got {len(files)}")
+    return files[0]
+
+
+async def run_cached(key: str, fn, *args, **kwargs) -> dict:
+    """Run a parse in the worker pool unless its result is cached, each response being a new ingestion"""
+    if cache is None:
+        return await pool.run(fn, *args, **kwargs)
+    return reingest(await cache.get_or_compute(key, partial(pool.run, fn, *args, **kwargs)))
+
+
+async def parse_cached(file_meta: dict, **kwargs) -> dict:
+    """Parse a received file in the worker pool unless the same content was parsed with the same options"""
+    # the extension takes part in detecting the file type
+    key = get_cache_key(file_meta["hash"]["sha256"], {"file_extension": file_meta["file_extension"].lower(), **kwargs})
+    out = await run_cached(key, parse_upload, file_meta["absolute_path"], file_meta=file_meta, **kwargs)
+    # the result may be that of the same content uploaded under another name
+    return out | {"file_name": file_meta["file_name"]}
+
+
+@contextmanager
+def parse_errors():
+    """Answer the failures of a parse with their status codes"""
+    try:
+        yield
+    except (ParseTimeout, asyncio.TimeoutError) as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e) or "Timed out waiting for a parsing worker")
+    except UnsupportedFileType as e:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+
+
+@app.post("/infer", openapi_extra=get_upload_body("file"))
 async def infer(
-    file: UploadFile = File(...),
+    request: Request,
+    extract_children: bool = Query(False, description="Extract children"),
+):
+    """Parse a file (multipart `file`) in the worker pool"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file = await receive_upload(request, Path(tmp_dir))
+        with parse_errors():
+            file_meta = await run_in_threadpool(file.get_file_meta)
+            return await parse_cached(
+                file_meta,
+                extract_children=extract_children,
+                out_dir=settings.children_dir,
+                timeout_multiplier=settings.timeout_multiplier,
+            )
+
+
+def stream_records(tmp_dir: tempfile.TemporaryDirectory, fn, file_path: Path, **kwargs) -> StreamingResponse:
+    """Stream the json lines a worker writes while parsing a file, removing the temporary directory when done
+
+    Note: the response has started by the time a parse fails, so failures are
+    reported by a last line with `"error": true`.
+    """
+
+    async def records():
+        try:
+            async for line in pool.stream(fn, Path(tmp_dir.name) / "records.jsonl", file_path, **kwargs):
+                yield line
+        except Exception as e:
+            logger.error(f"Failed to stream {file_path.name}: {e}")
+            yield json.dumps({"error": True, "message": str(e) or type(e).__name__}) + "\n"
+        finally:
+            tmp_dir.cleanup()
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+@app.post("/infer/stream", openapi_extra=get_upload_body("file"))
+async def infer_stream(
+    request: Request,
     extract_children: bool = Query(False, description="Extract children"),
-    **kwargs,
 ):
-    """Infer the file type of a file"""
+    """Parse a file (multipart `file`) in the worker pool, streaming a json record per line as archive or mailbox children are parsed"""
+    tmp_dir = tempfile.TemporaryDirectory()
+    try:
+        file = await receive_upload(request, Path(tmp_dir.name) / "upload")
+        file_meta = await run_in_threadpool(file.get_file_meta)
+    except BaseException:
+        tmp_dir.cleanup()
+        raise
 
-    return parse(
-        file=file.file,
+    return stream_records(
+        tmp_dir,
+        stream_upload,
+        file.file_path,
+        file_meta=file_meta,
         extract_children=extract_children,
         out_dir=settings.children_dir,
-        **kwargs,
+        timeout_multiplier=settings.timeout_multiplier,
     )
 
 
+async def receive_batch(request: Request, out_dir: Path) -> list[IncomingFile]:
+    """Receive the files of a batch request in order"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "multipart/form-data":
+        return await receive_multipart(request, out_dir, field="files")
+    if content_type in TAR_CONTENT_TYPES:
+        return await receive_tar(request, out_dir)
+    raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Expected multipart files or a tar, got {content_type}")
+
+
+async def parse_item(file: IncomingFile, **kwargs) -> dict:
+    """Parse a file of a batch in the worker pool, a failure becomes an error record instead of failing the batch"""
+    try:
+        file_meta = await run_in_threadpool(file.get_file_meta)
+        return await parse_cached(file_meta, **kwargs)
+    except Exception as e:
+        logger.error(f"Failed to parse {file.file_path.name}: {e}")
+        return {"error": True, "message": str(e) or type(e).__name__, "file_name": file.file_path.name}
+
+
+@app.post("/infer/batch", openapi_extra=get_upload_body("files", many=True))
+async def infer_batch(
+    request: Request,
+    extract_children: bool = Query(False, description="Extract children"),
+    stream: bool = Query(False, description="Stream the results as json lines in the order they finish"),
+):
+    """Parse many files concurrently in the worker pool, sent as multipart `files` or as a single tar body
+
+    Note: results are returned in the order of the files, or streamed with the
+    `index` of their file as they finish. A file that fails gets an error record.
+    """
+    tmp_dir = tempfile.TemporaryDirectory()
+    try:
+        files = await receive_batch(request, Path(tmp_dir.name))
+    except BaseException:
+        tmp_dir.cleanup()
+        raise
+
+    kwargs = {"extract_children": extract_children, "out_dir": settings.children_dir, "timeout_multiplier": settings.timeout_multiplier}
+    tasks = [asyncio.ensure_future(parse_item(file, **kwargs)) for file in files]
+    if not stream:
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            tmp_dir.cleanup()
+
+    async def indexed(index: int, task: asyncio.Future) -> dict:
+        return {"index": index} | await task
+
+    async def records():
+        try:
+            for result in asyncio.as_completed([indexed(i, task) for i, task in enumerate(tasks)]):
+                yield json.dumps(await result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            tmp_dir.cleanup()
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+@app.post("/infer/path")
+async def infer_path(
+    reference: FileReference,
+    extract_children: bool = Query(False, description="Extract children"),
+    stream: bool = Query(False, description="Stream a json record per line as for /infer/stream"),
+):
+    """Parse a file in place from a path or file:// URI under an allowed root, without uploading it
+
+    Note: results are cached by the path, size and modification time of the
+    file, so a cached result is found without reading the file.
+    """
+    file_path = resolve_reference(reference.path, allowed_roots=settings.allowed_roots)
+    kwargs = {"extract_children": extract_children, "out_dir": settings.children_dir, "timeout_multiplier": settings.timeout_multiplier}
+    if stream:
+        return stream_records(tempfile.TemporaryDirectory(), stream_file, file_path, **kwargs)
+
+    file_stat = file_path.stat()
+    reference_hash = hashlib.sha256(f"{file_path}\0{file_stat.st_size}\0{file_stat.st_mtime_ns}".encode()).hexdigest()
+    with parse_errors():
+        return await run_cached(get_cache_key(reference_hash, kwargs), parse_file, file_path, **kwargs)
+
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED, openapi_extra=get_upload_body("file"))
+async def submit_job(
+    request: Request,
+    extract_children: bool = Query(False, description="Extract children"),
+) -> JobStatus:
+    """Parse a file in the background, uploaded (multipart `file`) or by reference (json {"path": ...} as for /infer/path)
+
+    Note: the job's id is returned at once, its records are retrieved from
+    /jobs/{job_id}/results once its state is done.
+    """
+    try:
+        job_id = jobs.new_job_id()
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+    kwargs = {"extract_children": extract_children, "out_dir": settings.children_dir, "timeout_multiplier": settings.timeout_multiplier}
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "application/json":
+        try:
+            reference = FileReference.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        file_path = resolve_reference(reference.path, allowed_roots=settings.allowed_roots)
+        submit = partial(jobs.submit, job_id, file_path, **kwargs)
+    else:
+        try:
+            file = await receive_upload(request, jobs.get_input_dir(job_id))
+            file_meta = await run_in_threadpool(file.get_file_meta)
+        except BaseException:
+            await run_in_threadpool(shutil.rmtree, jobs.get_job_dir(job_id), ignore_errors=True)
+            raise
+        submit = partial(jobs.submit, job_id, file.file_path, temporary=True, file_meta=file_meta, **kwargs)
+
+    try:
+        return submit()
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> JobStatus:
+    """The state of a job and the number of records parsed so far"""
+    job = await run_in_threadpool(jobs.get_status, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No such job: {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}/results", response_class=FileResponse)
+async def get_job_results(job_id: str):
+    """The records of a finished job, a json record per line"""
+    job = await get_job(job_id)
+    if job.state != JobState.DONE:
+        detail = f"Job {job_id} failed: {job.error}" if job.state == JobState.FAILED else f"Job {job_id} is {job.state}"
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
+    return FileResponse(jobs.get_results_path(job_id), media_type="application/x-ndjson")
+
+
 def main():
     uvicorn.run("dd_pyparse.interfaces._fastapi:app", host=settings.host, port=settings.port, reload=settings.reload)
 
@@ -19,6 +19,9 @@ class Base(BaseModel):
     annotations: Optional[list[Annotation]] = Field(None, description="Annotations about the data")
     dataset: Optional[constr(to_upper=True, strip_whitespace=True, strict=True)] = Field(None, description="Dataset name")
     data_type: Optional[DataType] = Field(None, example=DataType.image, description="Data type")
+    degradation_level: Optional[int] = Field(
+        None, description="Load shedding level of the parse that produced the data (0 is a full parse)"
+    )
     date_ingested: Optional[datetime] = Field(
         default_factory=lambda: datetime.now(), description="Date and time the data was ingested into the system"
     )
@@ -1,3 +1,4 @@
+from pathlib import Path
 from typing import Optional
 
 from pydantic import Field
@@ -13,6 +14,28 @@ class Settings(BaseSettings):
     log_file: Optional[str] = Field(None, description="File to write logs to if desired")
     log_level: Optional[str] = Field("INFO", validation_alias="LOG_LEVEL", description="Log level")
     es_config: Optional[ElasticsearchConfig] = Field(None, description="Elasticsearch configuration object")
+    children_dir: Optional[Path] = Field(None, validation_alias="CHILDREN_DIR", description="Where to extract children to")
+    pool_size: Optional[int] = Field(None, validation_alias="POOL_SIZE", description="Parsing processes (defaults to the usable CPU count)")
+    pool_start_method: str = Field("forkserver", validation_alias="POOL_START_METHOD", description="How parsing processes are started")
+    request_timeout: Optional[float] = Field(
+        1800.0, validation_alias="REQUEST_TIMEOUT", description="Seconds a request may wait for its result, queueing included (0 disables)"
+    )
+    timeout_multiplier: float = Field(
+        1.0, validation_alias="TIMEOUT_MULTIPLIER", description="Scale the per file type parse timeouts (0 disables)"
+    )
+    cache_size: int = Field(1024, validation_alias="CACHE_SIZE", description="Parse results kept in memory (0 disables)")
+    cache_dir: Optional[Path] = Field(None, validation_alias="CACHE_DIR", description="Where to keep every parse result on disk as well")
+    allowed_roots: list[Path] = Field(
+        [], validation_alias="ALLOWED_ROOTS", description="Directories files may be parsed from in place, as a json list (none disables it)"
+    )
+    jobs_dir: Path = Field(Path("jobs"), validation_alias="JOBS_DIR", description="Where background jobs keep their state and results")
+    job_queue_size: int = Field(100, validation_alias="JOB_QUEUE_SIZE", description="Jobs that may wait before submissions are refused")
+    job_concurrency: Optional[int] = Field(
+        None, validation_alias="JOB_CONCURRENCY", description="Jobs running at once (defaults to half of the pool)"
+    )
+    job_ttl: float = Field(
+        86400.0, validation_alias="JOB_TTL", description="Seconds finished jobs and their results are kept for (0 keeps them)"
+    )
     model_config = SettingsConfigDict(env_file=".env", env_nested_delimiter="__", use_enum_values=True)
 
 
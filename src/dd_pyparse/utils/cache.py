@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from loguru import logger
+
+from dd_pyparse.core.utils.metrics import metrics
+
+
+def get_cache_key(sha256: str, options: dict) -> str:
+    """Key a result by the content hash of its file and the options it was parsed with"""
+    options_hash = hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"{sha256}-{options_hash}"
+
+
+def reingest(record: dict, parent_id: str = None) -> dict:
+    """Copy a cached record (and its children) with the id and ingestion date of a new ingestion"""
+    record = record | {"id": uuid4().hex, "date_ingested": datetime.now().isoformat()}
+    if parent_id is not None:
+        record["parent_id"] = parent_id
+    if record.get("children"):
+        record["children"] = [reingest(child, parent_id=record["id"]) for child in record["children"]]
+    return record
+
+
+class ResultCache:
+    """Parse results by file hash and options, in memory and optionally on disk
+
+    Note: the memory tier is an LRU of `max_entries` results, the disk tier (when
+    given a directory) keeps every result and survives restarts. Concurrent
+    requests for a key being computed wait for that computation instead of
+    starting their own.
+    """
+
+    def __init__(self, max_entries: int = 1024, disk_dir: Path = None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        if disk_dir is not None:
+            disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.coalesced = 0
+
+    def _get_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _remember(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is None and self.disk_dir is not None:
+            try:
+                value = json.loads(self._get_path(key).read_text())
+                self._remember(key, value)
+                tier = "disk"
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache entry {key}: {e}")
+        else:
+            tier = "memory"
+
+        if value is None:
+            self.misses += 1
+            metrics.inc("cache_requests", result="miss")
+        else:
+            self.hits[tier] += 1
+            metrics.inc("cache_requests", result="hit", tier=tier)
+        return value
+
+    def put(self, key: str, value: dict):
+        self._remember(key, value)
+        if self.disk_dir is None:
+            return
+        path = self._get_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}")
+        tmp_path.write_text(json.dumps(value))
+        os.replace(tmp_path, path)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[dict]]) -> dict:
+        """Get a result or compute it once, however many requests ask for it meanwhile"""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            metrics.inc("cache_coalesced")
+            try:
+                # shielded so a waiter that goes away doesn't cancel the others' computation
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # the request computing it went away, not this one
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get_or_compute(key, compute)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await asyncio.to_thread(self.get, key)
+            if value is None:
+                value = await compute()
+                await asyncio.to_thread(self.put, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # retrieved so a failure nobody else waited for isn't reported as never retrieved
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    @property
+    def stats(self) -> dict:
+        hits = sum(self.hits.values())
+        return {
+            "entries": len(self._entries),
+            "hits": hits,
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": hits / (hits + self.misses) if hits + self.misses else 0.0,
+        }
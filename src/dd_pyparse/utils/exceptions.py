@@ -15,6 +15,10 @@ class UnsupportedFileType(Exception):
     pass
 
 
+class ParseTimeout(Exception):
+    pass
+
+
 def get_error_response(exc) -> dict:
     """
     Generic error handling function
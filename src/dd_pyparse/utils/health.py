@@ -1,4 +1,5 @@
 from enum import StrEnum
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -9,8 +10,17 @@ class ServiceHealthStatus(StrEnum):
     ERROR = "ERROR"
 
 
+class PoolStats(BaseModel):
+    size: int
+    in_flight: int
+    queued: int
+    # in flight over size, over 1 when requests wait for a worker
+    saturation: float
+
+
 class ServiceHealth(BaseModel):
     status: ServiceHealthStatus = ServiceHealthStatus.PENDING
+    pool: Optional[PoolStats] = None
 
 
 service_health = ServiceHealth()
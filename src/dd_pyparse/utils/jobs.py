@@ -0,0 +1,256 @@
+import asyncio
+import json
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from enum import StrEnum
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+from loguru import logger
+from pydantic import BaseModel
+
+from dd_pyparse.core.utils.stores import SQLiteStore
+from dd_pyparse.utils.pool import ParserPool, stream_file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT 'queued',
+    file_name TEXT,
+    file_path TEXT NOT NULL,
+    temporary INTEGER NOT NULL DEFAULT 0,
+    options TEXT,
+    num_records INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+INPUT = "input"
+RESULTS = "records.jsonl"
+
+
+class JobState(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class JobStatus(BaseModel):
+    id: str
+    state: JobState
+    file_name: Optional[str] = None
+    num_records: int = 0
+    error: Optional[str] = None
+    created: Optional[datetime] = None
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobStore(SQLiteStore):
+    """Job states in a SQLite database next to their results
+
+    Note: the service reads the store from its worker threads, each with its
+    own connection waiting up to `timeout` seconds on the database lock.
+    """
+
+    schema = SCHEMA
+    row_factory = sqlite3.Row
+
+    def add(self, job_id: str, file_path: Path, file_name: str, temporary: bool, options: dict):
+        self._conn.execute(
+            "INSERT INTO jobs (id, file_name, file_path, temporary, options, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, file_name, str(file_path), int(temporary), json.dumps(options, default=str), time.time()),
+        )
+
+    def update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_unfinished(self) -> list[dict]:
+        rows = self._conn.execute("SELECT * FROM jobs WHERE state IN ('queued', 'running') ORDER BY created").fetchall()
+        return [dict(row) for row in rows]
+
+    def get_expired(self, before: float) -> list[str]:
+        """Ids of the jobs that finished before a time"""
+        rows = self._conn.execute("SELECT id FROM jobs WHERE state IN ('done', 'failed') AND finished < ?", (before,)).fetchall()
+        return [row["id"] for row in rows]
+
+    def delete(self, job_id: str):
+        self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+class JobManager:
+    """Parse large files in the background, a bounded queue of jobs feeding the worker pool
+
+    Note: `concurrency` jobs run at once so interactive requests keep a share of
+    the pool. Records are written to the job's directory as they are parsed and
+    the state is kept in SQLite, so finished results survive a restart and jobs
+    that were queued or running are run again. Finished jobs are deleted with
+    their results `ttl` seconds after they finished (0 keeps them).
+    """
+
+    def __init__(
+        self,
+        pool: ParserPool,
+        jobs_dir: Path,
+        max_queued: int = 100,
+        concurrency: int = 1,
+        progress_interval: float = 1.0,
+        ttl: float = 86400.0,
+        cleanup_interval: float = 600.0,
+    ):
+        self.pool = pool
+        self.jobs_dir = jobs_dir
+        self.max_queued = max_queued
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.store = None
+        self.running = 0
+        self._queue = None
+        self._runners = []
+        # metadata of uploads hashed as they were received, lost on a restart
+        self._file_meta: dict[str, dict] = {}
+
+    def get_job_dir(self, job_id: str) -> Path:
+        return self.jobs_dir / job_id
+
+    def get_input_dir(self, job_id: str) -> Path:
+        """Where a file uploaded for a job is kept until it is parsed"""
+        return self.get_job_dir(job_id) / INPUT
+
+    def get_results_path(self, job_id: str) -> Path:
+        return self.get_job_dir(job_id) / RESULTS
+
+    def _check_capacity(self):
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"{self._queue.qsize()} jobs are queued already")
+
+    def new_job_id(self) -> str:
+        """Get an id for a job, raising JobQueueFull before anything is received when no more may be queued"""
+        self._check_capacity()
+        return uuid4().hex
+
+    async def start(self):
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.store = await asyncio.to_thread(JobStore, self.jobs_dir / "jobs.db")
+        self._queue = asyncio.Queue()
+        for job_id in await asyncio.to_thread(self._requeue_unfinished):
+            self._queue.put_nowait(job_id)
+        self._runners = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        if self.ttl:
+            self._runners.append(asyncio.create_task(self._clean()))
+
+    async def stop(self):
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+
+    def _requeue_unfinished(self) -> list[str]:
+        """Mark the jobs that were queued or running when the service stopped as queued again"""
+        jobs = self.store.get_unfinished()
+        for job in jobs:
+            logger.info(f"Resuming {job['state']} job {job['id']}")
+            self.store.update(job["id"], state=JobState.QUEUED, num_records=0, started=None)
+        return [job["id"] for job in jobs]
+
+    def submit(
+        self, job_id: str, file_path: Path, file_name: str = None, temporary: bool = False, file_meta: dict = None, **options
+    ) -> JobStatus:
+        """Queue a job parsing a file with the options of `parse`, the input directory of `temporary` files is deleted once it finishes"""
+        self._check_capacity()
+        self.get_job_dir(job_id).mkdir(parents=True, exist_ok=True)
+        self.store.add(job_id, file_path=file_path, file_name=file_name or file_path.name, temporary=temporary, options=options)
+        if file_meta is not None:
+            self._file_meta[job_id] = file_meta
+        self._queue.put_nowait(job_id)
+        return self.get_status(job_id)
+
+    def get_status(self, job_id: str) -> JobStatus | None:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        for name in ["created", "started", "finished"]:
+            job[name] = datetime.fromtimestamp(job[name]) if job[name] else None
+        return JobStatus(**job)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self):
+        while True:
+            job_id = await self._queue.get()
+            self.running += 1
+            try:
+                await self._run_job(job_id)
+            finally:
+                self.running -= 1
+
+    def remove_expired(self) -> int:
+        """Delete the jobs that finished more than `ttl` seconds ago with their results"""
+        job_ids = self.store.get_expired(time.time() - self.ttl)
+        for job_id in job_ids:
+            shutil.rmtree(self.get_job_dir(job_id), ignore_errors=True)
+            self.store.delete(job_id)
+        if job_ids:
+            logger.info(f"Removed {len(job_ids)} expired jobs")
+        return len(job_ids)
+
+    async def _clean(self):
+        while True:
+            await asyncio.to_thread(self.remove_expired)
+            await asyncio.sleep(self.cleanup_interval)
+
+    async def _run_job(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        file_path, options = Path(job["file_path"]), json.loads(job["options"])
+        if options.get("out_dir") is not None:
+            options["out_dir"] = Path(options["out_dir"])
+        results_path = self.get_results_path(job_id)
+        # a job run again after a restart starts over
+        results_path.unlink(missing_ok=True)
+        results_path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self.store.update, job_id, state=JobState.RUNNING, started=time.time())
+        num_records, updated = 0, time.monotonic()
+        try:
+            async for _ in self.pool.stream(
+                stream_file, results_path, file_path, temporary=bool(job["temporary"]), file_meta=self._file_meta.get(job_id), **options
+            ):
+                num_records += 1
+                if time.monotonic() - updated > self.progress_interval:
+                    await asyncio.to_thread(self.store.update, job_id, num_records=num_records)
+                    updated = time.monotonic()
+            await asyncio.to_thread(self.store.update, job_id, state=JobState.DONE, num_records=num_records, finished=time.time())
+            logger.info(f"Job {job_id} parsed {num_records} records from {job['file_name']}")
+        except asyncio.CancelledError:
+            # left running so the job is resumed by the next start
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            error = str(e) or type(e).__name__
+            await asyncio.to_thread(
+                self.store.update, job_id, state=JobState.FAILED, num_records=num_records, error=error, finished=time.time()
+            )
+
+        self._file_meta.pop(job_id, None)
+        if job["temporary"]:
+            shutil.rmtree(self.get_input_dir(job_id), ignore_errors=True)
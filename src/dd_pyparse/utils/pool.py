@@ -0,0 +1,178 @@
+import asyncio
+import json
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+from loguru import logger
+
+from dd_pyparse.core.utils.scaling import get_cpu_count
+from dd_pyparse.utils.health import PoolStats
+
+# imported by the fork server so workers forked from it start with the parsers loaded
+PRELOAD = ["dd_pyparse.core.parsers"]
+
+
+def _warm():
+    # imports the parsers in workers that weren't forked from a preloaded server
+    import dd_pyparse.core.parsers  # noqa: F401
+
+
+def parse_file(file_path: Path, **kwargs) -> dict:
+    """Parse a file in a pool worker"""
+    from dd_pyparse.core.parsers import parse
+
+    return parse(file_path, mode="json", **kwargs)
+
+
+def parse_upload(file_path: Path, **kwargs) -> dict:
+    """Parse an uploaded file in a pool worker"""
+    out = parse_file(file_path, **kwargs)
+    # the upload is a temporary file
+    out.pop("absolute_path", None)
+    return out
+
+
+def stream_file(file_path: Path, out_path: Path, temporary: bool = False, **kwargs) -> int:
+    """Parse a file in a pool worker, appending each record to `out_path` as a json line"""
+    from dd_pyparse.core.parsers import stream
+
+    num_records = 0
+    with open(out_path, "a") as fb:
+        for record in stream(file_path, mode="json", **kwargs):
+            if temporary and record.get("absolute_path") == str(file_path):
+                del record["absolute_path"]
+            fb.write(json.dumps(record) + "\n")
+            fb.flush()
+            num_records += 1
+    return num_records
+
+
+def stream_upload(file_path: Path, out_path: Path, **kwargs) -> int:
+    """Parse an uploaded file in a pool worker, appending each record to `out_path` as a json line"""
+    return stream_file(file_path, out_path, temporary=True, **kwargs)
+
+
+class ParserPool:
+    """A pre-warmed process pool running parses off the event loop
+
+    Note: parse timeouts are enforced in the workers (as in batch mode) while
+    `timeout` bounds how long a request waits, queueing included. Requests in
+    flight beyond the pool size wait for a worker, which `stats` reports as
+    saturation over 1.
+    """
+
+    def __init__(self, size: int = None, timeout: float = None, start_method: str = "forkserver"):
+        self.size = size or get_cpu_count()
+        self.timeout = timeout or None
+        self.start_method = start_method if start_method in multiprocessing.get_all_start_methods() else "spawn"
+        self.in_flight = 0
+        # slots are released from the executor's thread when the work finishes
+        self._slots_lock = threading.Lock()
+        self._executor = None
+        # held while the pool restarts, requests wait for the new one instead of failing on the broken one
+        self._lock = asyncio.Lock()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == "forkserver":
+            context.set_forkserver_preload(PRELOAD)
+        executor = ProcessPoolExecutor(max_workers=self.size, mp_context=context, initializer=_warm)
+        # submitted at once, none finds an idle worker so each starts one
+        wait([executor.submit(_warm) for _ in range(self.size)])
+        logger.info(f"Started {self.size} parsing workers ({self.start_method})")
+        return executor
+
+    def start(self):
+        """Start every worker now so the first requests don't pay for it"""
+        self._executor = self._create_executor()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _restart(self, executor: ProcessPoolExecutor):
+        """Replace a broken executor, once however many requests found it broken"""
+        async with self._lock:
+            if self._executor is not executor:
+                return
+            logger.error("A parsing worker died, restarting the pool")
+            executor.shutdown(wait=False, cancel_futures=True)
+            # starting the workers takes seconds, the event loop must keep serving meanwhile
+            self._executor = await asyncio.to_thread(self._create_executor)
+
+    def _release(self, future: Future):
+        with self._slots_lock:
+            self.in_flight -= 1
+
+    @asynccontextmanager
+    async def _submit(self, fn: Callable) -> AsyncIterator[asyncio.Future]:
+        """Submit a function to a worker, restarting the pool when a worker died and took it down
+
+        Note: the request's slot is released when the worker is done with it, not
+        when the request stops waiting (e.g. timed out), so the saturation is that
+        of the workers.
+        """
+        async with self._lock:
+            executor = self._executor
+        try:
+            future = executor.submit(fn)
+        except BrokenProcessPool:
+            await self._restart(executor)
+            raise
+        with self._slots_lock:
+            self.in_flight += 1
+        future.add_done_callback(self._release)
+        try:
+            yield asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            await self._restart(executor)
+            raise
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run a function in a worker, raising TimeoutError if the result takes longer than `timeout`"""
+        async with self._submit(partial(fn, *args, **kwargs)) as future:
+            return await asyncio.wait_for(future, self.timeout)
+
+    async def stream(self, fn: Callable, out_path: Path, *args, poll_interval: float = 0.05, **kwargs) -> AsyncIterator[str]:
+        """Run a function writing json lines to `out_path` in a worker and yield each line once it is complete
+
+        Note: a stream isn't bound by `timeout` as records keep coming, the parse
+        timeouts still apply in the worker.
+        """
+        out_path.touch()
+        async with self._submit(partial(fn, *args, out_path=out_path, **kwargs)) as future:
+            try:
+                with open(out_path) as fb:
+                    partial_line = ""
+                    while True:
+                        done = future.done()
+                        # whatever was written before the worker finished is complete
+                        for line in fb:
+                            partial_line += line
+                            if partial_line.endswith("\n"):
+                                yield partial_line
+                                partial_line = ""
+                        if done:
+                            break
+                        await asyncio.sleep(poll_interval)
+                await future
+            finally:
+                # the client went away, the worker can't be interrupted but a queued parse is dropped
+                if not future.done():
+                    future.cancel()
+
+    @property
+    def stats(self) -> PoolStats:
+        return PoolStats(
+            size=self.size,
+            in_flight=self.in_flight,
+            queued=max(self.in_flight - self.size, 0),
+            saturation=self.in_flight / self.size,
+        )
@@ -0,0 +1,46 @@
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+
+from pydantic import BaseModel, Field
+
+try:
+    from fastapi import HTTPException, status
+except ImportError:
+    raise ImportError("You need to install fastapi to use this module")
+
+
+class FileReference(BaseModel):
+    path: str = Field(..., description="Absolute path or file:// URI of a file under an allowed root", examples=["file:///data/a.pdf"])
+
+
+def to_path(reference: str) -> Path:
+    """Get the path of a reference, either a path or a file:// URI"""
+    if reference.startswith("file:"):
+        url = urlparse(reference)
+        if url.netloc not in ["", "localhost"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Only local file URIs are supported, got {reference}")
+        return Path(url2pathname(unquote(url.path)))
+    return Path(reference)
+
+
+def resolve_reference(reference: str, allowed_roots: list[Path]) -> Path:
+    """Resolve a reference to a file under one of the allowed roots
+
+    Note: the path is resolved (symlinks and `..` included) before it is checked
+    so a link can't reach outside the roots.
+    """
+    if not allowed_roots:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Parsing by reference is disabled, no allowed roots are set")
+    path = to_path(reference)
+    if not path.is_absolute():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Expected an absolute path, got {reference}")
+    path = path.resolve()
+    # checked before the path exists so nothing is told about files outside the roots
+    if not any(path.is_relative_to(root.resolve()) for root in allowed_roots):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"{reference} is not under an allowed root")
+    if not path.exists():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No such file: {reference}")
+    if not path.is_file():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{reference} is not a file")
+    return path
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import io
+import os
+import queue
+import tarfile
+from datetime import datetime
+from pathlib import Path
+
+from dd_pyparse.core.utils.filetype import route_mime_type
+
+try:
+    from fastapi import HTTPException, Request, status
+except ImportError:
+    raise ImportError("You need to install fastapi to use this module")
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# bytes of the start and end of a file that detecting its type looks at
+HEAD_SIZE = 4096
+TAIL_SIZE = 16
+HASH_TYPES = ["md5", "sha256", "sha512"]
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileSample:
+    """The head and tail of a file, enough to detect its type without reading it back"""
+
+    def __init__(self, head: bytes, tail: bytes):
+        self.head = head
+        self.tail = tail
+        self._data = head
+        self._position = 0
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_END:
+            self._data, self._position = self.tail, max(len(self.tail) + offset, 0)
+        else:
+            self._data, self._position = self.head, offset
+        return self._position
+
+    def read(self, n: int = -1) -> bytes:
+        end = len(self._data) if n is None or n < 0 else self._position + n
+        out = self._data[self._position : end]
+        self._position += len(out)
+        return out
+
+
+class IncomingFile:
+    """A file written as it is received and hashed and sampled on the way
+
+    Note: `get_file_meta` returns what `get_file_meta` of the parsers would read
+    the file for, so a parse given it reads the file once.
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = file_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._fb = open(file_path, "wb")
+        self._hashes = {name: hashlib.new(name) for name in HASH_TYPES}
+        self.head = b""
+        self.tail = b""
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        self._fb.write(chunk)
+        for _hash in self._hashes.values():
+            _hash.update(chunk)
+        if len(self.head) < HEAD_SIZE:
+            self.head += chunk[: HEAD_SIZE - len(self.head)]
+        self.tail = (self.tail + chunk[-TAIL_SIZE:])[-TAIL_SIZE:]
+        self.size += len(chunk)
+
+    def close(self):
+        self._fb.close()
+
+    def get_file_meta(self) -> dict:
+        mime_type, file_type = route_mime_type(file_name=self.file_path.name, file=FileSample(self.head, self.tail))
+        file_stat = self.file_path.stat()
+        return {
+            "absolute_path": self.file_path.absolute(),
+            "date_modified": datetime.fromtimestamp(file_stat.st_mtime),
+            "date_created": datetime.fromtimestamp(file_stat.st_ctime),
+            "hash": {name: _hash.hexdigest() for name, _hash in self._hashes.items()},
+            "file_extension": self.file_path.suffix,
+            "file_name": self.file_path.name,
+            "file_size": self.size,
+            "file_type": file_type,
+            "mime_type": mime_type,
+        }
+
+
+class MultipartReceiver:
+    """Write the files of a multipart field to a directory as the request body is parsed, each in a directory of its index"""
+
+    def __init__(self, boundary: bytes, out_dir: Path, field: str):
+        self.out_dir = out_dir
+        self.field = field.encode()
+        self.files: list[IncomingFile] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = None
+        self._file = None
+        callbacks = {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        }
+        self._parser = MultipartParser(boundary, callbacks)
+
+    def write(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def _on_part_begin(self):
+        self._disposition = None
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = parse_options_header(self._header_value)[1]
+        self._header_field, self._header_value = b"", b""
+
+    def _on_headers_finished(self):
+        disposition = self._disposition or {}
+        if disposition.get(b"name") == self.field and b"filename" in disposition:
+            # parsers detect the file type from the name as well as the content
+            file_name = Path(disposition[b"filename"].decode(errors="replace")).name or "upload"
+            self._file = IncomingFile(self.out_dir / str(len(self.files)) / file_name)
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._file is not None:
+            self._file.write(data[start:end])
+
+    def _on_part_end(self):
+        if self._file is not None:
+            self._file.close()
+            self.files.append(self._file)
+            self._file = None
+
+
+async def receive_multipart(request: Request, out_dir: Path, field: str) -> list[IncomingFile]:
+    """Receive the files of a multipart field, read from the socket once and written once"""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing the multipart boundary")
+    receiver = MultipartReceiver(params[b"boundary"], out_dir=out_dir, field=field)
+    async for chunk in request.stream():
+        if chunk:
+            # writing and hashing large chunks would block the event loop
+            await asyncio.to_thread(receiver.write, chunk)
+    return receiver.files
+
+
+class ChunkReader(io.RawIOBase):
+    """A blocking reader of the chunks put in a queue until None, to feed a request body to synchronous readers"""
+
+    def __init__(self, chunks: queue.Queue):
+        self.chunks = chunks
+        self._chunk = b""
+        self._offset = 0
+        self._finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while self._offset >= len(self._chunk):
+            if self._finished:
+                return 0
+            chunk = self.chunks.get()
+            if chunk is None:
+                self._finished = True
+            else:
+                self._chunk, self._offset = chunk, 0
+        n = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:n] = self._chunk[self._offset : self._offset + n]
+        self._offset += n
+        return n
+
+    def drain(self):
+        """Consume what is left so the producer never blocks on a full queue"""
+        while not self._finished:
+            self._finished = self.chunks.get() is None
+
+
+def extract_tar(reader: ChunkReader, out_dir: Path) -> list[IncomingFile]:
+    """Extract the regular files of a (possibly compressed) tar stream in order, each in a directory of its index"""
+    files = []
+    try:
+        with tarfile.open(fileobj=reader, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                file = IncomingFile(out_dir / str(len(files)) / Path(member.name).name)
+                with archive.extractfile(member) as fb:
+                    while chunk := fb.read(CHUNK_SIZE):
+                        file.write(chunk)
+                file.close()
+                files.append(file)
+    finally:
+        reader.drain()
+    return files
+
+
+async def receive_tar(request: Request, out_dir: Path, max_chunks: int = 16) -> list[IncomingFile]:
+    """Receive the files of a tar body, extracted as it streams in"""
+    chunks = queue.Queue(maxsize=max_chunks)
+    extraction = asyncio.ensure_future(asyncio.to_thread(extract_tar, ChunkReader(chunks), out_dir))
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await asyncio.to_thread(chunks.put, chunk)
+    finally:
+        await asyncio.to_thread(chunks.put, None)
+    try:
+        return await extraction
+    except tarfile.TarError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid tar: {e}")
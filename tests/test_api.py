@@ -0,0 +1,361 @@
+import asyncio
+import io
+import json
+import mailbox
+import os
+import tarfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from dd_pyparse.core.parsers.base import get_file_meta
+from dd_pyparse.interfaces import _fastapi
+from dd_pyparse.utils.cache import ResultCache, get_cache_key, reingest
+from dd_pyparse.utils.jobs import JobManager, JobQueueFull, JobState, JobStore
+from dd_pyparse.utils.pool import ParserPool, parse_upload, stream_upload
+from dd_pyparse.utils.references import resolve_reference
+from dd_pyparse.utils.uploads import IncomingFile
+
+ASSETS = Path(__file__).parent / "assets"
+
+
+def _exit_worker(out_path: Path):
+    # as a worker killed for running out of memory
+    os._exit(1)
+
+
+@pytest.fixture
+def pool():
+    # fork keeps the test fast, the service defaults to a preloaded fork server
+    pool = ParserPool(size=1, timeout=60, start_method="fork")
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+class TestParserPool:
+    def test_parses_in_worker(self, pool):
+        out = asyncio.run(pool.run(parse_upload, ASSETS / "test.txt", timeout_multiplier=1.0))
+        assert out["file_type"] == "txt"
+        assert "absolute_path" not in out
+
+    def test_streams_records(self, pool, tmp_path):
+        file_path = tmp_path / "test.mbox"
+        box = mailbox.mbox(file_path)
+        for _ in range(3):
+            box.add((ASSETS / "test.eml").read_bytes())
+        box.close()
+
+        async def run():
+            return [json.loads(line) async for line in pool.stream(stream_upload, tmp_path / "records.jsonl", file_path)]
+
+        parent, *children = asyncio.run(run())
+        assert parent["file_type"] == "mbox"
+        assert len(children) == 3
+        assert all(child["parent_id"] == parent["id"] for child in children)
+
+    def test_streams_after_worker_died(self, pool, tmp_path):
+        async def run():
+            with pytest.raises(BrokenProcessPool):
+                async for _ in pool.stream(_exit_worker, tmp_path / "broken.jsonl"):
+                    pass
+            return [json.loads(line) async for line in pool.stream(stream_upload, tmp_path / "records.jsonl", ASSETS / "test.txt")]
+
+        (record,) = asyncio.run(run())
+        assert record["file_type"] == "txt"
+        assert pool.stats.in_flight == 0
+
+    def test_request_timeout(self, pool):
+        pool.timeout = 0.1
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(pool.run(time.sleep, 1))
+        # the worker is still busy with it
+        assert pool.stats.in_flight == 1
+        time.sleep(1.2)
+        assert pool.stats.in_flight == 0
+
+    def test_restarts_after_worker_died(self, pool):
+        async def run():
+            with pytest.raises(BrokenProcessPool):
+                await pool.run(os._exit, 1)
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.create_task(tick())
+            out = await pool.run(parse_upload, ASSETS / "test.txt")
+            ticker.cancel()
+            return out, ticks
+
+        out, ticks = asyncio.run(run())
+        assert out["file_type"] == "txt"
+        # the event loop kept running while the pool restarted
+        assert ticks > 0
+
+    def test_saturation(self, pool):
+        async def run():
+            tasks = [asyncio.create_task(pool.run(time.sleep, 0.2)) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            stats = pool.stats
+            await asyncio.gather(*tasks)
+            return stats
+
+        stats = asyncio.run(run())
+        assert (stats.in_flight, stats.queued, stats.saturation) == (3, 2, 3.0)
+        assert pool.stats.in_flight == 0
+
+
+class TestResultCache:
+    def test_lru_and_disk_tier(self, tmp_path):
+        cache = ResultCache(max_entries=1, disk_dir=tmp_path)
+        cache.put("a", {"n": 1})
+        cache.put("b", {"n": 2})
+        assert list(cache._entries) == ["b"]
+        assert cache.get("a") == {"n": 1}
+        # a restarted service still has the disk tier
+        assert ResultCache(max_entries=1, disk_dir=tmp_path).get("b") == {"n": 2}
+        assert cache.get("c") is None
+        assert (cache.stats["memory_hits"], cache.stats["disk_hits"], cache.stats["misses"]) == (0, 1, 1)
+
+    def test_reingest_renews_ids(self):
+        record = {"id": "a", "date_ingested": "2020-01-01T00:00:00", "children": [{"id": "b", "parent_id": "a"}]}
+        out = reingest(record)
+        assert out["id"] != "a" and out["date_ingested"] != record["date_ingested"]
+        assert out["children"][0]["id"] != "b" and out["children"][0]["parent_id"] == out["id"]
+        assert record["id"] == "a" and record["children"][0]["id"] == "b"
+
+    def test_keys_include_options(self):
+        assert get_cache_key("abc", {"extract_children": True}) != get_cache_key("abc", {"extract_children": False})
+
+    def test_coalesces_concurrent_requests(self):
+        cache = ResultCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"n": len(calls)}
+
+        async def run():
+            return await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(5)))
+
+        assert asyncio.run(run()) == [{"n": 1}] * 5
+        assert (len(calls), cache.stats["coalesced"]) == (1, 4)
+        assert asyncio.run(cache.get_or_compute("key", compute)) == {"n": 1}
+        assert len(calls) == 1
+
+
+class TestIncomingFile:
+    def test_meta_matches_reading_the_file(self, tmp_path):
+        # detecting json looks at the last byte, past the head of a large file
+        (tmp_path / "large.json").write_text(json.dumps({"text": "x" * 10_000}))
+        for path in [ASSETS / "test.txt", ASSETS / "test.eml", ASSETS / "test.jpg", tmp_path / "large.json"]:
+            content = path.read_bytes()
+            file = IncomingFile(tmp_path / "received" / path.name)
+            for i in range(0, len(content), 1000):
+                file.write(content[i : i + 1000])
+            file.close()
+            assert file.file_path.read_bytes() == content
+            expected = get_file_meta(file.file_path)
+            meta = file.get_file_meta()
+            assert {k: meta[k] for k in ["hash", "file_size", "file_type", "mime_type"]} == {
+                k: expected[k] for k in ["hash", "file_size", "file_type", "mime_type"]
+            }
+
+
+class TestReferences:
+    def test_only_files_under_allowed_roots(self, tmp_path):
+        root = tmp_path / "shared"
+        root.mkdir()
+        (root / "a.txt").write_text("a")
+        (tmp_path / "secret.txt").write_text("b")
+        (root / "link.txt").symlink_to(tmp_path / "secret.txt")
+        assert resolve_reference(str(root / "a.txt"), allowed_roots=[root]) == root / "a.txt"
+        assert resolve_reference((root / "a.txt").as_uri(), allowed_roots=[root]) == root / "a.txt"
+        for reference, status_code in [
+            (str(root / ".." / "secret.txt"), 403),
+            (str(root / "link.txt"), 403),
+            (str(root / "missing.txt"), 404),
+            (str(root), 400),
+            ("a.txt", 400),
+            ("file://remote/shared/a.txt", 400),
+        ]:
+            with pytest.raises(HTTPException) as e:
+                resolve_reference(reference, allowed_roots=[root])
+            assert e.value.status_code == status_code, reference
+        with pytest.raises(HTTPException):
+            resolve_reference(str(root / "a.txt"), allowed_roots=[])
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """Run requests against the app, its pool, cache and jobs set up for each test"""
+    pool = ParserPool(size=2, start_method="fork")
+    monkeypatch.setattr(_fastapi, "pool", pool)
+    monkeypatch.setattr(_fastapi, "cache", ResultCache())
+    monkeypatch.setattr(_fastapi, "jobs", JobManager(pool, jobs_dir=tmp_path / "jobs"))
+    monkeypatch.setattr(_fastapi.settings, "allowed_roots", [ASSETS, tmp_path])
+
+    def run(requests):
+        async def _run():
+            transport = httpx.ASGITransport(app=_fastapi.app)
+            async with _fastapi.lifespan(_fastapi.app), httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await requests(client)
+
+        return asyncio.run(_run())
+
+    return run
+
+
+class TestApi:
+    def test_infer(self, api):
+        async def requests(client):
+            health = (await client.get("/health")).json()
+            with open(ASSETS / "test.txt", "rb") as fb:
+                response = await client.post("/infer", files={"file": ("test.txt", fb)})
+            with open(ASSETS / "test.txt", "rb") as fb:
+                streamed = await client.post("/infer/stream", files={"file": ("test.txt", fb)})
+            with open(ASSETS / "test.txt", "rb") as fb:
+                copy = await client.post("/infer", files={"file": ("copy.txt", fb)})
+            metrics_text = (await client.get("/metrics")).text
+            return health, response, streamed, copy, metrics_text
+
+        health, response, streamed, copy, metrics_text = api(requests)
+        assert health == {"status": "OK", "pool": {"size": 2, "in_flight": 0, "queued": 0, "saturation": 0.0}}
+        assert response.status_code == 200
+        assert response.json()["file_name"] == "test.txt"
+        assert [json.loads(line)["file_name"] for line in streamed.text.splitlines()] == ["test.txt"]
+        assert "dd_pyparse_cache_hit_rate 0.5" in metrics_text
+        # the same content uploaded twice is ingested twice
+        assert copy.json()["file_name"] == "copy.txt"
+        assert copy.json()["id"] != response.json()["id"]
+        assert copy.json()["date_ingested"] != response.json()["date_ingested"]
+        assert copy.json()["hash"] == response.json()["hash"]
+
+    def test_batch(self, api):
+        tar = io.BytesIO()
+        with tarfile.open(fileobj=tar, mode="w") as archive:
+            archive.add(ASSETS / "test.txt", arcname="docs/test.txt")
+            archive.add(ASSETS / "test.eml", arcname="test.eml")
+
+        async def requests(client):
+            files = [("files", ("test.txt", (ASSETS / "test.txt").read_bytes())), ("files", ("blob.bin", bytes(range(256))))]
+            multipart = await client.post("/infer/batch", files=files)
+            headers = {"content-type": "application/x-tar"}
+            streamed = await client.post("/infer/batch", params={"stream": True}, content=tar.getvalue(), headers=headers)
+            return multipart, streamed
+
+        multipart, streamed = api(requests)
+        text, blob = multipart.json()
+        assert text["file_name"] == "test.txt"
+        assert blob["error"] and blob["file_name"] == "blob.bin"
+        results = sorted((json.loads(line) for line in streamed.text.splitlines()), key=lambda x: x["index"])
+        assert [(x["index"], x["file_name"]) for x in results] == [(0, "test.txt"), (1, "test.eml")]
+
+    def test_infer_path(self, api):
+        async def requests(client):
+            response = await client.post("/infer/path", json={"path": (ASSETS / "test.txt").as_uri()})
+            streamed = await client.post("/infer/path", params={"stream": True}, json={"path": str(ASSETS / "test.txt")})
+            forbidden = await client.post("/infer/path", json={"path": __file__})
+            return response, streamed, forbidden
+
+        response, streamed, forbidden = api(requests)
+        assert response.json()["absolute_path"] == str((ASSETS / "test.txt").resolve())
+        assert [json.loads(line)["file_name"] for line in streamed.text.splitlines()] == ["test.txt"]
+        assert forbidden.status_code == 403
+
+    def test_jobs(self, api, tmp_path):
+        mbox_path = tmp_path / "test.mbox"
+        box = mailbox.mbox(mbox_path)
+        for _ in range(3):
+            box.add((ASSETS / "test.eml").read_bytes())
+        box.close()
+
+        async def wait(client, job_id: str) -> dict:
+            while (job := (await client.get(f"/jobs/{job_id}")).json())["state"] in ["queued", "running"]:
+                await asyncio.sleep(0.05)
+            return job
+
+        async def requests(client):
+            with open(ASSETS / "test.txt", "rb") as fb:
+                uploaded = (await client.post("/jobs", files={"file": ("test.txt", fb)})).json()
+            referenced = (await client.post("/jobs", json={"path": str(mbox_path)})).json()
+            jobs = [await wait(client, uploaded["id"]), await wait(client, referenced["id"])]
+            results = [(await client.get(f"/jobs/{job['id']}/results")).text for job in jobs]
+            missing = await client.get("/jobs/missing")
+            return jobs, results, missing
+
+        (uploaded, referenced), (uploaded_results, referenced_results), missing = api(requests)
+        assert (uploaded["state"], uploaded["num_records"]) == ("done", 1)
+        assert json.loads(uploaded_results)["file_name"] == "test.txt"
+        # the upload is deleted once parsed
+        assert not (tmp_path / "jobs" / uploaded["id"] / "input").exists()
+        assert (referenced["state"], referenced["num_records"]) == ("done", 4)
+        assert len(referenced_results.splitlines()) == 4
+        assert missing.status_code == 404
+
+
+class TestJobManager:
+    def test_resumes_unfinished_jobs(self, pool, tmp_path):
+        async def run():
+            jobs = JobManager(pool, jobs_dir=tmp_path, max_queued=1, concurrency=1)
+            await jobs.start()
+            # a job left running by a restart
+            jobs.store.add("a", file_path=ASSETS / "test.txt", file_name="test.txt", temporary=False, options={})
+            jobs.store.update("a", state="running")
+            await jobs.stop()
+
+            jobs = JobManager(pool, jobs_dir=tmp_path, max_queued=1, concurrency=0)
+            await jobs.start()
+            with pytest.raises(JobQueueFull):
+                jobs.new_job_id()
+            await jobs.stop()
+
+            jobs = JobManager(pool, jobs_dir=tmp_path, max_queued=1, concurrency=1)
+            await jobs.start()
+            while jobs.get_status("a").state != JobState.DONE:
+                await asyncio.sleep(0.05)
+            await jobs.stop()
+
+        asyncio.run(run())
+        assert JobStore(tmp_path / "jobs.db").get("a")["num_records"] == 1
+        assert json.loads((tmp_path / "a" / "records.jsonl").read_text())["file_name"] == "test.txt"
+
+    def test_removes_expired_jobs(self, pool, tmp_path):
+        async def run():
+            jobs = JobManager(pool, jobs_dir=tmp_path, concurrency=0, ttl=60)
+            await jobs.start()
+            for job_id, finished in [("old", time.time() - 120), ("new", time.time())]:
+                jobs.submit(job_id, ASSETS / "test.txt")
+                jobs.store.update(job_id, state=JobState.DONE, finished=finished)
+            removed = jobs.remove_expired()
+            statuses = jobs.get_status("old"), jobs.get_status("new")
+            await jobs.stop()
+            return removed, statuses
+
+        removed, (old, new) = asyncio.run(run())
+        assert (removed, old, new.state) == (1, None, JobState.DONE)
+        assert not (tmp_path / "old").exists() and (tmp_path / "new").exists()
+
+    def test_runs_jobs_after_worker_died(self, pool, tmp_path):
+        async def run():
+            jobs = JobManager(pool, jobs_dir=tmp_path, concurrency=1)
+            await jobs.start()
+            with pytest.raises(BrokenProcessPool):
+                await pool.run(os._exit, 1)
+            jobs.submit("a", ASSETS / "test.txt")
+            while jobs.get_status("a").state not in [JobState.DONE, JobState.FAILED]:
+                await asyncio.sleep(0.05)
+            status = jobs.get_status("a")
+            await jobs.stop()
+            return status
+
+        assert asyncio.run(run()).state == JobState.DONE
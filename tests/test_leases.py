@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from multiprocessing import Process
+from pathlib import Path
+
+from dd_pyparse.core.utils.leases import LeaseQueue
+from dd_pyparse.core.utils.manifest import read_manifests
+from dd_pyparse.interfaces._cli import process
+
+# Note: each "host" is a separate process with its own lease owner sharing one sqlite file
+
+
+def simulate_host(db_path: Path, owner: str, out_path: Path, lease_seconds: float = 5.0, die_after: int = None):
+    """Claim and process tasks until the queue is exhausted, optionally dying mid-lease"""
+    leases = LeaseQueue(db_path, owner=owner, lease_seconds=lease_seconds)
+    processed = 0
+    with open(out_path, "a") as fb:
+        while True:
+            claimed = leases.claim(2)
+            if not claimed:
+                if leases.is_finished():
+                    break
+                time.sleep(0.05)
+                continue
+            for path, _ in claimed:
+                if die_after is not None and processed >= die_after:
+                    # exit without completing or renewing the leases we hold
+                    os._exit(1)
+                fb.write(json.dumps({"owner": owner, "path": path}) + "\n")
+                fb.flush()
+                processed += 1
+            leases.complete([path for path, _ in claimed])
+
+
+def run_hosts(db_path: Path, out_dir: Path, hosts: list[dict]) -> list[dict]:
+    workers = [
+        Process(target=simulate_host, kwargs={"db_path": db_path, "owner": f"host-{i}", "out_path": out_dir / f"host-{i}.jsonl", **host})
+        for i, host in enumerate(hosts)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+    return [json.loads(line) for path in sorted(out_dir.glob("host-*.jsonl")) for line in path.read_text().splitlines()]
+
+
+class TestLeaseQueue:
+    def test_add_is_idempotent(self, tmp_path):
+        leases = LeaseQueue(tmp_path / "queue.db")
+        assert leases.add([("a", 1), ("b", 2)]) == 2
+        assert leases.add([("a", 1), ("c", 3)]) == 1
+        assert leases.counts() == {"pending": 3}
+
+    def test_hosts_process_each_task_once(self, tmp_path):
+        db_path = tmp_path / "queue.db"
+        paths = [f"dir/file{i}.txt" for i in range(50)]
+        LeaseQueue(db_path).add([(path, 10) for path in paths])
+
+        processed = run_hosts(db_path, tmp_path, hosts=[{}, {}, {}])
+        assert sorted(x["path"] for x in processed) == sorted(paths)
+        assert LeaseQueue(db_path).counts() == {"done": 50}
+
+    def test_leases_of_dead_host_are_reclaimed(self, tmp_path):
+        db_path = tmp_path / "queue.db"
+        paths = [f"file{i}.txt" for i in range(20)]
+        LeaseQueue(db_path).add([(path, 10) for path in paths])
+
+        # host 0 dies holding a lease, the survivor picks its tasks up once the lease lapses
+        processed = run_hosts(db_path, tmp_path, hosts=[{"lease_seconds": 0.5, "die_after": 3}, {"lease_seconds": 0.5}])
+        assert set(x["path"] for x in processed) == set(paths)
+        assert LeaseQueue(db_path).counts() == {"done": 20}
+
+    def test_renew_extends_leases(self, tmp_path):
+        leases = LeaseQueue(tmp_path / "queue.db", owner="a", lease_seconds=0.2)
+        leases.add([("a", 1)])
+        assert leases.claim(1) == [("a", 1)]
+        other = LeaseQueue(tmp_path / "queue.db", owner="b", lease_seconds=0.2)
+        time.sleep(0.1)
+        leases.renew()
+        time.sleep(0.15)
+        assert other.claim(1) == []
+        time.sleep(0.2)
+        assert other.claim(1) == [("a", 1)]
+
+    def test_processors_share_work_queue(self, tmp_path):
+        in_dir = tmp_path / "in"
+        in_dir.mkdir()
+        for i in range(30):
+            (in_dir / f"file{i}.txt").write_text(f"hello world {i}")
+        out_dir = tmp_path / "out"
+        kwargs = {
+            "in_dir": in_dir,
+            "children_dir": tmp_path / "children",
+            "out_dir": out_dir,
+            "dataset": "test",
+            "num_workers": 2,
+            "executor": "thread",
+            "work_queue": tmp_path / "queue.db",
+            "lease_batch_size": 4,
+        }
+        hosts = [Process(target=process, kwargs=kwargs) for _ in range(2)]
+        for host in hosts:
+            host.start()
+        for host in hosts:
+            host.join(timeout=120)
+
+        entries = list(read_manifests(out_dir))
+        assert sorted(entry["relative_path"] for entry in entries) == sorted(f"file{i}.txt" for i in range(30))
+        assert LeaseQueue(tmp_path / "queue.db").counts() == {"done": 30}
@@ -0,0 +1,455 @@
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from dd_pyparse.core.parsers import PdfParser, TxtParser
+from dd_pyparse.core.utils.batching import BatchPlanner
+from dd_pyparse.core.utils.costs import CostModel, CostStore, compute_accuracy
+from dd_pyparse.core.utils.executors import ProcessExecutor, RayExecutor, ThreadExecutor
+from dd_pyparse.core.utils.failures import FailureRegistry, is_input_failure
+from dd_pyparse.core.utils.manifest import ManifestWriter, is_processed, merge_manifests
+from dd_pyparse.core.utils.memory import MemoryBudget, estimate_footprint, parse_memory_size
+from dd_pyparse.core.utils.metrics import Metrics, build_report, merge_snapshots, serve_metrics
+from dd_pyparse.core.utils.profiling import ParserProfiler, merge_profiles
+from dd_pyparse.core.utils.progress import ProgressCounters, ProgressReporter
+from dd_pyparse.core.utils.scaling import Autoscaler, CpuSampler, get_cgroup_cpu_quota
+from dd_pyparse.core.utils.sharding import get_shard, in_shard, parse_shard
+from dd_pyparse.core.utils.shedding import LoadShedder
+from dd_pyparse.core.utils.timeouts import get_timeout, time_limit
+from dd_pyparse.core.utils.tracing import TraceWriter, merge_traces
+from dd_pyparse.core.utils.watch import Debouncer, Inotify
+from dd_pyparse.interfaces._cli import Processor
+from dd_pyparse.schemas.data.parents.file import File
+from dd_pyparse.schemas.enums import FileType
+from dd_pyparse.utils.exceptions import ParseTimeout
+
+
+class TestBatchPlanner:
+    def test_large_files_are_not_batched(self):
+        planner = BatchPlanner(max_batch_size=4, max_file_size=100)
+        file = File(absolute_path="/data/big.pdf")
+        assert planner.add(file, file_size=1000) == [[file]]
+        assert not planner.is_batched(1000) and planner.is_batched(100)
+
+    def test_batches_close_at_max_size(self):
+        planner = BatchPlanner(max_batch_size=3, max_file_size=100, target_latency=10)
+        files = [File(absolute_path=f"/data/{i}.txt") for i in range(4)]
+        batches = [batch for file in files for batch in planner.add(file, file_size=10)]
+        assert batches == [files[:3]]
+        assert planner.flush() == files[3:]
+
+    def test_batches_close_at_target_latency(self):
+        planner = BatchPlanner(max_batch_size=100, max_file_size=100, target_latency=1.0)
+        planner.observe(FileType.txt, 0.5)
+        files = [File(absolute_path=f"/data/{i}.txt") for i in range(3)]
+        batches = [batch for file in files for batch in planner.add(file, file_size=10)]
+        assert batches == [files[:2]]
+
+
+class TestCostModel:
+    def test_fit_per_type_with_fallback(self, tmp_path):
+        store = CostStore(tmp_path / "costs.db")
+        rows = [
+            {"run_id": "a", "file_type": "pdf", "file_size": size, "elapsed": 0.1 + size * 1e-6, "peak_rss": 1000 + size, "status": "ok"}
+            for size in range(0, 100_000, 10_000)
+        ]
+        store.record(rows + [{"run_id": "a", "file_type": "txt", "file_size": 10, "elapsed": 99.0, "status": "error"}])
+        model = store.fit()
+        assert model.predict(FileType.pdf, 50_000) == pytest.approx(0.15)
+        assert model.predict_rss(FileType.pdf, 50_000) == 51_000
+        # errors are not fitted, unseen types use the model of every type
+        assert model.predict(FileType.txt, 50_000) == pytest.approx(0.15)
+        assert CostModel().predict(FileType.pdf, 10) is None
+
+    def test_accuracy(self):
+        rows = [{"file_type": "pdf", "predicted": 1.0, "elapsed": 2.0}, {"file_type": "txt", "predicted": 1.0, "elapsed": 1.0}]
+        accuracy = compute_accuracy(rows)
+        assert accuracy["num_files"] == 2
+        assert accuracy["total_ratio"] == pytest.approx(2 / 3)
+        assert accuracy["by_file_type"]["pdf"]["median_relative_error"] == pytest.approx(0.5)
+
+
+class TestMetrics:
+    def test_snapshots_merge_across_processes(self):
+        workers = [Metrics(), Metrics()]
+        for i, worker in enumerate(workers):
+            worker.inc("files", file_type="pdf", status="ok")
+            worker.observe("stage_seconds", 0.2, stage="parse", file_type="pdf")
+            worker.set("worker_rss_bytes", 100, worker=str(i))
+        report = build_report(merge_snapshots([worker.snapshot() for worker in workers]))
+        assert report["counters"] == [{"name": "files", "file_type": "pdf", "status": "ok", "value": 2}]
+        assert report["histograms"][0]["count"] == 2
+        assert report["histograms"][0]["p50"] == 0.5
+        assert len(report["gauges"]) == 2
+
+    def test_prometheus_endpoint(self):
+        from urllib.request import urlopen
+
+        worker = Metrics()
+        worker.inc("fallbacks", parser="CsvParser", fallback="TxtParser")
+        worker.observe("stage_seconds", 0.003, stage="hash")
+        server = serve_metrics(0, worker.snapshot, host="127.0.0.1")
+        try:
+            body = urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics").read().decode()
+        finally:
+            server.shutdown()
+        assert 'dd_pyparse_fallbacks_total{fallback="TxtParser",parser="CsvParser"} 1' in body
+        assert 'dd_pyparse_stage_seconds_bucket{stage="hash",le="0.005"} 1' in body
+        assert 'dd_pyparse_stage_seconds_count{stage="hash"} 1' in body
+
+
+class TestTracing:
+    def test_worker_traces_merge_into_lanes(self, tmp_path):
+        writer = TraceWriter(tmp_path / "_trace", run_tag="0-of-1-run")
+
+        def work():
+            with writer.span("file", path="a.pdf") as args:
+                with writer.span("parse"):
+                    pass
+                args["status"] = "ok"
+            # left unterminated like a worker that was killed
+
+        threads = [threading.Thread(target=work) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.flush()
+
+        assert merge_traces(tmp_path, run_tag="0-of-1-run", out_path=tmp_path / "trace.json") == 8
+        events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X"]
+        assert len({e["tid"] for e in spans}) == 2
+        assert {e["name"]: e["args"] for e in spans}["file"] == {"path": "a.pdf", "status": "ok"}
+
+
+class TestProfiling:
+    @pytest.mark.parametrize("profiler", ["cprofile", "sample"])
+    def test_profiles_per_parser_and_slow_files(self, tmp_path, profiler):
+        profiler = ParserProfiler(tmp_path, run_tag="run", profiler=profiler, slow_seconds=0.05, interval=0.001)
+        with profiler.profile("TxtParser", sha256="fast"):
+            sum(range(1000))
+        with profiler.profile("PdfParser", sha256="slow", path=Path("slow.pdf")):
+            time.sleep(0.1)
+        profiler.dump()
+
+        out_paths = merge_profiles(tmp_path, run_tag="run")
+        assert sorted(path.stem for path in out_paths) == ["PdfParser", "TxtParser"]
+        assert {path.stem for path in (tmp_path / "slow").iterdir()} == {"PdfParser-slow"}
+
+
+class TestProgress:
+    def test_counters_and_eta_per_file_type(self):
+        import io
+
+        counters = ProgressCounters(ThreadExecutor().array("d", ProgressCounters.size))
+        for _ in range(4):
+            counters.queued(FileType.pdf, predicted=1.0)
+        counters.queued(FileType.txt)
+        counters.started()
+        counters.started()
+        # the model underestimates pdfs by half
+        counters.finished(FileType.pdf, file_size=1024**2, seconds=2.0, error=False, predicted=1.0)
+
+        stream = io.StringIO()
+        reporter = ProgressReporter(counters, get_backlog=lambda: 3, get_num_workers=lambda: 2, mode="json", stream=stream)
+        reporter.report()
+        status = json.loads(stream.getvalue())
+        assert (status["done"], status["queued"], status["in_flight"], status["queue_depth"]) == (1, 5, 1, 3)
+        assert status["by_file_type"]["pdf"]["eta_seconds"] == pytest.approx(3.0)
+        # nothing is known about txt yet
+        assert status["by_file_type"]["txt"]["eta_seconds"] is None
+        assert status["eta_seconds"] is None
+
+
+class TestAutoscaler:
+    def test_grows_on_backlog_with_iowait(self):
+        scaler = Autoscaler(min_workers=1, max_workers=8, cpu_count=4)
+        assert scaler.decide(num_workers=4, backlog=100, utilization=0.95, iowait=0.4) == 5
+
+    def test_shrinks_when_oversubscribed(self):
+        scaler = Autoscaler(min_workers=1, max_workers=8, cpu_count=4)
+        assert scaler.decide(num_workers=6, backlog=100, utilization=0.99, iowait=0.0) == 5
+
+    def test_shrinks_when_idle_within_bounds(self):
+        scaler = Autoscaler(min_workers=2, max_workers=8, cpu_count=4)
+        assert scaler.decide(num_workers=3, backlog=0, utilization=0.1, iowait=0.0) == 2
+        assert scaler.decide(num_workers=2, backlog=0, utilization=0.1, iowait=0.0) == 2
+
+    def test_cgroup_v2_quota(self, tmp_path):
+        (tmp_path / "cpu.max").write_text("250000 100000\n")
+        assert get_cgroup_cpu_quota(tmp_path) == 2.5
+        (tmp_path / "cpu.max").write_text("max 100000\n")
+        assert get_cgroup_cpu_quota(tmp_path) is None
+
+    def test_samples_cgroup_usage_against_quota(self, tmp_path):
+        (tmp_path / "cpu.max").write_text("200000 100000\n")
+        (tmp_path / "cpu.stat").write_text("usage_usec 1000000\nuser_usec 800000\nsystem_usec 200000\n")
+        (tmp_path / "io.pressure").write_text("some avg10=0.00 avg60=0.00 avg300=0.00 total=0\n")
+        sampler = CpuSampler(stat_path=tmp_path / "missing", cgroup_root=tmp_path)
+        sampler._last_cgroup = (1.0, 0.0, time.monotonic() - 1.0)
+        # a second of 2 CPUs with 1.5 of them busy and a quarter stalled on I/O
+        (tmp_path / "cpu.stat").write_text("usage_usec 2500000\n")
+        (tmp_path / "io.pressure").write_text("some avg10=0.00 avg60=0.00 avg300=0.00 total=250000\n")
+        utilization, iowait = sampler.sample()
+        assert sampler.in_cgroup and sampler.cpu_count == 2.0
+        assert utilization == pytest.approx(0.75, rel=0.05)
+        assert iowait == pytest.approx(0.25, rel=0.05)
+
+
+class TestMemoryBudget:
+    def test_parse_memory_size(self):
+        assert parse_memory_size("512M") == 512 * 1024**2
+        assert parse_memory_size("1.5g") == int(1.5 * 1024**3)
+        assert parse_memory_size("2048") == 2048
+
+    def test_estimate_footprint(self):
+        assert estimate_footprint(FileType.json, 100) == 800
+
+    def test_reservations_stay_within_budget(self):
+        budget = MemoryBudget(100)
+        in_use, peak = [0], [0]
+        lock = threading.Lock()
+
+        def task(size: int):
+            with budget.reserve(size):
+                with lock:
+                    in_use[0] += min(size, budget.budget)
+                    peak[0] = max(peak[0], in_use[0])
+                time.sleep(0.01)
+                with lock:
+                    in_use[0] -= min(size, budget.budget)
+
+        threads = [threading.Thread(target=task, args=(size,)) for size in [60, 60, 60, 500]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert peak[0] <= 100
+        assert budget.reserved == 0
+
+
+class TestSharding:
+    def test_parse_shard(self):
+        assert parse_shard("1/4") == (1, 4)
+        with pytest.raises(Exception):
+            parse_shard("4/4")
+
+    def test_shards_are_disjoint_and_stable(self):
+        root = Path("/data")
+        paths = [root / f"dir{i % 7}" / f"file{i}.txt" for i in range(200)]
+        owners = [[index for index in range(3) if in_shard(path, root=root, shard=(index, 3))] for path in paths]
+        assert all(len(owner) == 1 for owner in owners)
+        assert get_shard("dir1/file1.txt", 3) == get_shard("dir1/file1.txt", 3)
+
+    def test_merge_manifests(self, tmp_path):
+        for shard_tag, paths in [("0-of-2", ["a", "b"]), ("1-of-2", ["c"])]:
+            writer = ManifestWriter(tmp_path, shard_tag=shard_tag)
+            for path in paths:
+                writer.write({"path": path, "id": path, "file_type": "txt", "file_size": 10, "status": "ok", "elapsed": 0.1})
+            writer.close()
+        stats = merge_manifests(tmp_path)
+        assert stats["num_files"] == 3
+        assert stats["num_bytes"] == 30
+        lines = (tmp_path / "_manifest" / "manifest.jsonl").read_text().splitlines()
+        assert sorted(json.loads(line)["path"] for line in lines) == ["a", "b", "c"]
+
+
+class TestFailures:
+    def test_registry_lookup_by_hash_and_parser(self, tmp_path):
+        registry = FailureRegistry(tmp_path / "failures.db", max_failures=2)
+        registry.record("abc", PdfParser, error=ValueError("bad xref"), seconds=1.5)
+        assert registry.lookup("abc", PdfParser) is None
+        registry.record("abc", PdfParser, error=ValueError("bad xref"), seconds=1.5)
+        failure = registry.lookup("abc", PdfParser)
+        assert failure["exception"] == "ValueError"
+        assert failure["count"] == 2
+        assert registry.lookup("abc", TxtParser) is None
+
+    def test_environment_errors_are_not_input_failures(self):
+        assert is_input_failure(ValueError("bad xref")) and is_input_failure(ParseTimeout("Timed out"))
+        assert not is_input_failure(ModuleNotFoundError("No module named 'openpyxl'"))
+        assert not is_input_failure(FileNotFoundError(2, "No such file or directory", "soffice"))
+
+    def test_timeouts_scale_with_file_size(self):
+        assert get_timeout(FileType.csv, multiplier=0, file_size=10**9) is None
+        assert get_timeout(FileType.csv, multiplier=2) == 240.0
+        assert get_timeout(FileType.csv, multiplier=1, file_size=4 * 1024**3) == 120.0 + 4096
+
+    def test_time_limit(self):
+        with pytest.raises(ParseTimeout):
+            with time_limit(0.05):
+                time.sleep(1)
+        with time_limit(1):
+            pass
+
+
+class TestLoadShedder:
+    def test_levels_follow_backlog(self):
+        shedder = LoadShedder(thresholds=[10, 100])
+        assert [shedder.level(FileType.pdf, backlog=n) for n in [0, 10, 99, 100, 10_000]] == [0, 1, 1, 2, 2]
+        assert shedder.options(FileType.pdf, 0) == {}
+        assert shedder.options(FileType.pdf, 2)["max_pages"] == 5
+
+    def test_slow_types_degrade_further_under_pressure(self):
+        shedder = LoadShedder(thresholds=[10, 100])
+        shedder.observe(FileType.pdf, seconds=60)
+        assert shedder.level(FileType.pdf, backlog=0) == 0
+        assert shedder.level(FileType.pdf, backlog=10) == 2
+        assert shedder.level(FileType.txt, backlog=10) == 1
+
+
+class TestWatch:
+    def test_debouncer_waits_for_quiet_period(self):
+        debouncer = Debouncer(quiet_period=5)
+        debouncer.touch(Path("a"), at=0)
+        debouncer.touch(Path("b"), at=3)
+        debouncer.touch(Path("a"), at=4)
+        assert debouncer.ready(now=8) == [Path("b")]
+        assert debouncer.ready(now=9) == [Path("a")]
+        assert len(debouncer) == 0
+
+    def test_changed_files_are_processed_again(self):
+        assert is_processed((10, 100.0), file_size=10, mtime=100.0000004)
+        assert not is_processed((10, 100.0), file_size=11, mtime=100.0)
+        assert not is_processed((10, 100.0), file_size=10, mtime=101.0)
+        assert not is_processed(None, file_size=10, mtime=100.0)
+
+    def test_inotify_reports_new_files_and_directories(self, tmp_path):
+        watcher = Inotify(tmp_path)
+        try:
+            (tmp_path / "a.txt").write_text("a")
+            (tmp_path / "sub").mkdir()
+            (tmp_path / "sub" / "b.txt").write_text("b")
+            paths = set()
+            for _ in range(10):
+                paths.update(watcher.read(timeout=0.1))
+            (tmp_path / "sub" / "c.txt").write_text("c")
+            paths.update(watcher.read(timeout=1))
+        finally:
+            watcher.close()
+        assert paths == {tmp_path / "a.txt", tmp_path / "sub" / "b.txt", tmp_path / "sub" / "c.txt"}
+
+
+ASSETS = Path(__file__).parent / "assets"
+
+
+@pytest.fixture
+def corpus(tmp_path) -> Path:
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    for i in range(6):
+        (in_dir / f"{i}.txt").write_text(f"file {i}\n")
+    shutil.copy(ASSETS / "test.eml", in_dir)
+    return in_dir
+
+
+def read_outputs(out_dir: Path) -> list[dict]:
+    """Read the records written by a run without what differs between runs"""
+    records = [json.loads(path.read_text()) for path in out_dir.glob("*.json")]
+    # batches are written together as json lines
+    records += [json.loads(line) for path in out_dir.glob("*.jsonl") for line in path.read_text().splitlines()]
+    records = [{key: value for key, value in record.items() if key not in ["id", "date_ingested"]} for record in records]
+    return sorted(records, key=lambda x: x["absolute_path"])
+
+
+def run_processor(in_dir: Path, out_dir: Path, **kwargs) -> Processor:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    processor = Processor(in_dir=in_dir, children_dir=out_dir / "children", out_dir=out_dir, dataset="test", num_workers=2, **kwargs)
+    processor.run()
+    return processor
+
+
+class TestProcessor:
+    def test_shard_stats_count_this_run(self, corpus, tmp_path):
+        for _ in range(2):
+            run_processor(corpus, tmp_path / "out")
+        stats = json.loads((tmp_path / "out" / "_manifest" / "stats-0-of-1.json").read_text())
+        assert (stats["num_files"], stats["num_errors"]) == (7, 0)
+
+    def test_batched_output_matches_unbatched(self, corpus, tmp_path):
+        run_processor(corpus, tmp_path / "unbatched")
+        processor = run_processor(corpus, tmp_path / "batched", batch_size=4, batch_max_file_size=1024)
+        assert list((tmp_path / "batched").glob("*.jsonl"))
+        processor._update_latencies()
+        # the email is too large to be batched so it doesn't skew the estimates
+        assert FileType.txt in processor.planner.latencies and FileType.eml not in processor.planner.latencies
+        assert read_outputs(tmp_path / "batched") == read_outputs(tmp_path / "unbatched")
+
+    def test_shards_process_each_file_once(self, corpus, tmp_path):
+        out_dir = tmp_path / "out"
+        shards = [run_processor(corpus, out_dir, shard=(index, 2)) for index in range(2)]
+        stats = [json.loads((out_dir / "_manifest" / f"stats-{shard.shard_tag}.json").read_text()) for shard in shards]
+        assert sum(x["num_files"] for x in stats) == 7
+        assert merge_manifests(out_dir)["num_files"] == 7
+        assert len(read_outputs(out_dir)) == 7
+
+    def test_watch_processes_new_files_once(self, corpus, tmp_path):
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+
+        default = signal.getsignal(signal.SIGTERM)
+
+        def watch(on_start=None) -> Processor:
+            processor = Processor(in_dir=corpus, children_dir=out_dir / "children", out_dir=out_dir, dataset="test", num_workers=2)
+
+            def drive():
+                # the watcher handles SIGTERM once it is watching
+                while signal.getsignal(signal.SIGTERM) is default:
+                    time.sleep(0.05)
+                if on_start is not None:
+                    on_start()
+                # until every file the watcher saw is processed
+                deadline = time.monotonic() + 30
+                while len(read_outputs(out_dir)) < len(list(corpus.iterdir())) and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                time.sleep(0.5)
+                os.kill(os.getpid(), signal.SIGTERM)
+
+            threading.Thread(target=drive, daemon=True).start()
+            processor.watch(quiet_period=0.2, poll_interval=0.1)
+            return processor
+
+        watch(on_start=lambda: (corpus / "new.txt").write_text("new file\n"))
+        assert len(read_outputs(out_dir)) == 8
+        # a restarted watcher skips what was processed
+        processor = watch()
+        stats = json.loads((out_dir / "_manifest" / f"stats-{processor.shard_tag}.json").read_text())
+        assert (stats["num_files"], len(read_outputs(out_dir))) == (0, 8)
+
+    def test_thread_and_process_executors_agree(self, corpus, tmp_path):
+        outputs = []
+        for executor in [ProcessExecutor(), ThreadExecutor()]:
+            out_dir = tmp_path / executor.name
+            run_processor(corpus, out_dir, executor=executor)
+            outputs.append(read_outputs(out_dir))
+        assert len(outputs[0]) == 7
+        assert outputs[0] == outputs[1]
+
+    def test_ray_and_process_executors_agree(self, corpus, tmp_path):
+        ray = pytest.importorskip("ray")
+        try:
+            outputs = []
+            for executor in [ProcessExecutor(), RayExecutor()]:
+                out_dir = tmp_path / executor.name
+                run_processor(corpus, out_dir, executor=executor)
+                # ray workers hash with their own seed, email recipients are a set
+                outputs.append([record | {"recipients": sorted(record.get("recipients", []))} for record in read_outputs(out_dir)])
+        finally:
+            ray.shutdown()
+        assert len(outputs[0]) == 7
+        assert outputs[0] == outputs[1]
+
+    def test_thread_executor_rejects_signals_and_cprofile(self, corpus, tmp_path):
+        with pytest.raises(ValueError, match="SIGALRM"):
+            Processor(in_dir=corpus, children_dir=None, out_dir=tmp_path, dataset="test", executor=ThreadExecutor(), timeout_multiplier=1.0)
+        if sys.version_info >= (3, 12):
+            with pytest.raises(ValueError, match="cProfile"):
+                Processor(in_dir=corpus, children_dir=None, out_dir=tmp_path, dataset="test", executor=ThreadExecutor(), profile="cprofile")